@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+ares_bench
+
+Benchmark of the ARES retrieval pipeline (HBase scan and decoding, DataFrame
+building, FITS conversion and XML index generation), run on the embedded local
+backend of pyares, so that results are reproducible on a single box.
+
+Usage example:
+
+  $ python3 ares_bench.py -w mixed                   # run a predefined workload
+  $ python3 ares_bench.py -w mixed --save-baseline   # store the results as baseline
+  $ python3 ares_bench.py -w mixed --check           # compare with the baseline
+  $ python3 ares_bench.py -w recorded --paramdef data/test_paramdef.csv \\
+                          --paramvalue data/test_paramvalue.dat
+
+The baselines depend on the machine they were measured on, so they are not
+kept in the repository: save one locally before changing the code, and check
+against it afterwards, on the same machine.
+'''
+
+import os, sys
+_filedir_ = os.path.dirname(os.path.abspath(__file__))
+_appsdir_, _ = os.path.split(_filedir_)
+_basedir_, _ = os.path.split(_appsdir_)
+sys.path.insert(0, _basedir_)
+
+import logging
+logger = logging.getLogger()
+
+import argparse
+import json
+import random
+import resource
+import shutil
+import tempfile
+import time
+
+from ares.ares_retrieve.ares_retrieve import Retriever, convert_pids_block
+import ares.pyares as pa
+import pyares.param_pb2 as param_pb2
+from pyares.local_backend import LocalStore, encode_sample, load_test_data, parse_test_time
+from pyares.row_key import decode_row_key
+
+VERSION = '0.0.1'
+
+__author__ = "J C Gonzalez"
+__version__ = VERSION
+__status__ = "Development"
+
+# Directory of the JSON baselines, one file per workload (local, not versioned)
+BaselinesDir = os.path.join(_filedir_, 'baselines')
+
+# Start of the synthetic samples: 2018.359 12:00:00
+StartDate = (2018, 359, 12, 0, 0, 0)
+
+# Predefined workloads: number of parameters, samples per parameter, sampling
+# period (s), type mix (type name: weight) and number of PIDs per file
+Workloads = {
+    'small':   {'pids': 20,   'samples': 1000,  'period': 1.0, 'block': 10,
+                'types': {'DOUBLE': 1}},
+    'mixed':   {'pids': 100,  'samples': 3600,  'period': 1.0, 'block': 50,
+                'types': {'DOUBLE': 4, 'FLOAT': 1, 'SINT': 2, 'UTINYINT': 1, 'BIT': 1,
+                          'STRING': 1, 'DATETIME': 1}},
+    'wide':    {'pids': 1000, 'samples': 100,   'period': 30.0, 'block': 250,
+                'types': {'DOUBLE': 3, 'SINT': 1, 'STRING': 1}},
+    'deep':    {'pids': 4,    'samples': 86400, 'period': 1.0, 'block': 4,
+                'types': {'DOUBLE': 1, 'SINT': 1, 'STRING': 1, 'DATETIME': 1}},
+    'strings': {'pids': 50,   'samples': 2000,  'period': 1.0, 'block': 25,
+                'types': {'STRING': 3, 'DATETIME': 1}},
+    'recorded': None,
+}
+
+# Stages shorter than this in the baseline (s) are too noisy to be compared
+MinCheckedTime = 0.05
+
+# Stages of the pipeline, in order
+Stages = ('decode', 'dataframe', 'convert', 'xml')
+
+
+def configureLogs(level=logging.INFO):
+    logger.setLevel(level)
+    c_handler = logging.StreamHandler()
+    c_handler.setLevel(level)
+    c_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname).1s %(module)s:%(lineno)d %(message)s'))
+    logger.addHandler(c_handler)
+    # keep the per-table messages of the Retriever out of the report
+    logging.getLogger('ares').setLevel(logging.WARNING)
+
+
+def getArgs():
+    '''
+    Parse arguments from command line
+
+    :return: args structure
+    '''
+    parser = argparse.ArgumentParser(description='Benchmark of the ARES retrieval pipeline')
+    parser.add_argument('-w', '--workload', dest='workload', default='mixed', choices=sorted(Workloads),
+                        help='Workload to run (default:mixed)')
+    parser.add_argument('-n', '--pids', dest='pids', type=int, default=None,
+                        help='Override the number of parameters of the workload')
+    parser.add_argument('-s', '--samples', dest='samples', type=int, default=None,
+                        help='Override the number of samples per parameter of the workload')
+    parser.add_argument('-b', '--block', dest='block', type=int, default=None,
+                        help='Override the number of PIDs per file of the workload')
+    parser.add_argument('-o', '--format', dest='file_type', default='fits',
+                        help='Format of the output files (default:fits)')
+    parser.add_argument('--bulk', dest='bulk_scans', action='store_true', default=None,
+                        help='Scan each block of consecutive PIDs in a single pass')
+    parser.add_argument('-r', '--repeat', dest='repeat', type=int, default=3,
+                        help='Number of runs of each stage, the best one is reported (default:3)')
+    parser.add_argument('--paramdef', dest='paramdef', default=None,
+                        help='Parameter definitions file of the recorded workload')
+    parser.add_argument('--paramvalue', dest='paramvalue', default=None,
+                        help='Parameter samples file of the recorded workload')
+    parser.add_argument('--seed', dest='seed', type=int, default=12345,
+                        help='Seed of the synthetic samples')
+    parser.add_argument('--workdir', dest='workdir', default=None,
+                        help='Directory for the local store and the output files (default: temporary)')
+    parser.add_argument('--json', dest='json_file', default=None,
+                        help='Write the results to this JSON file')
+    parser.add_argument('--save-baseline', dest='save_baseline', action='store_true',
+                        help='Store the results as the baseline of the workload')
+    parser.add_argument('--check', dest='check', action='store_true',
+                        help='Compare the results with the baseline of the workload, fail on regressions')
+    parser.add_argument('--tolerance', dest='tolerance', type=float, default=0.25,
+                        help='Allowed throughput loss with respect to the baseline (default:0.25)')
+    return parser.parse_args()
+
+
+def peak_rss_mb():
+    '''
+    Peak resident set size of the process, in MB
+    '''
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kB in Linux, bytes in macOS
+    return rss / 1024.0 if sys.platform != 'darwin' else rss / (1024.0 * 1024.0)
+
+
+def synthetic_value(type_name, i, t, rnd):
+    '''
+    Value of the i-th synthetic sample of a parameter of a given type
+    '''
+    if type_name == 'BIT':
+        return i % 2
+    if type_name in ('DOUBLE', 'FLOAT'):
+        return rnd.gauss(0.0, 1.0)
+    if type_name == 'STRING':
+        return 'STATE_{}'.format(rnd.randrange(8))
+    if type_name == 'DATETIME':
+        return '{:.6f}'.format(t / 1e6)
+    if type_name in ('UTINYINT', 'STINYINT'):
+        return rnd.randrange(100)
+    return rnd.randrange(-100000, 100000)
+
+
+def build_synthetic_store(store, workload, seed, syselem='TM'):
+    '''
+    Fill a local store with the synthetic parameters and samples of a workload
+
+    :return: Tuple (start timestamp, end timestamp, total size of the sample buffers in bytes)
+    '''
+    rnd = random.Random(seed)
+    type_names = [t for t, weight in sorted(workload['types'].items()) for _ in range(weight)]
+    start = parse_test_time('{:04d}-{:03d}T{:02d}:{:02d}:{:02d}'.format(*StartDate[:5]))
+    period = int(workload['period'] * 1e6)
+
+    params = []
+    nbytes = 0
+    for pid in range(1, workload['pids'] + 1):
+        type_name = type_names[(pid - 1) % len(type_names)]
+        params.append({'PID': pid, 'NAME': 'BENCH{:06d}'.format(pid), 'SYSTEM_ELEMENT': syselem,
+                       'DESCRIPTION': 'Benchmark parameter', 'ENGVALUNIT': '',
+                       'DATACATEGORY_str': type_name})
+        sam_type = param_pb2.Type.Value(type_name)
+        rows = [encode_sample(pid, start + i * period, sam_type,
+                              synthetic_value(type_name, i, start + i * period, rnd))
+                for i in range(workload['samples'])]
+        nbytes += sum(len(buf) for key, buf in rows)
+        store.put_samples(rows)
+    store.put_params(params)
+    return (start, start + workload['samples'] * period, nbytes)
+
+
+def build_recorded_store(store, paramdef, paramvalue):
+    '''
+    Fill a local store with the recorded parameters and samples of the test data files
+
+    :return: Tuple (start timestamp, end timestamp, total size of the sample buffers in bytes, workload)
+    '''
+    pids = load_test_data(store, paramdef, paramvalue)
+    rows = store.get_connection().execute("SELECT ROWKEY, VALUE FROM PARAM_SAMPLES").fetchall()
+    times = [decode_row_key(row['ROWKEY'])[1] for row in rows]
+    nbytes = sum(len(row['VALUE']) for row in rows)
+    workload = {'pids': len(pids), 'samples': len(rows) // max(1, len(pids)), 'block': len(pids),
+                'period': None, 'types': None}
+    return (min(times), max(times) + 1, nbytes, workload)
+
+
+def write_config(workdir, store_file):
+    '''
+    Write the pyares configuration using the local backend
+    '''
+    ini_file = os.path.join(workdir, 'bench_conf.ini')
+    with open(ini_file, 'w') as fini:
+        fini.write('[PyAres]\njob_dir = {}\nbackend = local\n\n'.format(workdir) +
+                   '[HBase]\nhost = localhost\nport = 9090\ndataspace = BENCH\n\n' +
+                   '[Local]\nstore_file = {}\n\n[Cache]\n'.format(store_file))
+    return ini_file
+
+
+def to_date_tuple(timestamp):
+    '''
+    Convert a timestamp in microseconds to the (Y, DOY, h, m, s, ms) tuple of the Retriever
+    '''
+    tm = time.gmtime(timestamp // 1000000)
+    return (tm.tm_year, tm.tm_yday, tm.tm_hour, tm.tm_min, tm.tm_sec, (timestamp // 1000) % 1000)
+
+
+def timed(fn, repeat):
+    '''
+    Run a function several times, and get the best elapsed time and the last result
+    '''
+    best, result = None, None
+    for _ in range(max(1, repeat)):
+        t0 = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return (best, result)
+
+
+def run_benchmark(args, workdir):
+    '''
+    Run the stages of the pipeline for a workload
+
+    :return: dictionary with the results
+    '''
+    store_file = os.path.join(workdir, 'bench_store.db')
+    if os.path.exists(store_file):
+        os.remove(store_file)
+    store = LocalStore(store_file)
+
+    t0 = time.perf_counter()
+    if args.workload == 'recorded':
+        if not (args.paramdef and args.paramvalue):
+            raise ValueError('The recorded workload needs --paramdef and --paramvalue')
+        start, end, nbytes, workload = build_recorded_store(store, args.paramdef, args.paramvalue)
+    else:
+        workload = dict(Workloads[args.workload])
+        for key in ('pids', 'samples', 'block'):
+            if getattr(args, key) is not None:
+                workload[key] = getattr(args, key)
+        start, end, nbytes = build_synthetic_store(store, workload, args.seed)
+    load_time = time.perf_counter() - t0
+
+    os.environ['PYARES_INI_FILE'] = write_config(workdir, store_file)
+    provider = pa.init_param_sampleprovider()
+    provider.set_system_element_as_any()
+
+    outdir = os.path.join(workdir, 'out')
+    os.makedirs(outdir, exist_ok=True)
+    retriever = Retriever(cfg_file=os.environ['PYARES_INI_FILE'], rqst_mode='pid',
+                          from_pid=1, to_pid=workload['pids'], pids_block=workload['block'],
+                          from_date=to_date_tuple(start), to_date=to_date_tuple(end),
+                          output_dir=outdir, file_type=args.file_type, bulk_scans=args.bulk_scans)
+    retriever.set_scan_mode(provider)
+
+    blocks = list(retriever.pid_blocks())
+    stages = {}
+
+    # Stage 1: scan and decoding of the samples of all the blocks
+    rss0 = peak_rss_mb()
+    decode_time, fetched = timed(lambda: [retriever.fetch_pids_block(provider, i_pid, j_pid)
+                                          for nfile, i_pid, j_pid in blocks], args.repeat)
+    nsamples = sum(len(columns) for param_names, samples in fetched for columns in samples)
+    stages['decode'] = {'time': decode_time, 'samples': nsamples, 'bytes': nbytes,
+                        'peak_rss_mb': peak_rss_mb(), 'rss_growth_mb': peak_rss_mb() - rss0}
+
+    # Stage 2: wide DataFrame of the first block
+    try:
+        import pandas
+        names = fetched[0][0]
+        rss0 = peak_rss_mb()
+        df_time, df = timed(lambda: provider.get_parameter_data_df(names, start, end), args.repeat)
+        df_samples = sum(len(columns) for columns in fetched[0][1])
+        stages['dataframe'] = {'time': df_time, 'samples': df_samples, 'bytes': int(df.memory_usage(deep=True).sum()),
+                               'peak_rss_mb': peak_rss_mb(), 'rss_growth_mb': peak_rss_mb() - rss0}
+    except ImportError:
+        logger.warning('pandas not available, skipping the dataframe stage')
+
+    # Stage 3: conversion of the blocks to output files
+    def convert():
+        retriever.xmlParams, retriever.xmlProds, retriever.xmlCont = ([], [], [])
+        invalid, files = ({}, [])
+        for (nfile, i_pid, j_pid), (param_names, samples) in zip(blocks, fetched):
+            base_name, file_name = retriever.block_file_name(i_pid, j_pid)
+            results = convert_pids_block(samples, param_names, i_pid, j_pid, workload['block'],
+                                         nfile, file_name, args.file_type)
+            retriever.add_block_results(nfile, i_pid, j_pid, base_name, file_name, results, invalid, files)
+        return files
+
+    rss0 = peak_rss_mb()
+    conv_time, files = timed(convert, args.repeat)
+    stages['convert'] = {'time': conv_time, 'samples': nsamples,
+                         'bytes': sum(os.path.getsize(f) for f in files),
+                         'peak_rss_mb': peak_rss_mb(), 'rss_growth_mb': peak_rss_mb() - rss0}
+
+    # Stage 4: XML index
+    rss0 = peak_rss_mb()
+    xml_time, _ = timed(lambda: retriever.write_xml_index('NOW'), args.repeat)
+    stages['xml'] = {'time': xml_time, 'samples': nsamples, 'bytes': 0,
+                     'peak_rss_mb': peak_rss_mb(), 'rss_growth_mb': peak_rss_mb() - rss0}
+
+    for stage in stages.values():
+        stage['samples_per_s'] = stage['samples'] / stage['time'] if stage['time'] > 0 else 0.0
+        stage['mb_per_s'] = stage['bytes'] / 1e6 / stage['time'] if stage['time'] > 0 else 0.0
+
+    total = sum(stage['time'] for stage in stages.values())
+    return {'workload': args.workload,
+            'parameters': workload,
+            'file_type': args.file_type,
+            'samples': nsamples,
+            'load_time': load_time,
+            'total_time': total,
+            'total_samples_per_s': nsamples / total if total > 0 else 0.0,
+            'peak_rss_mb': peak_rss_mb(),
+            'stages': stages,
+            'python': sys.version.split()[0],
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def report(results):
+    '''
+    Show the results of a run
+    '''
+    logger.info('-' * 78)
+    logger.info('Workload {} ({} samples, {} output)'.format(results['workload'], results['samples'],
+                                                            results['file_type']))
+    logger.info('{:<10s} {:>10s} {:>7s} {:>14s} {:>10s} {:>12s}'
+                .format('Stage', 'Time (s)', '%', 'Samples/s', 'MB/s', 'Peak RSS MB'))
+    for name in Stages:
+        stage = results['stages'].get(name)
+        if stage is None:
+            continue
+        share = 100.0 * stage['time'] / results['total_time'] if results['total_time'] > 0 else 0.0
+        logger.info('{:<10s} {:>10.4f} {:>7.1f} {:>14.0f} {:>10.2f} {:>12.1f}'
+                    .format(name, stage['time'], share, stage['samples_per_s'], stage['mb_per_s'],
+                            stage['peak_rss_mb']))
+    logger.info('{:<10s} {:>10.4f} {:>7.1f} {:>14.0f}'.format('total', results['total_time'], 100.0,
+                                                             results['total_samples_per_s']))
+    logger.info('-' * 78)
+
+
+def baseline_file(results):
+    return os.path.join(BaselinesDir, '{}_{}.json'.format(results['workload'], results['file_type']))
+
+
+def check_baseline(results, tolerance):
+    '''
+    Compare the throughput of each stage with the baseline of the workload
+
+    :return: List with the stages slower than the baseline by more than the tolerance
+    '''
+    if not os.path.exists(baseline_file(results)):
+        raise ValueError('No baseline for workload {} ({} output), create it with --save-baseline'
+                         .format(results['workload'], results['file_type']))
+    with open(baseline_file(results)) as fbase:
+        baseline = json.load(fbase)
+    regressions = []
+    for name in Stages:
+        stage, base = results['stages'].get(name), baseline['stages'].get(name)
+        if stage is None or base is None or base['samples_per_s'] <= 0:
+            continue
+        if base['time'] < MinCheckedTime:
+            logger.info('{:<10s} too short to be compared'.format(name))
+            continue
+        ratio = stage['samples_per_s'] / base['samples_per_s']
+        logger.info('{:<10s} {:>6.2f}x baseline'.format(name, ratio))
+        if ratio < 1.0 - tolerance:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    '''
+    Main program
+    '''
+    configureLogs()
+    args = getArgs()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='ares_bench_')
+    try:
+        results = run_benchmark(args, workdir)
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+    report(results)
+
+    if args.json_file:
+        with open(args.json_file, 'w') as fjson:
+            json.dump(results, fjson, indent=2)
+
+    if args.save_baseline:
+        os.makedirs(BaselinesDir, exist_ok=True)
+        with open(baseline_file(results), 'w') as fbase:
+            json.dump(results, fbase, indent=2)
+        logger.info('Baseline saved in {}'.format(baseline_file(results)))
+
+    if args.check:
+        regressions = check_baseline(results, args.tolerance)
+        if regressions:
+            logger.error('Throughput regression in: {}'.format(', '.join(regressions)))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -83,6 +83,23 @@ def getArgs():
                         default=100, help='Maximum number of PIDs per file')
     parser.add_argument('-e', '--sys_elem', dest='sys_elem', default='TM',
                         help='Set System Element (default:TM)')
+    parser.add_argument('-u', '--update', dest='update_xml', default=None,
+                        help='XML index of an existing product to update with the samples after its end')
+    parser.add_argument('-d', '--delta', dest='delta', action='store_true',
+                        help='When updating, write the new samples to delta files instead of appending them')
+    parser.add_argument('-o', '--format', dest='file_type', default='fits',
+                        choices=['fits', 'parquet', 'arrow', 'feather', 'hdf5'],
+                        help='Format of the output files (default:fits)')
+    parser.add_argument('-b', '--bulk', dest='bulk_scans', action='store_true', default=None,
+                        help='Scan each block of consecutive PIDs in a single pass')
+    parser.add_argument('-V', '--valid-only', dest='valid_only', action='store_true',
+                        help='Retrieve only the valid samples')
+    parser.add_argument('-w', '--scan-workers', dest='scan_workers', type=int, default=None,
+                        help='Number of parameters scanned concurrently (default: config. file, 1 for serial scans)')
+    parser.add_argument('-p', '--pipeline-depth', dest='pipeline_depth', type=int, default=0,
+                        help='Number of PID blocks retrieved in advance while the previous ones are converted')
+    parser.add_argument('-j', '--conv-procs', dest='conv_procs', type=int, default=0,
+                        help='Number of processes converting PID blocks at the same time')
 
     return parser.parse_args()
 
@@ -117,8 +134,16 @@ def main():
                           pids_block=args.num_pids_per_file,
                           from_date=tuple(fromDate), to_date=tuple(toDate),
                           output_dir='./', file_tpl=filename_tpl,
-                          sys_elem=args.sys_elem)
-    retr_time_total, conv_time_total, full_time_total, param_names_invalid, gen_files = retriever.run()
+                          file_type=args.file_type, sys_elem=args.sys_elem,
+                          bulk_scans=args.bulk_scans, valid_only=args.valid_only,
+                          scan_workers=args.scan_workers, pipeline_depth=args.pipeline_depth,
+                          conv_procs=args.conv_procs)
+    if args.update_xml:
+        mode = 'delta' if args.delta else 'append'
+        retr_time_total, conv_time_total, full_time_total, param_names_invalid, gen_files = \
+            retriever.run_incremental(args.update_xml, mode)
+    else:
+        retr_time_total, conv_time_total, full_time_total, param_names_invalid, gen_files = retriever.run()
 
     logger.info('Generated files:')
     for file in gen_files:
@@ -31,15 +31,23 @@ from astropy.io import fits
 from utime.utime import *
 
 import ares.pyares as pa
+from pyares.sample_filter import SampleFilter
 #import pandas as pd
 import numpy as np
 #import fitsio
 #import matplotlib.pyplot as plt
 
 import os, sys, errno
+import re
 import argparse
 import time
 import gzip
+import queue
+import threading
+import multiprocessing
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
 import logging
 
@@ -177,6 +185,362 @@ def gzip_file(src_path, dst_path):
     os.remove(src_path)
 
 
+def datestr_array(values):
+    '''
+    Vectorized version of unix_ms_to_datestr: convert an array of DateTime values
+    (seconds from Unix Epoch 0, as strings) to date strings
+
+    :param values: Array with the DateTime values
+    :return: Array of strings in the format YYYY-MM-DD hh:mm:ss.ffffff
+    '''
+    strs = np.asarray(values).astype(np.str_)
+    strs[strs == ''] = '0'
+    usecs = np.round(strs.astype(np.float64) * 1e6).astype(np.int64)
+    datestrs = np.datetime_as_string(usecs.astype('datetime64[us]'), unit='us')
+    return np.char.replace(datestrs, 'T', ' ')
+
+
+def columns_values(columns):
+    '''
+    Get the values of a SampleColumns object ready to be stored: DateTime values are
+    converted to strings, and strings to a fixed-width UTF-8 byte string buffer
+
+    :param columns: SampleColumns object
+    :return: Tuple (values array, ARES type of the stored values)
+    '''
+    var_type = columns.get_type()
+    values = columns.get_value()
+    if var_type == DateTimeType:
+        values = datestr_array(values)
+        var_type = StringType
+    if var_type == StringType:
+        values = np.char.encode(np.asarray(values).astype(np.str_), 'utf-8')
+    return (values, var_type)
+
+
+def bytes_values(values):
+    '''
+    Get the values of a string-like array (bytes, str or any object) as a fixed-width
+    byte string array, encoding the non-bytes values as UTF-8
+
+    :param values: NumPy array of kind 'S', 'U' or 'O'
+    :return: NumPy array of kind 'S'
+    '''
+    if values.dtype.kind == 'S':
+        return values
+    if values.dtype.kind == 'U':
+        return np.char.encode(values, 'utf-8')
+    return np.array([v if isinstance(v, bytes) else str(v).encode('utf-8') for v in values.tolist()],
+                    dtype=np.bytes_)
+
+
+def hdf5_group_name(param_name):
+    '''
+    Get the name of the HDF5 group of a parameter, escaping the characters with a meaning
+    in HDF5 paths ('/' would create nested groups), so that it can be unescaped with
+    urllib.parse.unquote
+
+    :param param_name: Name of the parameter
+    :return: String group name
+    '''
+    return param_name.replace('%', '%25').replace('/', '%2F')
+
+
+def sample_columns_to_hdu(columns):
+    '''
+    Build the binary table with the samples of a parameter, directly from the
+    typed NumPy arrays of its SampleColumns. String values are stored in a
+    fixed-width byte string buffer, and DateTime values are converted to strings.
+
+    :param columns: SampleColumns object
+    :return: Tuple (BinTableHDU, FITS format of the values), (None, None) if there are no samples
+    '''
+    if len(columns) == 0:
+        return (None, None)
+
+    values, var_type = columns_values(columns)
+    type_conv = Ares2FitsConversion[str(var_type)]
+    if var_type == StringType:
+        size_fld = values.dtype.itemsize
+        type_conv = type_conv.format(size_fld if size_fld > 0 else 1)
+
+    hdu = fits.BinTableHDU.from_columns([fits.Column(name='TIMESTAMP',
+                                                     array=columns.get_time(),
+                                                     format='K'),
+                                         fits.Column(name=columns.get_name(),
+                                                     array=values,
+                                                     format=type_conv)])
+    return (hdu, type_conv)
+
+
+class FitsBlockWriter(object):
+    '''
+    Writes the samples of a block of parameters as a multi-table FITS file,
+    with a binary table (TIMESTAMP, value) per parameter
+    '''
+
+    extension = '.fits'
+
+    def write(self, samples, param_names, i_pid, j_pid, file_name):
+        '''
+        Write the samples of a block of parameters to a file
+
+        :param samples: List with the SampleColumns of each parameter of the block
+        :param param_names: Names of the parameters of the block
+        :param i_pid: First PID of the block
+        :param j_pid: Last PID of the block
+        :param file_name: File to (re)create
+        :return: List with (position, SampleColumns, stored type) of each table written
+        '''
+        # Build initial primary HDU for FITS file
+        hdul = Retriever.fits_build_hdr(i_pid, j_pid)
+        tables = []
+        for i, columns in enumerate(samples, start=1):
+            t, type_conv = sample_columns_to_hdu(columns)
+            if t is not None:
+                hdul.append(t)
+                tables.append((i, columns, type_conv))
+
+        # Remove FITS file if exists, and (re)create it
+        Retriever.save_to_fits(hdul, file_name)
+        return tables
+
+
+class ArrowBlockWriter(object):
+    '''
+    Writes the samples of a block of parameters as an Arrow IPC (Feather v2) file,
+    with a record batch per parameter, so that it can be memory mapped without copies.
+    All the batches share the schema (PID, TIMESTAMP, VALIDITY, VALUE_INT, VALUE_REAL,
+    VALUE_STR), only the VALUE column matching the parameter type is filled.
+    '''
+
+    extension = '.arrow'
+
+    def write(self, samples, param_names, i_pid, j_pid, file_name):
+        import pyarrow
+
+        silent_remove(file_name)
+        tables = []
+        schema = self.schema()
+        with pyarrow.OSFile(file_name, 'wb') as sink:
+            writer = pyarrow.RecordBatchFileWriter(sink, schema)
+            for i, columns, batch, arrow_type in self.record_batches(samples, schema):
+                writer.write_batch(batch)
+                tables.append((i, columns, arrow_type))
+            writer.close()
+        return tables
+
+    @staticmethod
+    def schema():
+        import pyarrow
+
+        return pyarrow.schema([pyarrow.field('PID', pyarrow.int32()),
+                               pyarrow.field('TIMESTAMP', pyarrow.int64()),
+                               pyarrow.field('VALIDITY', pyarrow.uint8()),
+                               pyarrow.field('VALUE_INT', pyarrow.int64()),
+                               pyarrow.field('VALUE_REAL', pyarrow.float64()),
+                               pyarrow.field('VALUE_STR', pyarrow.binary())])
+
+    @staticmethod
+    def record_batches(samples, schema):
+        '''
+        Convert the SampleColumns of a block into record batches with the common schema
+
+        :return: Generator of (position, SampleColumns, batch, name of the filled VALUE column)
+        '''
+        import pyarrow
+
+        value_fields = ('VALUE_INT', 'VALUE_REAL', 'VALUE_STR')
+        for i, columns in enumerate(samples, start=1):
+            n = len(columns)
+            if n == 0:
+                continue
+            values, var_type = columns_values(columns)
+            # the column is chosen by the kind of the values, not by the type code
+            # (e.g. unknown, job and log values are kept as objects)
+            kind = values.dtype.kind
+            if kind in 'OUS':
+                field = 'VALUE_STR'
+                values = pyarrow.array(bytes_values(values).tolist(), type=pyarrow.binary())
+            elif kind == 'f':
+                field = 'VALUE_REAL'
+                values = pyarrow.array(values.astype(np.float64))
+            else:
+                field = 'VALUE_INT'
+                values = pyarrow.array(values.astype(np.int64))
+            arrays = [pyarrow.array(np.full(n, columns.get_pid(), dtype=np.int32)),
+                      pyarrow.array(columns.get_time()),
+                      pyarrow.array(columns.get_validity())]
+            for value_field in value_fields:
+                arrays.append(values if value_field == field else
+                              pyarrow.nulls(n, type=schema.field(value_field).type))
+            yield (i, columns, pyarrow.RecordBatch.from_arrays(arrays, schema.names), field)
+
+
+class ParquetBlockWriter(object):
+    '''
+    Writes the samples of a block of parameters as a compressed Parquet file, with the
+    schema of ArrowBlockWriter and a row group per parameter
+    '''
+
+    extension = '.parquet'
+
+    def __init__(self, compression='snappy'):
+        self.compression = compression
+
+    def write(self, samples, param_names, i_pid, j_pid, file_name):
+        import pyarrow
+        import pyarrow.parquet as pq
+
+        silent_remove(file_name)
+        tables = []
+        schema = ArrowBlockWriter.schema()
+        writer = pq.ParquetWriter(file_name, schema, compression=self.compression)
+        try:
+            for i, columns, batch, arrow_type in ArrowBlockWriter.record_batches(samples, schema):
+                # each table written is stored as (at least) one row group
+                writer.write_table(pyarrow.Table.from_batches([batch]))
+                tables.append((i, columns, arrow_type))
+        finally:
+            writer.close()
+        return tables
+
+
+class HDF5BlockWriter(object):
+    '''
+    Writes the samples of a block of parameters as an HDF5 file, with a group per
+    parameter holding the compressed TIMESTAMP, VALUE and VALIDITY datasets. The group
+    is named after the parameter (see hdf5_group_name), which is also kept in its NAME
+    attribute
+    '''
+
+    extension = '.h5'
+
+    def __init__(self, compression='gzip'):
+        self.compression = compression
+
+    def write(self, samples, param_names, i_pid, j_pid, file_name):
+        import h5py
+
+        silent_remove(file_name)
+        tables = []
+        with h5py.File(file_name, 'w') as h5:
+            h5.attrs['COMMENT'] = 'File contains data for PIDs in range {}:{}'.format(i_pid, j_pid)
+            for i, columns in enumerate(samples, start=1):
+                if len(columns) == 0:
+                    continue
+                values, var_type = columns_values(columns)
+                if values.dtype.kind in 'OU':
+                    values = bytes_values(values)
+                grp = h5.create_group(hdf5_group_name(columns.get_name()))
+                grp.attrs['NAME'] = columns.get_name()
+                grp.attrs['PID'] = columns.get_pid()
+                grp.attrs['TYPE'] = var_type
+                grp.create_dataset('TIMESTAMP', data=columns.get_time(), compression=self.compression)
+                grp.create_dataset('VALUE', data=values, compression=self.compression)
+                grp.create_dataset('VALIDITY', data=columns.get_validity(), compression=self.compression)
+                tables.append((i, columns, values.dtype.str))
+        return tables
+
+
+# Writers available for the file_type of the Retriever
+BlockWriters = {
+    'fits': FitsBlockWriter,
+    'parquet': ParquetBlockWriter,
+    'arrow': ArrowBlockWriter,
+    'feather': ArrowBlockWriter,
+    'hdf5': HDF5BlockWriter,
+}
+
+
+def convert_pids_block(samples, param_names, i_pid, j_pid, pid_blk, nfile, file_name, file_type='fits'):
+    '''
+    Convert the sample columns of a block of PIDs to tables, and save them in a file
+    of the given type. This is a module level function, so that it can run in a process pool.
+
+    :param samples: List with the SampleColumns of each parameter of the block
+    :param param_names: Names of the parameters of the block
+    :param i_pid: First PID of the block
+    :param j_pid: Last PID of the block
+    :param pid_blk: Block size
+    :param nfile: Index of the file in the XML index
+    :param file_name: File to (re)create
+    :param file_type: Key of the writer in BlockWriters
+    :return: XML index HDU and Param sections, and the parameters that could not be converted
+    '''
+    for i, columns in enumerate(samples, start=1):
+        if columns.get_name() != param_names[i - 1]:
+            logger.warning("ERROR: Param. name does not match with expectation!")
+
+    tables = BlockWriters[file_type]().write(samples, param_names, i_pid, j_pid, file_name)
+
+    xml_hdus = []
+    xml_params = []
+    written = set()
+    for i, columns, type_conv in tables:
+        pid = columns.get_pid()
+        var_name = columns.get_name()
+        logger.info('Generating table {} of {} for PID {} - {} (type={})'
+                     .format(i, pid_blk, pid, var_name, columns.get_type()))
+        written.add(i)
+
+        # Generate XML index section
+        xml_hdus.append(XMLTemplates['HDU'].format(i, pid, var_name, type_conv))
+        xml_params.append(XMLTemplates['Param'].format(pid, var_name, type_conv, nfile, i))
+
+    param_names_invalid = {str(columns.get_pid()): param_names[i - 1]
+                           for i, columns in enumerate(samples, start=1) if i not in written}
+
+    return (xml_hdus, xml_params, param_names_invalid)
+
+def read_xml_index(xml_file):
+    '''
+    Read the XML index of an existing HKTM product, as generated by the Retriever
+
+    :param xml_file: Path of the EUC_SOC_HKTM_*.xml file
+    :return: Dictionary with the PID range ('from_pid', 'to_pid'), the 'products'
+             (each one with 'index', 'id', 'from_pid', 'to_pid' and the list of 'hdus',
+             each one with 'index', 'pid', 'name' and 'type') and the data 'files'
+    '''
+    with open(xml_file) as fxml:
+        xml = fxml.read()
+
+    products = []
+    for prod in re.finditer(r'<Product index="(\d+)" id="([^"]*)" fromPID="(\d+)" toPID="(\d+)">(.*?)</Product>',
+                            xml, re.DOTALL):
+        hdus = [{'index': int(hdu.group(1)), 'pid': int(hdu.group(2)),
+                 'name': hdu.group(3), 'type': hdu.group(4)}
+                for hdu in re.finditer(r'<HDU index="(\d+)" pid="(\d+)" paramName="([^"]*)" type="([^"]*)"/>',
+                                       prod.group(5))]
+        products.append({'index': int(prod.group(1)), 'id': prod.group(2),
+                         'from_pid': int(prod.group(3)), 'to_pid': int(prod.group(4)),
+                         'hdus': hdus})
+
+    return {'from_pid': int(re.search(r'<FromPID>(\d+)</FromPID>', xml).group(1)),
+            'to_pid': int(re.search(r'<ToPID>(\d+)</ToPID>', xml).group(1)),
+            'products': products,
+            'files': re.findall(r'<FileName>([^<]*)</FileName>', xml)}
+
+
+def append_table_rows(old_hdu, new_hdu):
+    '''
+    Build a binary table with the rows of an existing table followed by the rows
+    of a new one with the same columns. String columns are widened if needed.
+
+    :param old_hdu: Existing BinTableHDU
+    :param new_hdu: BinTableHDU with the rows to append
+    :return: BinTableHDU with all the rows
+    '''
+    columns = []
+    for old_col in old_hdu.columns:
+        array = np.concatenate([old_hdu.data[old_col.name], new_hdu.data[old_col.name]])
+        fmt = str(old_col.format)
+        if array.dtype.kind == 'S':
+            fmt = Ares2FitsConversion[str(StringType)].format(max(array.dtype.itemsize, 1))
+        columns.append(fits.Column(name=old_col.name, array=array, format=fmt))
+    return fits.BinTableHDU.from_columns(columns)
+
+
 #----------------------------------------------------------------------------
 # Class: Retriever
 #----------------------------------------------------------------------------
@@ -208,9 +572,18 @@ class Retriever(object):
                  from_date=None, to_date=None, sys_elem='TM',
                  output_dir='./',
                  file_tpl='ares_%F-%T_%f-%t_%YMD1T%hms1-%YMD2T%hms2',
-                 file_type='fits'):
+                 file_type='fits', scan_workers=None, bulk_scans=None,
+                 pipeline_depth=0, conv_procs=0, valid_only=False):
         '''
         Instance initialization method
+        scan_workers is the number of parameters scanned concurrently (1 means serial
+        scans, default is the setting of the config. file)
+        bulk_scans enables (True) or disables (False) the scan of consecutive PIDs
+        in a single pass (default is the setting of the config. file)
+        pipeline_depth is the number of PID blocks that can be retrieved in advance
+        while the previous ones are converted (0 means no pipelining), and
+        conv_procs the number of processes converting blocks at the same time
+        valid_only drops the samples that are not valid while they are decoded
         '''
         # Define config. file if not set in the local environment
         if cfg_file == None:
@@ -260,6 +633,11 @@ class Retriever(object):
         self.file_tpl = self.create_actual_file_tpl(file_tpl)
         #print(self.generate_filename(self.file_tpl))
         self.file_type = file_type
+        self.scan_workers = scan_workers
+        self.bulk_scans = bulk_scans
+        self.pipeline_depth = pipeline_depth
+        self.conv_procs = conv_procs
+        self.sample_filter = SampleFilter.valid_only() if valid_only else None
 
         self.xmlDateTimeRange = XMLTemplates['DateTimeRange'].format(self.year1, self.doy1,
                                                                      self.hour1, self.min1, self.sec1,
@@ -298,6 +676,8 @@ class Retriever(object):
         '''
         Perform the retrieval of a range of PIDs
         '''
+        if self.pipeline_depth > 0:
+            return self.run_retrieval_pids_pipelined()
 
         # Get start time
         start_time = time.time()
@@ -308,116 +688,157 @@ class Retriever(object):
         # you need to manage this yourself.
         data_provider = pa.init_param_sampleprovider()
         data_provider.set_system_element_as_any()
+        self.set_scan_mode(data_provider)
 
         retr_time_total, conv_time_total = (0, 0)
 
-        keep_retrieving = True
-        i_pid = self.from_pid
-        j_pid = i_pid + self.pid_blk - 1
         param_names_invalid = {}
         gen_files = []
-        var_name = ''
-        var_type = ''
-
-        nfile = 1
 
-        while keep_retrieving:
+        for nfile, i_pid, j_pid in self.pid_blocks():
 
             # Set preparation time stamp
             prep_time = time.time()
 
-            # Get parameter names for the range of parameter ids, and retrieve samples as DataFrame
-            (param_names, param_syselem) = data_provider.get_parameter_names_from_pids(i_pid, j_pid)
-            samples = data_provider.get_parameter_sysel_data_objs(param_names,
-                                                                  param_syselem,
-                                                                  self.timestamp_start,
-                                                                  self.timestamp_end)
+            # Get parameter names for the range of parameter ids, and retrieve samples
+            (param_names, samples) = self.fetch_pids_block(data_provider, i_pid, j_pid)
 
             # Set retrieval time stamp
             retr_time = time.time()
 
-            # Currently only FITS files are generated
+            base_name, file_name = self.block_file_name(i_pid, j_pid)
+            results = convert_pids_block(samples, param_names, i_pid, j_pid,
+                                         self.pid_blk, nfile, file_name, self.file_type)
+            self.add_block_results(nfile, i_pid, j_pid, base_name, file_name, results,
+                                   param_names_invalid, gen_files)
 
-            # Build initial primary HDU for FITS file
-            hdul = self.fits_build_hdr(i_pid, j_pid)
-
-            # Convert sample columns to binary tables
-            i = 0
-            pid = i_pid
+            end_time = time.time()
 
-            for column in samples:
+            retr_time_total = retr_time_total + (retr_time - prep_time)
+            conv_time_total = conv_time_total + (end_time - retr_time)
 
-                # Loop on samples to add values to the resulting vectors
-                time_stamps = []
-                values = []
-                start = True
+        full_time_total = end_time - start_time
 
-                for s in column:
-                    if start:
-                        var_name = s.get_name()
-                        var_type = s.get_type()
-                        if var_name != param_names[i]:
-                            logger.warning("ERROR: Param. name does not match with expectation!")
-                        logger.info('Generating table {} of {} for PID {} - {} (type={})'
-                                     .format(i + 1, self.pid_blk, pid, var_name, var_type))
-                        start = False
+        self.log_retrieval_summary(retr_time_total, conv_time_total, full_time_total, param_names_invalid)
+        self.write_xml_index(now_utc_iso())
 
-                    time_stamps.append(s.get_time())
+        return (retr_time_total, conv_time_total, full_time_total, param_names_invalid, gen_files)
 
-                    value = s.get_value()
-                    if var_type == DateTimeType:
-                        value = unix_ms_to_datestr(value)
+    def run_retrieval_pids_pipelined(self):
+        '''
+        Perform the retrieval of a range of PIDs, overlapping the retrieval of the
+        next blocks (in a producer thread, through a queue of pipeline_depth blocks)
+        with the conversion and writing of the current one. If conv_procs > 1, the
+        conversion of several blocks runs at the same time in a pool of processes.
+        '''
 
-                    values.append(value)
+        # Get start time
+        start_time = time.time()
 
-                    if var_type == DateTimeType:
-                        var_type = StringType
+        data_provider = pa.init_param_sampleprovider()
+        data_provider.set_system_element_as_any()
+        self.set_scan_mode(data_provider)
+
+        blocks = queue.Queue(maxsize=self.pipeline_depth)
+        stop = threading.Event()
+
+        def offer(item):
+            # put an item in the queue, unless the consumer has given up
+            while not stop.is_set():
+                try:
+                    blocks.put(item, timeout=1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def produce():
+            try:
+                for nfile, i_pid, j_pid in self.pid_blocks():
+                    prep_time = time.time()
+                    (param_names, samples) = self.fetch_pids_block(data_provider, i_pid, j_pid)
+                    if not offer((nfile, i_pid, j_pid, param_names, samples, time.time() - prep_time)):
+                        return
+                offer(None)
+            except Exception as e:
+                offer(e)
+
+        producer = threading.Thread(target=produce, name='ares_retrieve.producer', daemon=True)
+        producer.start()
 
-                i = i + 1
-                pid = pid + 1
+        retr_time_total, conv_time_total = (0, 0)
+        param_names_invalid = {}
+        gen_files = []
 
-                if start:
-                    param_names_invalid[str(pid - 1)] = param_names[i - 1]
+        # the producer and the scan threads are already running, so the conversion processes are
+        # spawned instead of forked (a forked child could inherit a lock held by one of them)
+        executor = ProcessPoolExecutor(max_workers=self.conv_procs,
+                                       mp_context=multiprocessing.get_context('spawn')) \
+            if self.conv_procs > 1 else None
+        pending = deque()
+
+        def collect():
+            nfile, i_pid, j_pid, base_name, file_name, conv_start, future = pending.popleft()
+            results = future.result()
+            self.add_block_results(nfile, i_pid, j_pid, base_name, file_name, results,
+                                   param_names_invalid, gen_files)
+            return time.time() - conv_start
+
+        try:
+            while True:
+                block = blocks.get()
+                if block is None:
+                    break
+                if isinstance(block, Exception):
+                    raise block
+
+                nfile, i_pid, j_pid, param_names, samples, retr_time = block
+                retr_time_total = retr_time_total + retr_time
+
+                conv_start = time.time()
+                base_name, file_name = self.block_file_name(i_pid, j_pid)
+                if executor is None:
+                    results = convert_pids_block(samples, param_names, i_pid, j_pid,
+                                                 self.pid_blk, nfile, file_name, self.file_type)
+                    self.add_block_results(nfile, i_pid, j_pid, base_name, file_name, results,
+                                           param_names_invalid, gen_files)
+                    conv_time_total = conv_time_total + (time.time() - conv_start)
                     continue
 
-                type_conv = Ares2FitsConversion[str(var_type)]
-                if var_type == StringType:
-                    size_fld = len(max(values, key=len))
-                    type_conv = type_conv.format(size_fld if size_fld > 0 else 1)
-
-                t = fits.BinTableHDU.from_columns([fits.Column(name='TIMESTAMP',
-                                                               array=np.array(time_stamps),
-                                                               format='K'),
-                                                   fits.Column(name=var_name,
-                                                               array=np.array(values),
-                                                               format=type_conv)])
-                hdul.append(t)
+                if len(pending) >= self.conv_procs:
+                    conv_time_total = conv_time_total + collect()
+                future = executor.submit(convert_pids_block, samples, param_names, i_pid, j_pid,
+                                         self.pid_blk, nfile, file_name, self.file_type)
+                pending.append((nfile, i_pid, j_pid, base_name, file_name, conv_start, future))
 
-                # Generate XML index section
-                self.xmlHDUs.append(XMLTemplates['HDU'].format(i, pid-1, var_name, type_conv))
-                self.xmlParams.append(XMLTemplates['Param'].format(pid-1, var_name, type_conv,
-                                                                   nfile, i))
+            while pending:
+                conv_time_total = conv_time_total + collect()
+        finally:
+            stop.set()
+            if executor is not None:
+                executor.shutdown()
+        producer.join()
 
-            # Remove FITS file if exists, and (re)create it
-            self.from_pid_blk, self.to_pid_blk = (i_pid, j_pid)
-            base_name = self.generate_filename(self.file_tpl)
-            file_name = os.path.join(self.outdir, base_name) + '.fits'
-            self.save_to_fits(hdul, file_name)
-            gen_files.append(file_name)
-            logger.info('Saved file {}'.format(file_name))
+        full_time_total = time.time() - start_time
 
-            self.xmlProds.append(XMLTemplates['Prod'].format(nfile, base_name,
-                                                             self.from_pid_blk, self.to_pid_blk,
-                                                             '\n'.join(self.xmlHDUs)))
-            self.xmlCont.append(XMLTemplates['DataCont'].format(base_name + '.fits'))
-            self.xmlHDUs = []
+        self.log_retrieval_summary(retr_time_total, conv_time_total, full_time_total, param_names_invalid)
+        self.write_xml_index(now_utc_iso())
 
-            nfile = nfile + 1
-            end_time = time.time()
+        return (retr_time_total, conv_time_total, full_time_total, param_names_invalid, gen_files)
 
-            retr_time_total = retr_time_total + (retr_time - start_time)
-            conv_time_total = conv_time_total + (end_time - retr_time)
+    def pid_blocks(self):
+        '''
+        Generate the blocks of PIDs of the retrieval, as (file number, first PID, last PID)
+        '''
+        keep_retrieving = True
+        i_pid = self.from_pid
+        j_pid = i_pid + self.pid_blk - 1
+        nfile = 1
+
+        while keep_retrieving:
+            yield (nfile, i_pid, j_pid)
 
+            nfile = nfile + 1
             i_pid = j_pid + 1
             j_pid = i_pid + self.pid_blk - 1
             if j_pid > self.to_pid:
@@ -425,8 +846,61 @@ class Retriever(object):
 
             keep_retrieving = (i_pid < self.to_pid)
 
-        full_time_total = end_time - start_time
+    def block_writer(self):
+        '''
+        Get the writer of the output files, for the file type of the Retriever
+        '''
+        if self.file_type not in BlockWriters:
+            raise ValueError('Unknown output file type {}, must be one of {}'
+                             .format(self.file_type, ', '.join(sorted(BlockWriters))))
+        return BlockWriters[self.file_type]()
+
+    def file_extension(self):
+        '''
+        Get the extension of the output files, for the file type of the Retriever
+        '''
+        return self.block_writer().extension
+
+    def fetch_pids_block(self, data_provider, i_pid, j_pid):
+        '''
+        Get parameter names for a range of parameter ids, and retrieve their samples
+        '''
+        (param_names, param_syselem) = data_provider.get_parameter_names_from_pids(i_pid, j_pid)
+        samples = data_provider.get_parameter_arrays(param_names,
+                                                     self.timestamp_start,
+                                                     self.timestamp_end,
+                                                     param_syselem,
+                                                     sample_filter=self.sample_filter)
+        return (param_names, samples)
+
+    def block_file_name(self, i_pid, j_pid):
+        '''
+        Get the base name and the full path of the file of a block of PIDs
+        '''
+        self.from_pid_blk, self.to_pid_blk = (i_pid, j_pid)
+        base_name = self.generate_filename(self.file_tpl)
+        file_name = os.path.join(self.outdir, base_name) + self.file_extension()
+        return (base_name, file_name)
 
+    def add_block_results(self, nfile, i_pid, j_pid, base_name, file_name, results,
+                          param_names_invalid, gen_files):
+        '''
+        Add the XML index sections of a converted block, and collect its invalid parameters
+        '''
+        xml_hdus, xml_params, invalid = results
+        self.xmlParams.extend(xml_params)
+        param_names_invalid.update(invalid)
+        gen_files.append(file_name)
+        logger.info('Saved file {}'.format(file_name))
+
+        self.xmlProds.append(XMLTemplates['Prod'].format(nfile, base_name, i_pid, j_pid,
+                                                         '\n'.join(xml_hdus)))
+        self.xmlCont.append(XMLTemplates['DataCont'].format(os.path.basename(file_name)))
+
+    def log_retrieval_summary(self, retr_time_total, conv_time_total, full_time_total, param_names_invalid):
+        '''
+        Show the timing of the retrieval and the list of parameters that could not be converted
+        '''
         logger.info("Data retrieval:   {:10.3f} s".format(retr_time_total))
         logger.info("Data conversion:  {:10.3f} s".format(conv_time_total))
         logger.info("Total exec. time: {:10.3f} s".format(full_time_total))
@@ -435,10 +909,13 @@ class Retriever(object):
             for p in param_names_invalid.keys():
                 logger.info('{}: "{}"'.format(p, param_names_invalid[p]))
 
-        # Generate complete XML index file
+    def write_xml_index(self, creation_date):
+        '''
+        Generate complete XML index file
+        '''
         xml_file_tpl = self.create_actual_file_tpl('EUC_SOC_HKTM_%YMD1T%hms1-%YMD2T%hms2')
         base_name = self.generate_filename(xml_file_tpl)
-        xml = XMLTemplates['XML'].format(base_name, now_utc_iso(),
+        xml = XMLTemplates['XML'].format(base_name, creation_date,
                                          self.xmlDateTimeRange, self.xmlPIDRange,
                                          '\n'.join(self.xmlParams),
                                          '\n'.join(self.xmlProds),
@@ -447,8 +924,6 @@ class Retriever(object):
         with open(xml_file, "w") as fxml:
             fxml.write(xml)
 
-        return (retr_time_total, conv_time_total, full_time_total, param_names_invalid, gen_files)
-
     def run_retrieval_names(self):
         '''
         Perform the retrieval of a range of PIDs
@@ -463,89 +938,56 @@ class Retriever(object):
         # you need to manage this yourself.
         data_provider = pa.init_param_sampleprovider()
         data_provider.set_system_element_as_any()
+        self.set_scan_mode(data_provider)
 
         retr_time_total, conv_time_total = (0, 0)
 
         param_names_invalid = {}
         gen_files = []
-        var_name = ''
-        var_type = ''
+
+        # Replace the name patterns (e.g. AOCS_*) by the parameters they match
+        self.param_names, _ = data_provider.expand_parameter_names(self.param_names)
 
         # Set preparation time stamp
         prep_time = time.time()
 
-        # Get parameter names for the range of parameter ids, and retrieve samples as DataFrame
-        (param_pids, param_syselem) = data_provider.get_parameter_pid_sysel_from_names(self.param_names)
-        samples = data_provider.get_parameter_sysel_data_objs(self.param_names,
-                                                              param_syselem,
-                                                              self.timestamp_start,
-                                                              self.timestamp_end)
+        # Retrieve the samples of the parameters, of any system element
+        samples = data_provider.get_parameter_arrays(self.param_names,
+                                                     self.timestamp_start,
+                                                     self.timestamp_end,
+                                                     sample_filter=self.sample_filter)
 
         # Set retrieval time stamp
         retr_time = time.time()
 
         # Convert sample columns to binary tables
         i = 0
-        for column in samples:
+        for columns in samples:
 
             pname = self.param_names[i]
-            pid = param_pids[i]
-
-            # Currently only FITS files are generated
+            pid = columns.get_pid()
 
-            # Build initial primary HDU for FITS file
-            hdul = self.fits_build_hdr(pid, pid)
-
-            # Loop on samples to add values to the resulting vectors
-            time_stamps = []
-            values = []
-            start = True
-
-            for s in column:
-                if start:
-                    var_name = s.get_name()
-                    var_type = s.get_type()
-                    if var_name != pname:
-                        logger.warning("ERROR: Param. name does not match with expectation!")
-                    logger.info('Generating table for PID {} - {} (type={})'
-                                 .format(pid, var_name, var_type))
-                    start = False
-
-                time_stamps.append(s.get_time())
-
-                value = s.get_value()
-                if var_type == DateTimeType:
-                    value = unix_ms_to_datestr(value)
-
-                values.append(value)
-
-                if var_type == DateTimeType:
-                    var_type = StringType
-
-            if start:
-                param_names_invalid[str(pid - 1)] = pname
+            if len(columns) == 0:
+                param_names_invalid[str(pid)] = pname
+                i = i + 1
                 continue
 
-            type_conv = Ares2FitsConversion[str(var_type)]
-            if var_type == StringType:
-                size_fld = len(max(values, key=len))
-                type_conv = type_conv.format(size_fld if size_fld > 0 else 1)
-
-            t = fits.BinTableHDU.from_columns([fits.Column(name='TIMESTAMP',
-                                                           array=np.array(time_stamps),
-                                                           format='K'),
-                                               fits.Column(name=var_name,
-                                                           array=np.array(values),
-                                                           format=type_conv)])
-            hdul.append(t)
-
-            # Remove FITS file if exists, and (re)create it
+            # Remove output file if exists, and (re)create it
             self.from_pid, self.to_pid = (pid, pid)
             self.from_pid_blk, self.to_pid_blk = (pid, pid)
             self.name = pname
             base_name = self.generate_filename(self.file_tpl)
-            file_name = os.path.join(self.outdir, base_name) + '.fits'
-            self.save_to_fits(hdul, file_name)
+            file_name = os.path.join(self.outdir, base_name) + self.file_extension()
+            tables = self.block_writer().write([columns], [pname], pid, pid, file_name)
+            if len(tables) == 0:
+                param_names_invalid[str(pid)] = pname
+                i = i + 1
+                continue
+
+            _, _, type_conv = tables[0]
+            var_name = columns.get_name()
+            logger.info('Generating table for PID {} - {} (type={})'
+                         .format(pid, var_name, columns.get_type()))
             gen_files.append(file_name)
             logger.info('Saved file {}'.format(file_name))
 
@@ -555,7 +997,7 @@ class Retriever(object):
             self.xmlProds.append(XMLTemplates['Prod'].format(i + 1, base_name,
                                                              self.from_pid_blk, self.to_pid_blk,
                                                              '\n'.join(self.xmlHDUs)))
-            self.xmlCont.append(XMLTemplates['DataCont'].format(base_name + '.fits'))
+            self.xmlCont.append(XMLTemplates['DataCont'].format(os.path.basename(file_name)))
             self.xmlHDUs = []
 
             # Go on
@@ -568,28 +1010,162 @@ class Retriever(object):
 
         full_time_total = end_time - start_time
 
-        logger.info("Data retrieval:   {:10.3f} s".format(retr_time_total))
-        logger.info("Data conversion:  {:10.3f} s".format(conv_time_total))
-        logger.info("Total exec. time: {:10.3f} s".format(full_time_total))
-        if len(param_names_invalid) > 0:
-            logger.info("The following parameters could not be converted:")
-            for p in param_names_invalid.keys():
-                logger.info('{}: "{}"'.format(p, param_names_invalid[p]))
+        self.log_retrieval_summary(retr_time_total, conv_time_total, full_time_total, param_names_invalid)
+        self.write_xml_index('NOW')
 
-        # Generate complete XML index file
-        xml_file_tpl = self.create_actual_file_tpl('EUC_SOC_HKTM_%YMD1T%hms1-%YMD2T%hms2')
-        base_name = self.generate_filename(xml_file_tpl)
-        xml = XMLTemplates['XML'].format(base_name, 'NOW',
-                                         self.xmlDateTimeRange, self.xmlPIDRange,
-                                         '\n'.join(self.xmlParams),
-                                         '\n'.join(self.xmlProds),
-                                         '\n'.join(self.xmlCont))
-        xml_file = os.path.join(self.outdir, base_name) + '.xml'
-        with open(xml_file, "w") as fxml:
-            fxml.write(xml)
+        return (retr_time_total, conv_time_total, full_time_total, param_names_invalid, gen_files)
+
+    def run_incremental(self, xml_file, mode='append'):
+        '''
+        Update an existing EUC_SOC_HKTM_* product, instead of retrieving the whole
+        time window again. The last TIMESTAMP of each HDU is read from the product
+        files listed in the XML index, and only the samples after it (and up to the
+        end date of this Retriever) are retrieved. In 'append' mode the new rows are
+        appended to the existing binary tables, in 'delta' mode they are written to
+        a new file per product, referenced by the XML index next to the original one
+        (the Parameter entries keep pointing to the original tables).
+        The new XML index covers from the start date of this Retriever (nominally, the
+        start of the existing product) to its end date.
+        Only the parameters with a table in the existing product are updated: the ones
+        of its PID range without samples when it was generated (so without table) are
+        not picked up, a full retrieval is needed to add them.
+
+        :param xml_file: Path of the XML index of the existing product
+        :param mode: 'append' or 'delta'
+        '''
+        if mode not in ('append', 'delta'):
+            raise ValueError('Unknown incremental mode "{}"'.format(mode))
+        if self.file_type != 'fits':
+            raise ValueError('Incremental mode is only available for FITS products')
+
+        # Get start time
+        start_time = time.time()
+
+        data_provider = pa.init_param_sampleprovider()
+        data_provider.set_system_element_as_any()
+        self.set_scan_mode(data_provider)
+
+        retr_time_total, conv_time_total = (0, 0)
+        param_names_invalid = {}
+        gen_files = []
+
+        index = read_xml_index(xml_file)
+        indir = os.path.dirname(xml_file)
+        self.xmlPIDRange = XMLTemplates['PIDRange'].format(index['from_pid'], index['to_pid'])
+        nfile = 1
+
+        for prod, prod_file in zip(index['products'], index['files']):
+            prep_time = time.time()
+            file_name = os.path.join(indir, prod_file)
+
+            # Last time stamp of each table (the tables follow the order of the HDU entries)
+            with fits.open(file_name) as hdul:
+                last_times = {i: int(hdul[i].data['TIMESTAMP'][-1]) if len(hdul[i].data) > 0 else -1
+                              for i in range(1, len(prod['hdus']) + 1)}
+
+            if len(last_times) == 0:
+                continue
+
+            # Retrieve only the samples after the last time stamp of each table, with one
+            # request per distinct last time stamp (nominally, most of the tables share it)
+            tables_by_time = {}
+            for i, last_time in last_times.items():
+                tables_by_time.setdefault(last_time, []).append(i)
+            new_hdus = {}
+            for last_time, tables in sorted(tables_by_time.items()):
+                param_names = [prod['hdus'][i - 1]['name'] for i in tables]
+                samples = data_provider.get_parameter_arrays(param_names,
+                                                             last_time + 1,
+                                                             self.timestamp_end,
+                                                             sample_filter=self.sample_filter)
+                for i, columns in zip(tables, samples):
+                    columns = columns.select(columns.get_time() > last_time)
+                    t, type_conv = sample_columns_to_hdu(columns)
+                    if t is not None:
+                        new_hdus[i] = t
+            retr_time = time.time()
+
+            logger.info('{} new rows for {} of {} tables of {}'
+                        .format(sum(len(t.data) for t in new_hdus.values()),
+                                len(new_hdus), len(prod['hdus']), prod_file))
+
+            if mode == 'append':
+                with fits.open(file_name) as hdul:
+                    hdul_new = fits.HDUList([fits.PrimaryHDU(header=hdul[0].header)])
+                    for i in range(1, len(hdul)):
+                        if i in new_hdus:
+                            hdul_new.append(append_table_rows(hdul[i], new_hdus[i]))
+                        else:
+                            hdul_new.append(fits.BinTableHDU(data=hdul[i].data.copy(),
+                                                             header=hdul[i].header))
+                self.save_to_fits(hdul_new, file_name)
+                self.add_product_index(nfile, prod['id'], prod, hdul_new, gen_files, file_name)
+                nfile = nfile + 1
+            else:
+                with fits.open(file_name) as hdul:
+                    self.add_product_index(nfile, prod['id'], prod, hdul, None, file_name)
+                nfile = nfile + 1
+                if len(new_hdus) > 0:
+                    base_name = prod['id'] + '_DELTA_' + \
+                                self.generate_filename(self.create_actual_file_tpl('%YMD2T%hms2'))
+                    delta_name = os.path.join(indir, base_name) + '.fits'
+                    hdul_delta = self.fits_build_hdr(prod['from_pid'], prod['to_pid'])
+                    delta_hdus = []
+                    for i in sorted(new_hdus.keys()):
+                        hdul_delta.append(new_hdus[i])
+                        delta_hdus.append(dict(prod['hdus'][i - 1], index=len(delta_hdus) + 1))
+                    self.save_to_fits(hdul_delta, delta_name)
+                    self.add_product_index(nfile, base_name, dict(prod, hdus=delta_hdus),
+                                           hdul_delta, gen_files, delta_name, params=False)
+                    nfile = nfile + 1
+
+            end_time = time.time()
+            retr_time_total = retr_time_total + (retr_time - prep_time)
+            conv_time_total = conv_time_total + (end_time - retr_time)
+
+        full_time_total = time.time() - start_time
+
+        self.log_retrieval_summary(retr_time_total, conv_time_total, full_time_total, param_names_invalid)
+        self.write_xml_index(now_utc_iso())
 
         return (retr_time_total, conv_time_total, full_time_total, param_names_invalid, gen_files)
 
+    def add_product_index(self, nfile, base_name, prod, hdul, gen_files, file_name, params=True):
+        '''
+        Add the XML index sections of an updated product file, taking the
+        types from its (possibly widened) binary tables. The Parameter entries
+        are only added if params is True (not for the delta files, so each
+        parameter is listed once)
+        '''
+        xml_hdus = []
+        for j, hdu in enumerate(prod['hdus'], start=1):
+            type_conv = str(hdul[j].columns[1].format)
+            xml_hdus.append(XMLTemplates['HDU'].format(j, hdu['pid'], hdu['name'], type_conv))
+            if params:
+                self.xmlParams.append(XMLTemplates['Param'].format(hdu['pid'], hdu['name'], type_conv, nfile, j))
+
+        self.xmlProds.append(XMLTemplates['Prod'].format(nfile, base_name, prod['from_pid'], prod['to_pid'],
+                                                         '\n'.join(xml_hdus)))
+        self.xmlCont.append(XMLTemplates['DataCont'].format(os.path.basename(file_name)))
+        if gen_files is not None:
+            gen_files.append(file_name)
+            logger.info('Saved file {}'.format(file_name))
+
+    def set_scan_mode(self, data_provider):
+        '''
+        Configure the data provider to scan the parameters of a block serially or concurrently,
+        and with one scan per parameter or per run of consecutive PIDs. The settings that
+        are None keep the mode of the config. file
+        '''
+        if self.scan_workers == 1:
+            data_provider.set_serial_scans()
+        elif self.scan_workers is not None:
+            data_provider.set_parallel_scans(self.scan_workers)
+        if self.bulk_scans:
+            data_provider.set_bulk_scans()
+        elif self.bulk_scans is not None:
+            data_provider.set_single_scans()
+
     def create_actual_file_tpl(self, tpl):
         '''
         The filename template uses the following placeholders:
@@ -667,7 +1243,8 @@ class Retriever(object):
                           month2=self.month2, day2=self.day2,
                           hour2=self.hour2, min2=self.min2, sec2=int(self.sec2))
 
-    def fits_build_hdr(self, i, j):
+    @staticmethod
+    def fits_build_hdr(i, j):
         '''
         Build FITS header for resulting file
         '''
@@ -679,7 +1256,8 @@ class Retriever(object):
         primary_hdu = fits.PrimaryHDU(header=hdr)
         return fits.HDUList([primary_hdu]) # HDU List with only primary_hdu
 
-    def save_to_fits(self, hdu_list, file_name):
+    @staticmethod
+    def save_to_fits(hdu_list, file_name):
         '''
         Save HDU List to FITS file
         '''
@@ -10,7 +10,8 @@ import time
 import glob
 import json
 
-import pymysql
+import ares.pyares  # puts pyares in the import path, as its modules import each other as pyares.*
+from pyares.mariadb_pool import MariaDBPool
 
 VERSION = '0.0.1'
 
@@ -51,27 +52,15 @@ class AresDBConnection(object):
             self.pwd = pwd
             self.db = db
 
+        # connections shared with the other clients of the same database in the process
+        self.pool = MariaDBPool.get_shared(self.host, self.port, self.user, self.pwd, self.db)
 
     def getParamNames(self):
         '''
         Returns a tuple with all the parameter names from the ARES DB
         '''
-        connection = pymysql.connect(host = self.host,
-                                     port = self.port,
-                                     user = self.user,
-                                     password = self.pwd,                               
-                                     db = self.db,    
-                                     cursorclass=pymysql.cursors.DictCursor)
-        try:
-            with connection.cursor() as cursor:
-                query = ("SELECT * FROM DATA_DEFS_TBL")
-
-                cursor.execute(query)
-
-                paramNames = [row['NAME'] for row in cursor]
-    
-        finally:
-            connection.close()
+        rows = self.pool.query("SELECT NAME FROM DATA_DEFS_TBL")
+        paramNames = [row['NAME'] for row in rows]
 
         return paramNames
 
@@ -1,16 +1,44 @@
+import math
 import pickle
 import re
 import subprocess
 
+import numpy as np
+
 from inspect import signature
 
 from pyspark import SQLContext, SparkConf, SparkContext, HiveContext
 from pyspark.sql import Row, utils, Window
 import pyspark.sql.functions as F
-from pyspark.sql.types import StringType, FloatType, IntegerType, BooleanType
+from pyspark.sql.types import StringType, FloatType, IntegerType, BooleanType, LongType, DoubleType, \
+    StructType, StructField
 
 from pyares.pyares_conf_factory import PyAresConfigFactory as paconf
 from pyares.parameter_sample_provider import ParameterSampleProvider
+from pyares.bucket_stats import resolution_to_interval
+from pyares.scan_partitions import pack_partitions, split_units
+
+# Scan units handed to the tasks of the search (see scan_partitions.ScanUnit)
+UNIT_SCHEMA = StructType([StructField('pid', LongType()),
+                          StructField('name', StringType()),
+                          StructField('syselem', StringType()),
+                          StructField('start', LongType()),
+                          StructField('end', LongType()),
+                          StructField('rows', LongType())])
+
+# Samples returned by the search, before pivoting them by parameter
+SAMPLE_SCHEMA = StructType([StructField('timestamp', LongType()),
+                            StructField('value', DoubleType()),
+                            StructField('var_name', StringType())])
+
+# Modes of execution of the functions of function_dict
+UDF_MODES = ('auto', 'row', 'scalar', 'grouped_map')
+
+# Rows of the DF the functions are tried on, to decide if they can run as scalar pandas UDFs
+UDF_PROBE_ROWS = 16
+
+# NumPy type the results of the pandas UDFs are converted to, for each Spark SQL return type
+UDF_NUMPY_TYPES = {'int': np.int32, 'float': np.float32, 'boolean': np.bool_, 'string': str}
 
 """
 # old imports, saved here until the next stable release
@@ -38,7 +66,9 @@ class AresJob:
                    persist_search=False,
                    calc_stats=False,
                    resolution='5m',
-                   previous_results=None
+                   previous_results=None,
+                   partition_rows=1000000,
+                   udf_mode='row'
                    ):
         """
         Define a job that can run calculations on parameter sample data in the ARES cluster.
@@ -49,6 +79,17 @@ class AresJob:
         :param calc_stats: Bool if you want to calculate and persist statistics with the resolution
         :param resolution: Can be String 5m, 30m, 1d, OR any Int in microseconds
         :param previous_results: Dict defining which job_id's and which result types you want to reuse in the job
+        :param partition_rows: Int max. estimated samples read by a task of the search, longer parameters
+                               are split in time slices
+        :param udf_mode: String, how the functions of function_dict run (an entry can override it with a
+                         third element, e.g. (f, ['sa'], 'grouped_map')):
+                         'row' as row by row UDFs,
+                         'scalar' as pandas UDFs, called with a pandas Series per column for a batch of rows,
+                         'grouped_map' as pandas UDFs called with a pandas DF (timestamp and the columns) for
+                         each interval of the resolution, sorted by timestamp,
+                         'auto' as scalar pandas UDFs if they return one value per row when tried on a few rows,
+                         else as row UDFs (the DF is then persisted, so the probe rows do not run the search
+                         again)
         """
         # TODO able to pass multiple functions on multiple columns
         # TODO columns is (nested) array of columns
@@ -95,13 +136,8 @@ class AresJob:
 
         # if the data needs to come from HBase
         if perform_search:
-            params = sc.parallelize(param_names)
-            try:
-                samples = params.flatMap(lambda x: self.__get_samples(x, start, end)).filter(lambda x: x is not None)
-                rows = samples.map(lambda x: Row(timestamp=x.get_time(), value=x.get_value(), var_name=x.get_name()))
-                acdf = sqlc.createDataFrame(rows, schema=['timestamp', 'value', 'var_name'])
-                # TODO; for now type is inferred from the sampling ratio, later this should be in the sample object
-            except ValueError:
+            acdf = self.__read_samples(sc, sqlc, param_names, start, end, partition_rows)
+            if acdf is None:
                 logger.info("Search returned no data. "
                             "Please consider using different parameters or a different time period.")
                 return
@@ -146,31 +182,45 @@ class AresJob:
         performance should be equal to doing this with map reduce.
         """
         if function_dict is not None:
-            for key in function_dict.keys():
-                try:
-                    f = F.udf(function_dict[key][0], self.__check_f_type(function_dict[key][0]))
-                    df = df.withColumn('%s' % key, f(*[F.col(x) for x in function_dict[key][1]]))
-
-                    # part of the fix related to JIRA ARESPY-20
-                    #bad_func = F.udf(self.__check_not_bad, BooleanType())
-                    #cols = [F.col(x) for x in function_dict[key][1]]
-                    #df = df.withColumn('%s' % key, f(*[F.col(x) for x in cols]))
-
-                    #df = df.withColumn('test', F.lit(bad_func(*cols)))
-                    #df = df.withColumn('test', F.lit(bad_func(*cols)).cast('string')=='false')
-                    #df = df.withColumn('test_%s' % key , F.when(F.lit(bad_func(*cols)).cast('string')=='false', f(*cols)).otherwise(F.lit('None')))
-
-                        #*[F.col(x) for x in function_dict[key][1]],
-                        #                              f(*[F.col(x) for x in function_dict[key][1]])))
-                except utils.AnalysisException:
-                    logger.info("Cannot find parameter of query %s in result given current columns %s. "
-                                "Please consider using different parameters or a different time period."
-                                % (str(function_dict[key][1]),str(df.columns)))
-                    pass
-
-            # persist only the new results
-            df.select([column for column in df.columns if column not in old_columns])\
-                .write.save(('%s/%s_udf_result' % (result_path, str(sc.applicationId))), mode='append')
+            modes = {key: function_dict[key][2] if len(function_dict[key]) > 2 else udf_mode
+                     for key in function_dict.keys()}
+            probe_sample = persisted = None
+            if hasattr(F, 'pandas_udf') and any(mode in ('auto', 'scalar') for mode in modes.values()):
+                # the functions are tried on a few local rows, and the search and pivot are only
+                # computed once for them and for the results
+                df = persisted = df.persist()
+                probe_sample = df.limit(UDF_PROBE_ROWS).toPandas()
+            try:
+                for key in function_dict.keys():
+                    try:
+                        df, mode = self.__add_udf_column(df, '%s' % key, function_dict[key][0],
+                                                         function_dict[key][1], modes[key], resolution,
+                                                         probe_sample)
+                        logger.info("Function of %s runs as a %s UDF." % (key, mode))
+
+                        # part of the fix related to JIRA ARESPY-20
+                        #bad_func = F.udf(self.__check_not_bad, BooleanType())
+                        #cols = [F.col(x) for x in function_dict[key][1]]
+                        #df = df.withColumn('%s' % key, f(*[F.col(x) for x in cols]))
+
+                        #df = df.withColumn('test', F.lit(bad_func(*cols)))
+                        #df = df.withColumn('test', F.lit(bad_func(*cols)).cast('string')=='false')
+                        #df = df.withColumn('test_%s' % key , F.when(F.lit(bad_func(*cols)).cast('string')=='false', f(*cols)).otherwise(F.lit('None')))
+
+                            #*[F.col(x) for x in function_dict[key][1]],
+                            #                              f(*[F.col(x) for x in function_dict[key][1]])))
+                    except utils.AnalysisException:
+                        logger.info("Cannot find parameter of query %s in result given current columns %s. "
+                                    "Please consider using different parameters or a different time period."
+                                    % (str(function_dict[key][1]),str(df.columns)))
+                        pass
+
+                # persist only the new results
+                df.select([column for column in df.columns if column not in old_columns])\
+                    .write.save(('%s/%s_udf_result' % (result_path, str(sc.applicationId))), mode='append')
+            finally:
+                if persisted is not None:
+                    persisted.unpersist()
 
         logger.info("Finished PyAres job.")
 
@@ -254,50 +304,45 @@ class AresJob:
         output = "\n".join(re.findall(r".*PyAres:.*", cmd_out))
         return output
 
-    def __get_samples(self, param_name, start, end):
+    def __read_samples(self, sc, sqlc, param_names, start, end, partition_rows):
         """
-        Helper function that initiates the hbase connection inside the node, because connection objects
-        cannot be serialized and transferred to the nodes from the driver.
-        Fetches all the samples for a given parameter name.
-        Only to be used from within a Spark job with a paralellized param_names rdd.
-        Returns empty if the parameter cannot be found in the MariaDB
-        :param param_name: String
+        Reads the samples of the parameters from HBase into a Spark DF with columns timestamp, value and var_name.
+        The rows of each parameter are estimated from the driver, and the work split in (PID, time slice)
+        units of at most partition_rows rows, spread over the partitions balancing their rows. Each partition
+        opens its connections once, and returns its samples as Arrow record batches (Spark 3.3+, mapInArrow)
+        or as rows with older versions.
+        :param sc: SparkContext
+        :param sqlc: SQLContext
+        :param param_names: List of strings with parameter name(s)
         :param start: timestamp
         :param end: timestamp
-        :return: generator with parameter data objects
+        :param partition_rows: Int max. estimated rows of a unit
+        :return: DF with the samples, None if the parameters have no samples in the period
         """
-
         dp = ParameterSampleProvider('pyares_conf.ini')
+        units = split_units(dp.get_row_estimates(param_names, start, end), start, end, partition_rows)
+        if len(units) == 0:
+            return None
 
-        try:
-            #samples = dp.get_parameter_data_objs([param_name], start, end) # old implementation
-            sample_objs = dp.get_parameter_data_objs([param_name], start, end)
-            samples = [s for sample in sample_objs for s in sample]
-            return samples
+        total_rows = sum(unit.rows for unit in units)
+        partitions = pack_partitions(units, max(sc.defaultParallelism, math.ceil(total_rows / partition_rows)))
+        # a single element per slice, so each list of units is read by its own partition
+        unit_rdd = sc.parallelize(partitions, len(partitions)).flatMap(lambda units: units)
+        unit_df = sqlc.createDataFrame(unit_rdd.map(tuple), schema=UNIT_SCHEMA)
 
-        except TypeError:
-            return [None]
+        if hasattr(unit_df, 'mapInArrow'):
+            return unit_df.mapInArrow(_read_partition_batches, SAMPLE_SCHEMA)
+        return sqlc.createDataFrame(unit_rdd.mapPartitions(_read_partition_rows), schema=SAMPLE_SCHEMA)
 
     def __calc_stats(self, df, resolution):
         """
         Calculates statistics for every column in the Spark DF and returns a seperate DF with the results.
         Statistics: sum, min, max, count, mean, kurtosis, skewness, stddev, variance.
         :param df: DF containing the columns that you want to run your statistics calculations on
-        :param resolution: int resolution in milli or microseconds OR string '5m'/'1h'/'1d'
+        :param resolution: int resolution in microseconds OR string '1m'/'5m'/'1h'/'1d'
         :return: aggregation dataframe containing statistics
         """
-
-        if type(resolution) is str:
-            # resolution to microseconds
-            res_dict = {'5m': 300000000,
-                        '1h': 3600000000,
-                        '1d': 86400000000}
-            agg_interval = res_dict[resolution]
-
-        elif type(resolution) is int:
-            if len(str(resolution)) < 16:
-                resolution = int(str(resolution).ljust(16, '0'))
-            agg_interval = resolution
+        agg_interval = resolution_to_interval(resolution)
 
         ts_col = F.col('timestamp')
         df_ori_cols = list(set(df.columns) - set(['timestamp']))
@@ -332,6 +377,94 @@ class AresJob:
 
         return agg_df
 
+    def __add_udf_column(self, df, key, f, columns, mode, resolution, probe_sample=None):
+        """
+        Adds the result of a function of function_dict as a new column of the DF.
+        Pandas UDFs need Spark 2.3+ (and pyarrow in the nodes), with older versions the functions run row by row.
+        :param df: DF with the timestamp and the input columns
+        :param key: String name of the new column
+        :param f: function as defined in the job definition
+        :param columns: List of the names of the input columns
+        :param mode: String 'auto', 'row', 'scalar' or 'grouped_map' (see define_job)
+        :param resolution: int resolution in microseconds OR string '1m'/'5m'/'1h'/'1d' of the groups
+        :param probe_sample: pandas DF with the first rows of the DF, to try the function on (see __probe_vectorized)
+        :return: tuple (DF with the new column, String mode the function runs in)
+        """
+        if mode not in UDF_MODES:
+            raise ValueError('Unknown UDF mode %s, must be one of %s' % (mode, ', '.join(UDF_MODES)))
+        cols = [F.col(x) for x in columns]
+        if mode == 'row' or not hasattr(F, 'pandas_udf'):
+            return (df.withColumn(key, F.udf(f, self.__check_f_type(f))(*cols)), 'row')
+
+        if mode == 'grouped_map':
+            return_type = self.__check_vector_type(f)
+            return (self.__add_grouped_column(df, key, f, columns, return_type, resolution), mode)
+
+        probe = self.__probe_vectorized(probe_sample, f, columns)
+        if probe is None and mode == 'auto':
+            return (df.withColumn(key, F.udf(f, self.__check_f_type(f))(*cols)), 'row')
+        return_type = self.__check_vector_type(f, probe)
+        f_udf = F.pandas_udf(_scalar_pandas_function(f, UDF_NUMPY_TYPES[return_type.simpleString()]),
+                             return_type)
+        return (df.withColumn(key, f_udf(*cols)), 'scalar')
+
+    def __add_grouped_column(self, df, key, f, columns, return_type, resolution):
+        """
+        Adds the result of a grouped map function as a new column of the DF, calling it once per
+        interval of the resolution and joining its results on the timestamp
+        :return: DF with the new column
+        """
+        interval = resolution_to_interval(resolution)
+        schema = StructType([StructField('timestamp', df.schema['timestamp'].dataType),
+                             StructField(key, return_type)])
+        function = _grouped_pandas_function(f, key, columns, UDF_NUMPY_TYPES[return_type.simpleString()])
+        grouped = df.select(['timestamp'] + list(columns))\
+                    .withColumn('interval_start', F.floor(F.col('timestamp') / interval) * interval)\
+                    .groupBy('interval_start')
+        if hasattr(grouped, 'applyInPandas'):
+            result = grouped.applyInPandas(function, schema)
+        else:
+            result = grouped.apply(F.pandas_udf(function, schema, F.PandasUDFType.GROUPED_MAP))
+        return df.join(result, on='timestamp', how='left')
+
+    def __probe_vectorized(self, sample, f, columns):
+        """
+        Helper function to check if a function can run as a scalar pandas UDF: it is called on the first rows of
+        the DF, with a pandas Series per column, and has to return one value per row.
+        :param sample: pandas DF with the first rows of the DF (UDF_PROBE_ROWS), None if not taken
+        :param f: function as defined in the job definition
+        :param columns: List of the names of the input columns
+        :return: NumPy array with the result, None if the call failed, the DF is empty or lacks a column
+        """
+        if sample is None or len(sample) == 0 or any(x not in sample.columns for x in columns):
+            return None
+        sample = sample[list(columns)]
+        try:
+            result = np.asarray(f(*[sample.iloc[:, i] for i in range(len(columns))]))
+        except Exception:
+            return None
+        if result.ndim != 1 or len(result) != len(sample):
+            return None
+        return result
+
+    def __check_vector_type(self, f, result=None):
+        """
+        Helper function to get the return type of a pandas UDF: the annotation type of the function as
+        in __check_f_type, or else the type of its result on a few rows, defaulting to floats.
+        :param f: function as defined in the job definition
+        :param result: NumPy array with the result of the function on a few rows, None if unknown
+        :return: spark sql type
+        """
+        if signature(f).return_annotation in (int, float):
+            return self.__check_f_type(f)
+        if result is None or result.dtype.kind == 'f':
+            return FloatType()
+        if result.dtype.kind in 'iu':
+            return IntegerType()
+        if result.dtype.kind == 'b':
+            return BooleanType()
+        return StringType()
+
     def __check_f_type(self, f):
         """
         Helper function to check for the annotation type of the function to base the return type of the UDF on.
@@ -376,3 +509,95 @@ class AresJob:
             if (value == value) | (value is not None): #(value != None)
                 bad = False
         return bad
+
+
+def _read_units(units):
+    """
+    Reads the samples of the scan units of a partition, with a single provider (and so a single set of
+    connections) for all of them. The PIDs of the units are used as they are, without looking up the
+    names in the metadata. Runs in the executors.
+    :param units: iterable of ScanUnit-like tuples (pid, name, syselem, start, end, rows)
+    :return: generator of (param_name, SampleColumns) batches
+    """
+    dp = ParameterSampleProvider('pyares_conf.ini')
+    for pid, name, syselem, start, end, rows in units:
+        for columns in dp.get_parameter_stream(name, start, end, syselem=syselem, pid=pid):
+            if len(columns) > 0:
+                yield (name, columns)
+
+
+def _float_values(columns):
+    """
+    Get the values of a batch as float64, NaN for the non numeric ones
+    :param columns: SampleColumns object
+    :return: float64 array
+    """
+    values = columns.get_value()
+    if values.dtype == np.object_:
+        return np.full(len(values), np.nan)
+    return values.astype(np.float64, copy=False)
+
+
+def _read_partition_batches(batches):
+    """
+    mapInArrow function of the search: reads the samples of the scan units of the partition
+    as Arrow record batches with the columns of SAMPLE_SCHEMA
+    :param batches: iterator of Arrow record batches with the units (UNIT_SCHEMA)
+    :return: generator of Arrow record batches with the samples
+    """
+    import pyarrow
+
+    units = (unit for batch in batches
+             for unit in zip(*(batch.column(name).to_pylist() for name in UNIT_SCHEMA.names)))
+    for name, columns in _read_units(units):
+        values = _float_values(columns)
+        yield pyarrow.RecordBatch.from_arrays([pyarrow.array(columns.get_time(), type=pyarrow.int64()),
+                                               pyarrow.array(values, mask=np.isnan(values)),
+                                               pyarrow.array([name] * len(values), type=pyarrow.string())],
+                                              names=SAMPLE_SCHEMA.names)
+
+
+def _read_partition_rows(units):
+    """
+    mapPartitions function of the search, for Spark versions without mapInArrow
+    :param units: iterator of ScanUnit tuples
+    :return: generator of (timestamp, value, var_name) tuples
+    """
+    for name, columns in _read_units(units):
+        values = _float_values(columns)
+        for timestamp, value in zip(columns.get_time().tolist(), values.tolist()):
+            yield (timestamp, value if value == value else None, name)
+
+
+def _scalar_pandas_function(f, dtype):
+    """
+    Wraps a function of function_dict for a scalar pandas UDF
+    :param f: function called with a pandas Series per input column
+    :param dtype: NumPy type of the results
+    :return: function returning a pandas Series with a result per row
+    """
+    def apply(*series):
+        import pandas as pd
+
+        return pd.Series(np.asarray(f(*series))).astype(dtype)
+
+    return apply
+
+
+def _grouped_pandas_function(f, key, columns, dtype):
+    """
+    Wraps a function of function_dict for a grouped map pandas UDF
+    :param f: function called with a pandas DF with the timestamp and the input columns of a group
+    :param key: String name of the result column
+    :param columns: List of the names of the input columns
+    :param dtype: NumPy type of the results
+    :return: function returning a pandas DF with the timestamp and the result of each row
+    """
+    def apply(group):
+        import pandas as pd
+
+        group = group[['timestamp'] + list(columns)].sort_values('timestamp').reset_index(drop=True)
+        return pd.DataFrame({'timestamp': group['timestamp'],
+                             key: pd.Series(np.asarray(f(group))).astype(dtype)})
+
+    return apply
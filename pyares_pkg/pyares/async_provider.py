@@ -0,0 +1,232 @@
+import asyncio
+import functools
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from pyares.parameter_sample_provider import ParameterSampleProvider
+
+# queued after the last batch of a stream
+_END = object()
+
+
+class AsyncParameterSampleProvider:
+    """
+    asyncio front end of a ParameterSampleProvider, for GUIs and services that run several
+    parameter requests at once without blocking their event loop.
+    The blocking scans run in a bounded pool of threads (by default as many as pooled HBase
+    connections), and each request is an awaitable that can be cancelled or given a timeout.
+    A request already running in a thread cannot be interrupted: it completes in the
+    background and its result is discarded, but a queued one is dropped before it starts.
+    The streams are read by their own pool of threads, each one busy for the whole stream, so
+    open streams never take the threads of the other requests; the streams beyond max_streams
+    wait until a previous one is finished or closed.
+    Usage:
+        async with AsyncParameterSampleProvider() as provider:
+            columns = await provider.get_parameter_arrays(names, start, end, timeout=60)
+            async for batch in provider.iter_parameter_stream(name, start, end):
+                ...
+    :param conf: String path of the config. file, used when no provider is given
+    :param provider: ParameterSampleProvider object to wrap (default is a new one)
+    :param max_workers: Integer max. number of requests running at the same time
+    :param timeout: Float default timeout of the requests in seconds (None means no timeout)
+    :param max_streams: Integer max. number of streams read at the same time (default is max_workers)
+    Needs Python 3.7 (async generators and asyncio.get_running_loop), unlike the rest of the package,
+    so it is only imported when used.
+    """
+
+    def __init__(self, conf=None, provider=None, max_workers=None, timeout=None, max_streams=None):
+        self.__provider = provider if provider is not None else ParameterSampleProvider(conf)
+        if not max_workers:
+            max_workers = self.__provider.get_pool_size()
+        self.__executor = ThreadPoolExecutor(max_workers=max(1, int(max_workers)),
+                                             thread_name_prefix='pyares-async')
+        self.__stream_executor = ThreadPoolExecutor(max_workers=max(1, int(max_streams or max_workers)),
+                                                    thread_name_prefix='pyares-stream')
+        self.__timeout = timeout
+        self.__futures = set()
+        self.__futures_lock = threading.Lock()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get_provider(self):
+        return self.__provider
+
+    def close(self):
+        """
+        Stop the threads, dropping the requests not started yet
+        """
+        # cancelled here instead of with shutdown(cancel_futures=True), only available from Python 3.9
+        with self.__futures_lock:
+            futures = list(self.__futures)
+        for future in futures:
+            future.cancel()
+        self.__executor.shutdown(wait=False)
+        self.__stream_executor.shutdown(wait=False)
+
+    async def get_parameter_arrays(self, param_names, start, end, param_syselem=None, sample_filter=None,
+                                   timeout=None):
+        """
+        Awaitable version of ParameterSampleProvider.get_parameter_arrays
+        :param timeout: Float timeout in seconds (default is the one of the provider)
+        :return: list with a SampleColumns object for each parameter
+        """
+        return await self.__run(timeout, self.__provider.get_parameter_arrays,
+                                param_names, start, end, param_syselem, sample_filter)
+
+    async def get_parameter_data_block(self, param_names, start, end, param_syselem=None, sample_filter=None,
+                                       timeout=None):
+        """
+        Awaitable version of ParameterSampleProvider.get_parameter_data_block
+        :param timeout: Float timeout in seconds (default is the one of the provider)
+        :return: SampleBlock object
+        """
+        return await self.__run(timeout, self.__provider.get_parameter_data_block,
+                                param_names, start, end, param_syselem, sample_filter)
+
+    async def get_parameter_data_df(self, param_names, start, end, align='exact', step=None, bfill=False,
+                                    sample_filter=None, timeout=None):
+        """
+        Awaitable version of ParameterSampleProvider.get_parameter_data_df
+        :param timeout: Float timeout in seconds (default is the one of the provider)
+        :return: pandas dataframe
+        """
+        return await self.__run(timeout, self.__provider.get_parameter_data_df,
+                                param_names, start, end, align=align, step=step, bfill=bfill,
+                                sample_filter=sample_filter)
+
+    async def get_parameter_stats(self, param_names, start, end, resolution='5m', param_syselem=None,
+                                  sample_filter=None, timeout=None):
+        """
+        Awaitable version of ParameterSampleProvider.get_parameter_stats
+        :param timeout: Float timeout in seconds (default is the one of the provider)
+        :return: pandas dataframe
+        """
+        return await self.__run(timeout, self.__provider.get_parameter_stats,
+                                param_names, start, end, resolution=resolution, param_syselem=param_syselem,
+                                sample_filter=sample_filter)
+
+    async def get_parameter_names_from_pids(self, from_pid, to_pid, timeout=None):
+        """
+        Awaitable version of ParameterSampleProvider.get_parameter_names_from_pids
+        :param timeout: Float timeout in seconds (default is the one of the provider)
+        :return: tuple (param_names, param_syselem)
+        """
+        return await self.__run(timeout, self.__provider.get_parameter_names_from_pids, from_pid, to_pid)
+
+    async def iter_parameter_stream(self, param_name, start, end, slice_length=3600000000, batch_size=10000,
+                                    syselem=None, sample_filter=None, prefetch=2, timeout=None):
+        """
+        Async iterator over the batches of ParameterSampleProvider.get_parameter_stream.
+        The scan is read by one thread of the stream pool for the whole stream, at most prefetch
+        batches ahead of the consumer; the timeout applies to the wait for every batch.
+        Leaving the loop (break, cancellation, timeout) stops the scan and closes it.
+        :param param_name: String with the parameter name
+        :param start: Timestamp with the start of the period
+        :param end: Timestamp with the end of the period
+        :param slice_length: Integer length of the time slices, in microseconds
+        :param batch_size: Integer max. number of samples per batch
+        :param syselem: String system element of the parameter (default is the provider one)
+        :param sample_filter: SampleFilter object selecting the samples while they are decoded, None keeps all
+        :param prefetch: Integer max. number of batches read and not yet consumed
+        :param timeout: Float timeout in seconds (default is the one of the provider)
+        :return: async generator of SampleColumns batches
+        """
+        if timeout is None:
+            timeout = self.__timeout
+        stream = await self.__run(timeout, self.__provider.get_parameter_stream, param_name, start, end,
+                                  slice_length=slice_length, batch_size=batch_size, syselem=syselem,
+                                  sample_filter=sample_filter)
+        queue = asyncio.Queue()
+        credits = threading.Semaphore(max(1, int(prefetch)))
+        stop = threading.Event()
+        self.__submit(self.__stream_executor, self.__produce, stream, asyncio.get_running_loop(), queue, credits,
+                      stop)
+        try:
+            while True:
+                batch, error = await asyncio.wait_for(queue.get(), timeout)
+                credits.release()
+                if error is not None:
+                    raise error
+                if batch is _END:
+                    break
+                yield batch
+        finally:
+            stop.set()
+            credits.release()
+
+    """
+    Private Methods
+    """
+    async def __run(self, timeout, method, *args, **kwargs):
+        """
+        Run a blocking method of the provider in the pool of threads
+        :param timeout: Float timeout in seconds, None for the default one
+        :return: the result of the method
+        """
+        future = self.__submit(self.__executor, functools.partial(method, *args, **kwargs))
+        return await self.__wait(future, timeout)
+
+    def __submit(self, executor, function, *args):
+        """
+        Submit a function to a pool of threads, keeping its future until it is done, so that close
+        can cancel it if it has not started
+        :return: concurrent.futures.Future object
+        """
+        future = executor.submit(function, *args)
+        with self.__futures_lock:
+            self.__futures.add(future)
+        future.add_done_callback(self.__forget)
+        return future
+
+    def __forget(self, future):
+        with self.__futures_lock:
+            self.__futures.discard(future)
+
+    async def __wait(self, future, timeout):
+        """
+        Wait for a future of the pool of threads, cancelling it on timeout or cancellation
+        :param future: concurrent.futures.Future object
+        :param timeout: Float timeout in seconds, None for the default one
+        :return: the result of the future
+        """
+        if timeout is None:
+            timeout = self.__timeout
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+
+    def __produce(self, stream, loop, queue, credits, stop):
+        """
+        Read the batches of a stream in a thread of the stream pool and hand them to the event loop.
+        Every batch takes a credit, given back by the consumer, so the reading stays a few
+        batches ahead at most. The stream is closed in this same thread, as some scanners
+        cannot be used from other threads.
+        :param stream: ScanStream object
+        :param loop: event loop of the consumer
+        :param queue: asyncio.Queue of (batch, error) tuples
+        :param credits: threading.Semaphore with the batches that can still be queued
+        :param stop: threading.Event set when the consumer is gone
+        """
+        batches = iter(stream)
+        item = (_END, None)
+        try:
+            for batch in batches:
+                credits.acquire()
+                if stop.is_set():
+                    return
+                loop.call_soon_threadsafe(queue.put_nowait, (batch, None))
+        except Exception as error:
+            item = (None, error)
+        finally:
+            close = getattr(batches, 'close', None)
+            if close is not None:
+                close()
+        if not stop.is_set():
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+            except RuntimeError:
+                # the event loop is already closed
+                pass
@@ -0,0 +1,190 @@
+import numpy as np
+
+# Aggregation intervals, in microseconds
+RESOLUTIONS = {'1m': 60000000,
+               '5m': 300000000,
+               '1h': 3600000000,
+               '1d': 86400000000}
+
+# Statistics kept for each time bucket
+STATS = ('count', 'sum', 'min', 'max', 'mean', 'var', 'std', 'first_ts', 'first', 'last_ts', 'last')
+
+# Accumulators that fully describe a bucket, any of the STATS can be derived from them
+ACCUMULATORS = ('interval_start', 'count', 'sum', 'min', 'max', 'mean', 'm2', 'first_ts', 'first', 'last_ts', 'last')
+
+
+def resolution_to_interval(resolution):
+    """
+    Get the aggregation interval of a resolution
+    :param resolution: int resolution in microseconds OR string '1m'/'5m'/'1h'/'1d'
+    :return: Integer interval in microseconds
+    """
+    if type(resolution) is str:
+        if resolution not in RESOLUTIONS:
+            raise ValueError('Unknown resolution {}, must be one of {} or an integer'
+                             .format(resolution, ', '.join(RESOLUTIONS)))
+        return RESOLUTIONS[resolution]
+    if int(resolution) <= 0:
+        raise ValueError('The resolution must be a positive number of microseconds, not {}'.format(resolution))
+    return int(resolution)
+
+
+def finish_stats(stats):
+    """
+    Add the variance and standard deviation to a dictionary of bucket accumulators
+    :param stats: dictionary with the arrays of ACCUMULATORS
+    :return: the same dictionary, with 'var' and 'std' arrays
+    """
+    count = stats['count']
+    var = np.full(len(count), np.nan)
+    np.divide(stats['m2'], count - 1, out=var, where=count > 1)
+    stats['var'] = var
+    stats['std'] = np.sqrt(var)
+    return stats
+
+
+def rollup_stats(stats, interval):
+    """
+    Combine the accumulators of consecutive buckets into coarser buckets, e.g. 1m buckets into 1h ones
+    :param stats: dictionary with the arrays of ACCUMULATORS, sorted by interval_start
+    :param interval: Integer length of the coarser buckets, a multiple of the length of the original ones
+    :return: dictionary with the arrays of ACCUMULATORS, plus 'var' and 'std', of the coarser buckets
+    """
+    bucket = (stats['interval_start'] // interval) * interval
+    if len(bucket) == 0:
+        return finish_stats({name: stats[name][:0] for name in ACCUMULATORS})
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    ends = np.r_[starts[1:], len(bucket)]
+    count = stats['count'].astype(np.int64)
+    counts = np.add.reduceat(count, starts)
+    sums = np.add.reduceat(stats['sum'], starts)
+    means = np.add.reduceat(stats['mean'] * count, starts) / counts
+    # Chan: M2 = sum(M2_i + n_i * (mean_i - mean)^2)
+    dev = stats['mean'] - np.repeat(means, ends - starts)
+    m2s = np.add.reduceat(stats['m2'] + count * dev * dev, starts)
+    return finish_stats({'interval_start': bucket[starts],
+                         'count': counts,
+                         'sum': sums,
+                         'min': np.minimum.reduceat(stats['min'], starts),
+                         'max': np.maximum.reduceat(stats['max'], starts),
+                         'mean': means,
+                         'm2': m2s,
+                         'first_ts': stats['first_ts'][starts],
+                         'first': stats['first'][starts],
+                         'last_ts': stats['last_ts'][ends - 1],
+                         'last': stats['last'][ends - 1]})
+
+
+class BucketStats:
+    """
+    Running statistics of the samples of a parameter per time bucket: count, sum, min, max,
+    mean and variance (Welford, merged batch by batch with Chan's formula), and first/last sample.
+    Batches are reduced with NumPy and only the per-bucket accumulators are kept, so the memory
+    used depends on the number of buckets and not on the number of samples.
+    Batches must be added in time order, as they come from the HBase scans.
+    :param interval: Integer length of the buckets, in the units of the sample times
+    """
+
+    def __init__(self, interval):
+        self.__interval = interval
+        self.__numeric = True
+        self.__start = []
+        self.__count = []
+        self.__sum = []
+        self.__min = []
+        self.__max = []
+        self.__mean = []
+        self.__m2 = []
+        self.__first_ts = []
+        self.__first = []
+        self.__last_ts = []
+        self.__last = []
+
+    def add(self, columns):
+        """
+        Accumulate a batch of samples
+        :param columns: SampleColumns object with samples later than the ones already added
+        """
+        if len(columns) == 0:
+            return
+        time = columns.get_time()
+        value = columns.get_value()
+        self.__numeric = self.__numeric and value.dtype.kind in 'biuf'
+
+        bucket = (time // self.__interval) * self.__interval
+        starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+        ends = np.r_[starts[1:], len(bucket)]
+        counts = ends - starts
+
+        if self.__numeric:
+            fvalue = value.astype(np.float64)
+            sums = np.add.reduceat(fvalue, starts)
+            means = sums / counts
+            dev = fvalue - np.repeat(means, counts)
+            m2s = np.add.reduceat(dev * dev, starts)
+            mins = np.minimum.reduceat(fvalue, starts)
+            maxs = np.maximum.reduceat(fvalue, starts)
+        else:
+            sums = means = m2s = mins = maxs = np.full(len(starts), np.nan)
+
+        batch = zip(bucket[starts].tolist(), counts.tolist(), sums.tolist(), mins.tolist(), maxs.tolist(),
+                    means.tolist(), m2s.tolist(), time[starts].tolist(), value[starts].tolist(),
+                    time[ends - 1].tolist(), value[ends - 1].tolist())
+        for i, stats in enumerate(batch):
+            if i == 0 and len(self.__start) > 0 and self.__start[-1] == stats[0]:
+                self.__merge_last(*stats[1:])
+            else:
+                self.__append(*stats)
+
+    def get_stats(self):
+        """
+        Get the statistics of the buckets with samples
+        :return: dictionary with the arrays of ACCUMULATORS and of STATS
+        """
+        value_dtype = np.float64 if self.__numeric else np.object_
+        return finish_stats({'interval_start': np.array(self.__start, dtype=np.int64),
+                             'count': np.array(self.__count, dtype=np.int64),
+                             'sum': np.array(self.__sum, dtype=np.float64),
+                             'min': np.array(self.__min, dtype=np.float64),
+                             'max': np.array(self.__max, dtype=np.float64),
+                             'mean': np.array(self.__mean, dtype=np.float64),
+                             'm2': np.array(self.__m2, dtype=np.float64),
+                             'first_ts': np.array(self.__first_ts, dtype=np.int64),
+                             'first': np.array(self.__first, dtype=value_dtype),
+                             'last_ts': np.array(self.__last_ts, dtype=np.int64),
+                             'last': np.array(self.__last, dtype=value_dtype)})
+
+    def __len__(self):
+        return len(self.__start)
+
+    """
+    Private Methods
+    """
+    def __append(self, start, count, total, vmin, vmax, mean, m2, first_ts, first, last_ts, last):
+        self.__start.append(start)
+        self.__count.append(count)
+        self.__sum.append(total)
+        self.__min.append(vmin)
+        self.__max.append(vmax)
+        self.__mean.append(mean)
+        self.__m2.append(m2)
+        self.__first_ts.append(first_ts)
+        self.__first.append(first)
+        self.__last_ts.append(last_ts)
+        self.__last.append(last)
+
+    def __merge_last(self, count, total, vmin, vmax, mean, m2, first_ts, first, last_ts, last):
+        """
+        Merge the first bucket of a batch into the last accumulated one (same interval start)
+        """
+        n_a = self.__count[-1]
+        n = n_a + count
+        delta = mean - self.__mean[-1]
+        self.__count[-1] = n
+        self.__sum[-1] += total
+        self.__min[-1] = min(self.__min[-1], vmin)
+        self.__max[-1] = max(self.__max[-1], vmax)
+        self.__mean[-1] += delta * count / n
+        self.__m2[-1] += m2 + delta * delta * n_a * count / n
+        self.__last_ts[-1] = last_ts
+        self.__last[-1] = last
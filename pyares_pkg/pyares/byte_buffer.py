@@ -1,4 +1,4 @@
-# TODO now only forward translation (put), do we need backwards translation as well?
+# Only forward translation (put), the rowkeys are built and decoded with pyares.row_key
 
 
 class ByteBuffer:
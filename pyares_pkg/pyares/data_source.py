@@ -8,6 +8,8 @@ class DataSource:
     :param password: string
     :param database: string of the databasename that you want to connect to
     :param schema: string of the schema where you want to fetch the rows from
+    :param pool_size: integer max. number of pooled connections
+    :param ping_interval: seconds a pooled connection can stay idle before it is checked
     """
 
     def __init__(self, mariadb_conf_obj):
@@ -20,6 +22,8 @@ class DataSource:
         self.__database = str(mariadb_conf_obj['database'])
         self.__port = int(mariadb_conf_obj['port'])
         self.__schema = 'DATA_DEFS_TBL'
+        self.__pool_size = int(mariadb_conf_obj.get('pool_size', 4))
+        self.__ping_interval = float(mariadb_conf_obj.get('ping_interval', 30))
 
     def set_host(self, host):
         self.__host = host
@@ -39,6 +43,12 @@ class DataSource:
     def set_port(self, port):
         self.__port = port
 
+    def set_pool_size(self, pool_size):
+        self.__pool_size = pool_size
+
+    def set_ping_interval(self, ping_interval):
+        self.__ping_interval = ping_interval
+
     def get_host(self):
         return self.__host
 
@@ -56,3 +66,9 @@ class DataSource:
 
     def get_port(self):
         return self.__port
+
+    def get_pool_size(self):
+        return self.__pool_size
+
+    def get_ping_interval(self):
+        return self.__ping_interval
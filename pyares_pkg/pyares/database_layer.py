@@ -0,0 +1,69 @@
+from abc import ABC, abstractmethod
+
+
+class DatabaseLayer(ABC):
+    """
+    Interface of the parameter definitions database used by ParameterSampleProvider,
+    implemented by DatabaseLayerImpl (MariaDB) and LocalDatabaseLayer (sqlite).
+    The lookups built on top of the queries of the backends are shared here.
+    """
+
+    @abstractmethod
+    def get_params_from_pids(self, frompid, topid, syselem=None):
+        """
+        :return: list of rows with PID and NAME of the parameters with a PID in [frompid, topid]
+        """
+
+    @abstractmethod
+    def get_params_sysel_from_pids(self, frompid, topid, syselem=None):
+        """
+        :return: list of rows with PID, NAME and SYSTEM_ELEMENT of the parameters with a PID in [frompid, topid]
+        """
+
+    @abstractmethod
+    def get_params_pid_sysel_from_names(self, names):
+        """
+        :return: list of rows with PID and SYSTEM_ELEMENT of the parameters with one of the names
+        """
+
+    @abstractmethod
+    def get_paramnames_list(self):
+        """
+        :return: list with the names of all the parameters
+        """
+
+    @abstractmethod
+    def get_metadata(self):
+        """
+        :return: list with all the rows of the parameter definitions, sorted by PID
+        """
+
+    def get_param_ids(self, params):
+        """
+        Get the IDs of a list of parameters, with one query for each chunk of names
+        instead of one query per parameter
+        :param params: list of (param_name, syselem) tuples, a syselem of None matches any system element
+        :return: dictionary {(param_name, syselem): pid} with the parameters found
+        """
+        by_name = {}
+        for row in self._get_params_from_names(sorted(set(name for name, syselem in params))):
+            by_name.setdefault(row['NAME'], []).append(row)
+
+        result = {}
+        for name, syselem in params:
+            for row in by_name.get(name, []):
+                if syselem is None or row['SYSTEM_ELEMENT'] == syselem:
+                    result[(name, syselem)] = row['PID']
+                    break
+        return result
+
+    """
+    Protected Methods
+    """
+    @abstractmethod
+    def _get_params_from_names(self, names):
+        """
+        :param names: list of parameter names
+        :return: list of rows with PID, NAME and SYSTEM_ELEMENT of the parameters with one of the names,
+            sorted by PID
+        """
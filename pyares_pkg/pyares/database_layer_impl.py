@@ -1,10 +1,12 @@
+from pyares.database_layer import DatabaseLayer
+
 # assumption is that one paramid only matches with one paramname and vice versa
 # for each systemelement at least.
 # so each query should only match one row.
 
 # TODO include loggers
 # TODO looaaaaads of try/except/asserts etc
-# TODO make sure that there are no trailing SQL connections (connection pool?)
+# the connections are taken from a MariaDBPool, and given back after each query
 
 """
 TODO: Consider optimizations
@@ -13,10 +15,13 @@ Does it help to optimize for branch mispredictions? Don't think so, but sorting
 """
 
 
-class DatabaseLayerImpl:
+class DatabaseLayerImpl(DatabaseLayer):
+
+    # max. number of values sent in a single IN (...) clause
+    IN_CHUNK_SIZE = 1000
 
-    def __init__(self, connection, schema):
-        self.__connection = connection
+    def __init__(self, pool, schema):
+        self.__pool = pool
         self.__schema = schema
 
     def fetch_all(self):
@@ -25,10 +30,7 @@ class DatabaseLayerImpl:
         Only for testing, not recommended to use in production
         :return: dictionary with all the rows
         """
-        with self.__connection.cursor() as cursor:
-            query = "SELECT * FROM %s" % self.__schema
-            cursor.execute(query)
-            return cursor.fetchall()
+        return self.__pool.query("SELECT * FROM %s" % self.__schema)
 
     def get_param_id(self, param_name, syselem):
         """
@@ -38,25 +40,22 @@ class DatabaseLayerImpl:
         :return: integer value that is the ID
         """
 
-        with self.__connection.cursor() as cursor:
-            query = "SELECT PID FROM %s WHERE NAME= '%s' AND SYSTEM_ELEMENT= '%s'" % (self.__schema, param_name, syselem)
-            cursor.execute(query)
-            result = cursor.fetchone()
+        result = self.__pool.query_one("SELECT PID FROM %s WHERE NAME=%%s AND SYSTEM_ELEMENT=%%s" % self.__schema,
+                                       (param_name, syselem))
         return result['PID']
 #------
     def get_param_re_names(self, param_name_re, syselem):
         """
-        Get the ID that corresponds with a certain parameter name and corresponding system element
-        :param param_name: string that is the name of the parameter
+        Get the IDs of the parameters whose name matches a LIKE pattern, for a system element
+        (see ParameterSampleProvider.find_parameters for glob and regex patterns without the database)
+        :param param_name_re: string with the LIKE pattern of the parameter names
         :param syselem: string that is the system element
-        :return: integer value that is the ID
+        :return: list of integer IDs, sorted
         """
 
-        with self.__connection.cursor() as cursor:
-            query = "SELECT PID FROM %s WHERE NAME LIKE '%s' AND SYSTEM_ELEMENT= '%s'" % (self.__schema, param_name_re, syselem)
-            cursor.execute(query)
-            result = cursor.fetchone()
-        return result['PID']
+        result = self.__pool.query("SELECT PID FROM %s WHERE NAME LIKE %%s AND SYSTEM_ELEMENT=%%s "
+                                   "ORDER BY PID" % self.__schema, (param_name_re, syselem))
+        return [row['PID'] for row in result]
 
     def get_params_from_pids(self, frompid, topid, syselem=None):
         """
@@ -66,19 +65,11 @@ class DatabaseLayerImpl:
         :return: integer value that is the ID
         """
 
-        with self.__connection.cursor() as cursor:
-            query = ''
-            if not syselem:
-                query = ("SELECT NAME FROM %s WHERE " +
-                         " PID BETWEEN %s AND %s") % (self.__schema, frompid, topid)
-            else:
-                query = ("SELECT NAME FROM %s WHERE " +
-                         " SYSTEM_ELEMENT='%s'" +
-                         " AND PID BETWEEN %s AND %s") % (self.__schema, syselem, frompid, topid)
-            cursor.execute(query)
-            result = cursor.fetchall()
-
-        return result
+        if not syselem:
+            return self.__pool.query("SELECT PID,NAME FROM %s WHERE PID BETWEEN %%s AND %%s" % self.__schema,
+                                     (frompid, topid))
+        return self.__pool.query("SELECT PID,NAME FROM %s WHERE SYSTEM_ELEMENT=%%s AND PID BETWEEN %%s AND %%s"
+                                 % self.__schema, (syselem, frompid, topid))
 
     def get_params_sysel_from_pids(self, frompid, topid, syselem=None):
         """
@@ -88,19 +79,11 @@ class DatabaseLayerImpl:
         :return: integer value that is the ID
         """
 
-        with self.__connection.cursor() as cursor:
-            query = ''
-            if not syselem:
-                query = ("SELECT NAME,SYSTEM_ELEMENT FROM %s WHERE " +
-                         " PID BETWEEN %s AND %s") % (self.__schema, frompid, topid)
-            else:
-                query = ("SELECT NAME,SYSTEM_ELEMENT FROM %s WHERE " +
-                         " SYSTEM_ELEMENT='%s'" +
-                         " AND PID BETWEEN %s AND %s") % (self.__schema, syselem, frompid, topid)
-            cursor.execute(query)
-            result = cursor.fetchall()
-
-        return result
+        if not syselem:
+            return self.__pool.query("SELECT PID,NAME,SYSTEM_ELEMENT FROM %s WHERE PID BETWEEN %%s AND %%s"
+                                     % self.__schema, (frompid, topid))
+        return self.__pool.query("SELECT PID,NAME,SYSTEM_ELEMENT FROM %s WHERE SYSTEM_ELEMENT=%%s "
+                                 "AND PID BETWEEN %%s AND %%s" % self.__schema, (syselem, frompid, topid))
 
     def get_params_pid_sysel_from_names(self, names):
         """
@@ -110,14 +93,37 @@ class DatabaseLayerImpl:
         :return: integer value that is the ID
         """
 
-        with self.__connection.cursor() as cursor:
-            namelist = ','.join(["'{}'".format(name) for name in names])
-            query = ("SELECT PID,SYSTEM_ELEMENT FROM %s WHERE " +
-                     " NAME IN (%s)") % (self.__schema, namelist)
-            print(query)
-            cursor.execute(query)
-            result = cursor.fetchall()
+        return self.__fetch_in_chunks("SELECT PID,SYSTEM_ELEMENT FROM %s WHERE NAME IN (%s)", list(names))
+
+    def get_param_names_from_ids(self, param_ids, syselem=None):
+        """
+        Get the names and system elements of a list of parameter IDs, with one query for each
+        chunk of IN_CHUNK_SIZE IDs instead of one query per parameter
+        :param param_ids: list of integer parameter IDs
+        :param syselem: string that is the system element, None matches any
+        :return: list of rows with PID, NAME and SYSTEM_ELEMENT
+        """
+        rows = self.__fetch_in_chunks("SELECT PID,NAME,SYSTEM_ELEMENT FROM %s WHERE PID IN (%s) ORDER BY PID",
+                                      sorted(set(param_ids)))
+        return [row for row in rows if syselem is None or row['SYSTEM_ELEMENT'] == syselem]
+
+    def _get_params_from_names(self, names):
+        return self.__fetch_in_chunks("SELECT PID,NAME,SYSTEM_ELEMENT FROM %s WHERE NAME IN (%s) ORDER BY PID",
+                                      names)
 
+    def __fetch_in_chunks(self, query_tpl, values):
+        """
+        Run a parameterized query with an IN (...) clause for a long list of values,
+        splitting the list in chunks of IN_CHUNK_SIZE values
+        :param query_tpl: query with two %s placeholders, for the schema and for the IN list
+        :param values: list of values for the IN clause
+        :return: list with all the resulting rows
+        """
+        result = []
+        for i in range(0, len(values), self.IN_CHUNK_SIZE):
+            chunk = values[i:i + self.IN_CHUNK_SIZE]
+            query = query_tpl % (self.__schema, ','.join(['%s'] * len(chunk)))
+            result.extend(self.__pool.query(query, chunk))
         return result
 
 #-----
@@ -130,16 +136,14 @@ class DatabaseLayerImpl:
         :return: string with description
         """
         if type(param) == str:
-            query = "SELECT DESCRIPTION FROM %s WHERE NAME='%s' AND SYSTEM_ELEMENT='%s'" % (self.__schema, param, syselem)
+            query = "SELECT DESCRIPTION FROM %s WHERE NAME=%%s AND SYSTEM_ELEMENT=%%s" % self.__schema
         elif type(param) == int:
-            query = "SELECT DESCRIPTION FROM %s WHERE PID='%s' AND SYSTEM_ELEMENT='%s'" % (self.__schema, param, syselem)
+            query = "SELECT DESCRIPTION FROM %s WHERE PID=%%s AND SYSTEM_ELEMENT=%%s" % self.__schema
         else:
             print("Can't execute an empty query. Give a parameter name or id number.")
             return None
 
-        with self.__connection.cursor() as cursor:
-            cursor.execute(query)
-            result = cursor.fetchone()
+        result = self.__pool.query_one(query, (param, syselem))
         return result['DESCRIPTION']
 
     def get_paramnames_list(self):
@@ -150,10 +154,7 @@ class DatabaseLayerImpl:
         """
         # TODO include syselem?
 
-        query = "SELECT NAME FROM %s" % self.__schema
-        with self.__connection.cursor() as cursor:
-            cursor.execute(query)
-            result = cursor.fetchall()
+        result = self.__pool.query("SELECT NAME FROM %s" % self.__schema)
         return [val['NAME'] for val in result]
 
     def get_param_name(self, param_id, syselem):
@@ -164,10 +165,8 @@ class DatabaseLayerImpl:
         :return: String value that is the name
         """
 
-        with self.__connection.cursor() as cursor:
-            query = "SELECT NAME FROM %s WHERE PID= '%s' AND SYSTEM_ELEMENT= '%s'" % (self.__schema, param_id, syselem)
-            cursor.execute(query)
-            result = cursor.fetchone()
+        result = self.__pool.query_one("SELECT NAME FROM %s WHERE PID=%%s AND SYSTEM_ELEMENT=%%s" % self.__schema,
+                                       (param_id, syselem))
         return result['NAME']
 
     def get_metadata(self):
@@ -177,8 +176,5 @@ class DatabaseLayerImpl:
                 "FROM %s a " \
                 "LEFT JOIN DATA_DEFS_TYPE_TBL b ON a.DATACATEGORY=b.PKEY " \
                 "LEFT JOIN DATA_DEFS_TYPE_TBL c ON a.RAW_DATACATEGORY=c.PKEY " \
-                "order by a.PID;" % self.__schema
-        with self.__connection.cursor() as cursor:
-            cursor.execute(query)
-            result = cursor.fetchall()
-        return result
+                "order by a.PID" % self.__schema
+        return self.__pool.query(query)
@@ -1,4 +1,4 @@
-import happybase
+from concurrent.futures import ThreadPoolExecutor
 
 # TODO connection open/close take closer look at what is preferred
 
@@ -14,6 +14,7 @@ class HBaseConnect:
         self.__hostname = hbase_conf_obj['host']
         self.__port = int(hbase_conf_obj['port'])
         self.__connectionpool = None
+        self.__pool_size = int(hbase_conf_obj.get('pool_size', 25))
         self.__dataspace = hbase_conf_obj['dataspace']
 
         # TODO in the future the table specification should be more general, not just for parameter samples
@@ -24,10 +25,19 @@ class HBaseConnect:
         Create the connection to HBase. ConnectionPool establishes the first connection immediately,
         so wrong host or port are immediately detected.
         """
-        self.__connectionpool = happybase.ConnectionPool(size=25,
+        import happybase
+
+        self.__connectionpool = happybase.ConnectionPool(size=self.__pool_size,
                                                          host=self.__hostname,
                                                          port=self.__port)
 
+    def get_pool_size(self):
+        """
+        Get the number of connections in the pool, i.e. the max. number of concurrent scans
+        :return: Integer pool size
+        """
+        return self.__pool_size
+
     def get_families(self):
         """
         Get the table families of a certain table
@@ -73,12 +83,168 @@ class HBaseConnect:
         :param table: String HBase table to search
         :return: iterable for looping over the matching rows
         """
+        # the rows are read in batches, and the connection is given back to the pool between them,
+        # so scans that are not exhausted do not keep the pool busy
+        for batch in self.scan_batches(start_key, end_key, min(buffsize, maxsamples)):
+            for row in batch:
+                yield row
+
+    def fetch_scan(self, start_key, end_key, buffsize=100000):
+        """
+        Scans HBase for a specific parameter in a timestamp range, and reads all the matching
+        rows while the connection is still taken from the pool.
+        Safe to be called concurrently from several threads, each one gets its own connection.
+        :param start_key: Bytes start rowkey
+        :param end_key: Bytes end rowkey
+        :param buffsize: Int
+        :return: list of (row_key, row_dict) tuples
+        """
+        with self.__connectionpool.connection() as connection:
+            conn_table = connection.table(self.__table)
+            rows = list(conn_table.scan(row_start=start_key,
+                                        row_stop=end_key,
+                                        reverse=False,
+                                        batch_size=buffsize,
+                                        scan_batching=None))
+        return rows
+
+    def scan_batches(self, start_key, end_key, batch_size=10000):
+        """
+        Scans HBase between two rowkeys, and yields the rows in lists of batch_size rows.
+        Each batch is read with its own scan, and the connection is given back to the pool before
+        the batch is yielded, so a generator that is not exhausted does not hold a connection.
+        :param start_key: Bytes start rowkey
+        :param end_key: Bytes end rowkey
+        :param batch_size: Int number of rows per batch
+        :return: generator of lists of (row_key, row_dict) tuples
+        """
+        while True:
+            batch = self.__read_batch(start_key, end_key, batch_size)
+            if batch:
+                yield batch
+            if len(batch) < batch_size:
+                return
+            # smallest rowkey after the last one read
+            start_key = batch[-1][0] + b'\x00'
+
+    def stream_scan(self, key_ranges, batch_size=10000, prefetch=False, resume_key=None, transform=None):
+        """
+        Scans HBase over a sorted list of key ranges (e.g. the time slices of a parameter),
+        one after the other, yielding batches of rows.
+        :param key_ranges: List of (start_key, end_key) tuples, sorted and not overlapping
+        :param batch_size: Int number of rows per batch
+        :param prefetch: Bool to fetch the next range in the background while the current one is consumed
+        :param resume_key: Bytes last rowkey delivered by an interrupted stream, to go on from there
+        :param transform: function applied to each batch of rows before yielding it
+        :return: ScanStream object
+        """
+        return ScanStream(self, key_ranges, batch_size, prefetch, resume_key, transform)
+
+    """
+    Private Methods
+    """
+    def __read_batch(self, start_key, end_key, batch_size):
+        """
+        Read up to batch_size rows from start_key, while the connection is taken from the pool
+        """
         with self.__connectionpool.connection() as connection:
             conn_table = connection.table(self.__table)
-            scan = conn_table.scan(row_start=start_key,
-                                   row_stop=end_key,
-                                   reverse=False,
-                                   batch_size=min(buffsize, maxsamples),
-                                   scan_batching=None) #True
+            return list(conn_table.scan(row_start=start_key,
+                                        row_stop=end_key,
+                                        reverse=False,
+                                        batch_size=batch_size,
+                                        limit=batch_size,
+                                        scan_batching=None))
+
+
+class ScanStream:
+    """
+    Iterator over the batches of rows of a list of key ranges, scanned one after the other.
+    It records the last rowkey delivered, so an interrupted retrieval can be resumed with
+    HBaseConnect.stream_scan(..., resume_key=stream.get_last_key()).
+    The resume is at-least-once: the last key of a batch is only recorded when the consumer asks
+    for the next one, so the batch being processed when the retrieval was interrupted is
+    delivered again by the resumed stream, and the consumer has to tolerate (or drop) it.
+    :param hbaseconn: HBaseConnect object
+    :param key_ranges: List of (start_key, end_key) tuples, sorted and not overlapping
+    :param batch_size: Int number of rows per batch
+    :param prefetch: Bool to fetch the next range in the background
+    :param resume_key: Bytes last rowkey already delivered, or None to start from the beginning
+    :param transform: function applied to each batch of rows before yielding it
+    """
+
+    def __init__(self, hbaseconn, key_ranges, batch_size=10000, prefetch=False, resume_key=None, transform=None):
+        self.__hbaseconn = hbaseconn
+        self.__batch_size = batch_size
+        self.__prefetch = prefetch
+        self.__transform = transform
+        self.__last_key = resume_key
+        self.__key_ranges = self.__skip_delivered(key_ranges, resume_key)
 
-        return scan
+    def get_last_key(self):
+        """
+        Get the last rowkey delivered by the stream
+        :return: Bytes rowkey, None if nothing has been delivered yet
+        """
+        return self.__last_key
+
+    def get_key_ranges(self):
+        """
+        Get the key ranges still to be scanned when the stream was created
+        :return: List of (start_key, end_key) tuples
+        """
+        return list(self.__key_ranges)
+
+    def __iter__(self):
+        if self.__prefetch:
+            batches = self.__iter_prefetched()
+        else:
+            batches = (batch
+                       for start_key, end_key in self.__key_ranges
+                       for batch in self.__hbaseconn.scan_batches(start_key, end_key, self.__batch_size))
+        for batch in batches:
+            last_key = batch[-1][0]
+            if self.__transform is not None:
+                batch = self.__transform(batch)
+            yield batch
+            # only recorded once the consumer has asked for the next batch
+            self.__last_key = last_key
+
+    """
+    Private Methods
+    """
+    def __iter_prefetched(self):
+        """
+        Yields the batches of each range, while the next range is read by a background thread
+        """
+        if not self.__key_ranges:
+            return
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(self.__fetch_range, self.__key_ranges[0])
+            for i in range(len(self.__key_ranges)):
+                batches = future.result()
+                if i + 1 < len(self.__key_ranges):
+                    future = executor.submit(self.__fetch_range, self.__key_ranges[i + 1])
+                for batch in batches:
+                    yield batch
+
+    def __fetch_range(self, key_range):
+        start_key, end_key = key_range
+        return list(self.__hbaseconn.scan_batches(start_key, end_key, self.__batch_size))
+
+    @staticmethod
+    def __skip_delivered(key_ranges, resume_key):
+        """
+        Remove from the list of key ranges the part up to (and including) the resume key
+        """
+        if resume_key is None:
+            return list(key_ranges)
+        ranges = []
+        for start_key, end_key in key_ranges:
+            if end_key <= resume_key:
+                continue
+            if start_key <= resume_key:
+                # smallest rowkey after the resume key
+                start_key = resume_key + b'\x00'
+            ranges.append((start_key, end_key))
+        return ranges
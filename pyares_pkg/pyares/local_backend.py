@@ -0,0 +1,276 @@
+import csv
+import sqlite3
+import threading
+
+from datetime import datetime, timezone
+
+import pyares.param_pb2 as param_pb2
+from pyares.database_layer import DatabaseLayer
+from pyares.hbase_connect import ScanStream
+from pyares.protobuf import VALUE_FIELDS
+from pyares.row_key import encode_row_key
+
+
+class LocalStore:
+    """
+    Embedded stand-in for the ARES cluster, kept in a single sqlite file: the parameter
+    definitions (as in the MariaDB DATA_DEFS_TBL table) and the parameter samples, sorted by
+    the same rowkey as the HBase ARES_<dataspace>_ParamSamples table (3 bytes PID + 8 bytes
+    timestamp), with the ParamSample protobuf buffer as value.
+    Each thread uses its own sqlite connection, so it can be shared by concurrent scans.
+    :param store_file: String path of the sqlite file
+    """
+
+    def __init__(self, store_file):
+        self.__store_file = store_file
+        self.__local = threading.local()
+        db = self.get_connection()
+        db.execute("CREATE TABLE IF NOT EXISTS DATA_DEFS_TBL ("
+                   "PID INTEGER NOT NULL, NAME TEXT NOT NULL, SYSTEM_ELEMENT TEXT NOT NULL, "
+                   "DESCRIPTION TEXT, ENGVALUNIT TEXT, DATACATEGORY_str TEXT, RAW_DATACATEGORY_str TEXT, "
+                   "ACTIVE INTEGER, PRIMARY KEY (PID, SYSTEM_ELEMENT))")
+        db.execute("CREATE INDEX IF NOT EXISTS DATA_DEFS_NAME ON DATA_DEFS_TBL (NAME)")
+        db.execute("CREATE TABLE IF NOT EXISTS PARAM_SAMPLES ("
+                   "ROWKEY BLOB PRIMARY KEY, VALUE BLOB NOT NULL) WITHOUT ROWID")
+        db.commit()
+
+    def get_connection(self):
+        """
+        Get the sqlite connection of the calling thread
+        :return: sqlite3.Connection, returning the rows as dictionaries
+        """
+        db = getattr(self.__local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.__store_file)
+            db.row_factory = lambda cursor, row: {col[0]: value for col, value in zip(cursor.description, row)}
+            self.__local.db = db
+        return db
+
+    def put_params(self, params):
+        """
+        Store parameter definitions
+        :param params: list of dictionaries with PID, NAME, SYSTEM_ELEMENT and optionally DESCRIPTION,
+                       ENGVALUNIT, DATACATEGORY_str, RAW_DATACATEGORY_str and ACTIVE
+        """
+        db = self.get_connection()
+        db.executemany("INSERT OR REPLACE INTO DATA_DEFS_TBL VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                       [(p['PID'], p['NAME'], p['SYSTEM_ELEMENT'], p.get('DESCRIPTION'), p.get('ENGVALUNIT'),
+                         p.get('DATACATEGORY_str'), p.get('RAW_DATACATEGORY_str', p.get('DATACATEGORY_str')),
+                         p.get('ACTIVE', 1)) for p in params])
+        db.commit()
+
+    def put_samples(self, rows):
+        """
+        Store parameter samples
+        :param rows: iterable of (rowkey, buffer) tuples
+        """
+        db = self.get_connection()
+        db.executemany("INSERT OR REPLACE INTO PARAM_SAMPLES VALUES (?, ?)", rows)
+        db.commit()
+
+
+class LocalDatabaseLayer(DatabaseLayer):
+    """
+    Database layer on a LocalStore, with the same queries as DatabaseLayerImpl
+    :param store: LocalStore object
+    """
+
+    def __init__(self, store):
+        self.__store = store
+
+    def fetch_all(self):
+        return self.__query("SELECT * FROM DATA_DEFS_TBL")
+
+    def get_param_id(self, param_name, syselem):
+        return self.__query_one("SELECT PID FROM DATA_DEFS_TBL WHERE NAME=? AND SYSTEM_ELEMENT=?",
+                                (param_name, syselem))['PID']
+
+    def get_param_re_names(self, param_name_re, syselem):
+        return [row['PID'] for row in self.__query("SELECT PID FROM DATA_DEFS_TBL WHERE NAME LIKE ? "
+                                                   "AND SYSTEM_ELEMENT=? ORDER BY PID", (param_name_re, syselem))]
+
+    def get_params_from_pids(self, frompid, topid, syselem=None):
+        return [{'PID': row['PID'], 'NAME': row['NAME']}
+                for row in self.get_params_sysel_from_pids(frompid, topid, syselem)]
+
+    def get_params_sysel_from_pids(self, frompid, topid, syselem=None):
+        if not syselem:
+            return self.__query("SELECT PID,NAME,SYSTEM_ELEMENT FROM DATA_DEFS_TBL WHERE PID BETWEEN ? AND ?",
+                                (frompid, topid))
+        return self.__query("SELECT PID,NAME,SYSTEM_ELEMENT FROM DATA_DEFS_TBL WHERE SYSTEM_ELEMENT=? "
+                            "AND PID BETWEEN ? AND ?", (syselem, frompid, topid))
+
+    def get_params_pid_sysel_from_names(self, names):
+        return self.__query_in("SELECT PID,SYSTEM_ELEMENT FROM DATA_DEFS_TBL WHERE NAME IN (%s)", names)
+
+    def get_param_names_from_ids(self, param_ids, syselem=None):
+        rows = self.__query_in("SELECT PID,NAME,SYSTEM_ELEMENT FROM DATA_DEFS_TBL WHERE PID IN (%s) ORDER BY PID",
+                               sorted(set(param_ids)))
+        return [row for row in rows if syselem is None or row['SYSTEM_ELEMENT'] == syselem]
+
+    def get_description(self, param, syselem):
+        column = 'NAME' if type(param) == str else 'PID'
+        return self.__query_one("SELECT DESCRIPTION FROM DATA_DEFS_TBL WHERE %s=? AND SYSTEM_ELEMENT=?" % column,
+                                (param, syselem))['DESCRIPTION']
+
+    def get_paramnames_list(self):
+        return [row['NAME'] for row in self.__query("SELECT NAME FROM DATA_DEFS_TBL")]
+
+    def get_param_name(self, param_id, syselem):
+        return self.__query_one("SELECT NAME FROM DATA_DEFS_TBL WHERE PID=? AND SYSTEM_ELEMENT=?",
+                                (param_id, syselem))['NAME']
+
+    def get_metadata(self):
+        return self.__query("SELECT * FROM DATA_DEFS_TBL ORDER BY PID")
+
+    def _get_params_from_names(self, names):
+        return self.__query_in("SELECT PID,NAME,SYSTEM_ELEMENT FROM DATA_DEFS_TBL WHERE NAME IN (%s) ORDER BY PID",
+                               names)
+
+    """
+    Private Methods
+    """
+    def __query(self, query, args=()):
+        return self.__store.get_connection().execute(query, args).fetchall()
+
+    def __query_one(self, query, args=()):
+        return self.__store.get_connection().execute(query, args).fetchone()
+
+    def __query_in(self, query_tpl, values):
+        # sqlite limits the number of host parameters of a statement
+        result = []
+        for i in range(0, len(values), 500):
+            chunk = list(values[i:i + 500])
+            result.extend(self.__query(query_tpl % ','.join(['?'] * len(chunk)), chunk))
+        return result
+
+
+class LocalSampleTable:
+    """
+    Sample table on a LocalStore, with the same methods as HBaseConnect.
+    Rows are returned as HBase rows: (rowkey, {b'v:e': buffer}) tuples.
+    :param store: LocalStore object
+    :param pool_size: Integer max. number of concurrent scans reported to the provider
+    """
+
+    def __init__(self, store, pool_size=4):
+        self.__store = store
+        self.__pool_size = pool_size
+
+    def create_hbase_layer(self):
+        pass
+
+    def get_pool_size(self):
+        return self.__pool_size
+
+    def get_families(self):
+        return {b'v': {}}
+
+    def get_row(self, rowkey):
+        row = self.__store.get_connection().execute("SELECT VALUE FROM PARAM_SAMPLES WHERE ROWKEY=?",
+                                                    (rowkey,)).fetchone()
+        return {b'v:e': row['VALUE']} if row else {}
+
+    def get_rows(self, rowkeys):
+        return (self.get_row(rowkey) for rowkey in rowkeys)
+
+    def create_scan(self, start_key, end_key, buffsize=100000, maxsamples=100000):
+        for batch in self.scan_batches(start_key, end_key, min(buffsize, maxsamples)):
+            for row in batch:
+                yield row
+
+    def fetch_scan(self, start_key, end_key, buffsize=100000):
+        return [row for batch in self.scan_batches(start_key, end_key, buffsize) for row in batch]
+
+    def scan_batches(self, start_key, end_key, batch_size=10000):
+        cursor = self.__store.get_connection().execute("SELECT ROWKEY, VALUE FROM PARAM_SAMPLES "
+                                                       "WHERE ROWKEY>=? AND ROWKEY<? ORDER BY ROWKEY",
+                                                       (start_key, end_key))
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield [(row['ROWKEY'], {b'v:e': row['VALUE']}) for row in rows]
+
+    def stream_scan(self, key_ranges, batch_size=10000, prefetch=False, resume_key=None, transform=None):
+        return ScanStream(self, key_ranges, batch_size, prefetch, resume_key, transform)
+
+
+def parse_test_time(timestr):
+    """
+    Convert a time of the test data files to microseconds from Unix Epoch 0
+    :param timestr: String in the format YYYY-DOYThh:mm:ss[.ffffff] (UTC)
+    :return: Integer timestamp in microseconds
+    """
+    fmt = '%Y-%jT%H:%M:%S.%f' if '.' in timestr else '%Y-%jT%H:%M:%S'
+    dt = datetime.strptime(timestr, fmt).replace(tzinfo=timezone.utc)
+    return int(dt.timestamp()) * 1000000 + dt.microsecond
+
+
+def encode_sample(pid, gen_time, sam_type, value, validity=param_pb2.ParamSample.VALID):
+    """
+    Build the HBase row of a parameter sample
+    :param pid: Integer PID
+    :param gen_time: Integer timestamp in microseconds
+    :param sam_type: Integer type code
+    :param value: value of the sample
+    :param validity: Integer validity
+    :return: tuple (rowkey, ParamSample protobuf buffer)
+    """
+    paramsam = param_pb2.ParamSample()
+    paramsam.pid = pid
+    paramsam.gen_time = gen_time
+    paramsam.validity = validity
+    paramsam.type = sam_type
+    field = VALUE_FIELDS[sam_type]
+    if field == 'v_bit':
+        value = bool(int(value))
+    elif field == 'v_long':
+        value = int(value)
+    elif field in ('v_flt', 'v_dbl'):
+        value = float(value)
+    else:
+        value = str(value)
+    setattr(paramsam, field, value)
+
+    return (encode_row_key(pid, gen_time), paramsam.SerializeToString())
+
+
+def load_test_data(store, paramdef_file, paramvalue_file, syselem='TM', first_pid=1):
+    """
+    Load parameter definitions and samples in the format of the data/test_paramdef.csv
+    (Parameter, Type, Description, Unit, Active) and data/test_paramvalue.dat
+    (Parameter, Time, Value) files into a LocalStore. PIDs are assigned in the order of the definitions.
+    :param store: LocalStore object
+    :param paramdef_file: String path of the definitions file
+    :param paramvalue_file: String path of the samples file
+    :param syselem: String system element of the parameters
+    :param first_pid: Integer PID of the first parameter
+    :return: dictionary name -> PID of the loaded parameters
+    """
+    params = []
+    with open(paramdef_file, newline='') as fdef:
+        reader = csv.reader(fdef, skipinitialspace=True)
+        next(reader)
+        for pid, row in enumerate((r for r in reader if r), start=first_pid):
+            name, type_name, description, unit, active = [field.strip() for field in row[:5]]
+            params.append({'PID': pid, 'NAME': name, 'SYSTEM_ELEMENT': syselem,
+                           'DESCRIPTION': description, 'ENGVALUNIT': unit,
+                           'DATACATEGORY_str': type_name.upper(), 'ACTIVE': int(active)})
+    store.put_params(params)
+
+    pids = {p['NAME']: p['PID'] for p in params}
+    types = {p['NAME']: param_pb2.Type.Value(p['DATACATEGORY_str']) for p in params}
+    with open(paramvalue_file, newline='') as fval:
+        reader = csv.reader(fval, skipinitialspace=True)
+        next(reader)
+        rows = []
+        for row in reader:
+            if not row:
+                continue
+            name, timestr, value = [field.strip() for field in row[:3]]
+            if name not in pids:
+                raise ValueError('Samples for parameter {} not defined in {}'.format(name, paramdef_file))
+            rows.append(encode_sample(pids[name], parse_test_time(timestr), types[name], value))
+    store.put_samples(rows)
+    return pids
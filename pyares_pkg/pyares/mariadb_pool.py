@@ -0,0 +1,189 @@
+import queue
+import threading
+import time
+
+from contextlib import contextmanager
+
+
+class MariaDBPool:
+    """
+    Thread safe pool of pymysql connections to the ARES metadata database.
+    Connections are opened on demand, up to size, and given back to the pool after each query.
+    A connection idle for more than ping_interval seconds is checked (and reconnected if needed)
+    before being used, and one that fails with a connection error is dropped: the query is then
+    retried once with a new connection, and the idle connections are checked before their next use.
+    The queries are parameterized (%s placeholders, values passed apart) so the statements are
+    never built from the values.
+    :param host: String name or IP address of the host
+    :param port: Integer port
+    :param user: String
+    :param password: String
+    :param database: String
+    :param size: Integer max. number of open connections
+    :param ping_interval: Float seconds a connection can stay idle before it is checked
+    :param connect_timeout: Float seconds to wait for a new connection
+    """
+
+    __shared = {}
+    __shared_lock = threading.Lock()
+
+    def __init__(self, host, port, user, password, database, size=4, ping_interval=30, connect_timeout=10):
+        self.__settings = dict(host=host, port=int(port), user=user, password=password, db=database,
+                               connect_timeout=connect_timeout)
+        self.__size = max(1, int(size))
+        self.__ping_interval = ping_interval
+        self.__idle = queue.LifoQueue()   # (connection, time given back)
+        self.__slots = threading.BoundedSemaphore(self.__size)
+        self.__lock = threading.Lock()
+        self.__opened = 0
+        self.__failed = 0.0                # time of the last connection error
+        self.__closed = False
+
+    @classmethod
+    def get_shared(cls, host, port, user, password, database, size=4, ping_interval=30):
+        """
+        Get the pool shared by all the clients of this process for a given database and user,
+        e.g. the database layers of several providers and the AresDBConnection of the GUIs
+        :return: MariaDBPool object
+        """
+        key = (host, int(port), user, database)
+        with cls.__shared_lock:
+            pool = cls.__shared.get(key)
+            if pool is None or pool.is_closed():
+                pool = cls(host, port, user, password, database, size, ping_interval)
+                cls.__shared[key] = pool
+        return pool
+
+    @classmethod
+    def from_datasource(cls, datasource):
+        """
+        Get the shared pool for the settings of a DataSource
+        :param datasource: DataSource object
+        :return: MariaDBPool object
+        """
+        return cls.get_shared(datasource.get_host(), datasource.get_port(), datasource.get_user(),
+                              datasource.get_password(), datasource.get_database(),
+                              datasource.get_pool_size(), datasource.get_ping_interval())
+
+    def get_size(self):
+        return self.__size
+
+    def is_closed(self):
+        return self.__closed
+
+    def get_opened(self):
+        """
+        :return: Integer number of connections currently open (idle or in use)
+        """
+        return self.__opened
+
+    @contextmanager
+    def connection(self, new=False):
+        """
+        Borrow a connection of the pool, waiting for one if all of them are in use
+        :param new: Bool to open a new connection instead of using an idle one
+        :return: context manager giving a pymysql connection
+        """
+        import pymysql
+
+        if self.__closed:
+            raise ValueError('The MariaDB connection pool is closed')
+        self.__slots.acquire()
+        conn = None
+        try:
+            conn = self.__open() if new else self.__checkout()
+            yield conn
+        except (pymysql.OperationalError, pymysql.InterfaceError):
+            self.__failed = time.monotonic()
+            self.__discard(conn)
+            conn = None
+            raise
+        finally:
+            if conn is not None:
+                if self.__closed:
+                    self.__discard(conn)
+                else:
+                    self.__idle.put((conn, time.monotonic()))
+                    if self.__closed:
+                        # closed while it was given back
+                        self.close()
+            self.__slots.release()
+
+    def query(self, query, args=None):
+        """
+        Run a parameterized query, retrying it once with a new connection if the connection fails
+        :param query: String statement with %s placeholders
+        :param args: tuple or list with the values of the placeholders
+        :return: list of rows, as dictionaries
+        """
+        import pymysql
+
+        try:
+            return self.__run(query, args)
+        except (pymysql.OperationalError, pymysql.InterfaceError):
+            return self.__run(query, args, new=True)
+
+    def query_one(self, query, args=None):
+        """
+        Run a parameterized query returning a single row
+        :return: dictionary with the first row, None if there is none
+        """
+        rows = self.query(query, args)
+        return rows[0] if rows else None
+
+    def close(self):
+        """
+        Close the pool: the idle connections are closed now, the ones in use when given back,
+        and no new connection can be borrowed
+        """
+        self.__closed = True
+        while True:
+            try:
+                conn, _ = self.__idle.get_nowait()
+            except queue.Empty:
+                break
+            self.__discard(conn)
+
+    """
+    Private Methods
+    """
+    def __run(self, query, args, new=False):
+        with self.connection(new) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(query, args)
+                return cursor.fetchall()
+
+    def __checkout(self):
+        """
+        Get an idle connection, checking it if it was idle for long or given back before
+        a connection error, or open a new one
+        """
+        try:
+            conn, released = self.__idle.get_nowait()
+        except queue.Empty:
+            return self.__open()
+        if time.monotonic() - released > self.__ping_interval or released <= self.__failed:
+            try:
+                conn.ping(reconnect=True)
+            except Exception:
+                self.__discard(conn)
+                return self.__open()
+        return conn
+
+    def __open(self):
+        import pymysql.cursors
+
+        conn = pymysql.connect(cursorclass=pymysql.cursors.DictCursor, autocommit=True, **self.__settings)
+        with self.__lock:
+            self.__opened += 1
+        return conn
+
+    def __discard(self, conn):
+        if conn is None:
+            return
+        with self.__lock:
+            self.__opened -= 1
+        try:
+            conn.close()
+        except Exception:
+            pass
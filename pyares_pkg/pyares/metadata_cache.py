@@ -0,0 +1,287 @@
+import sqlite3
+import threading
+import time
+
+from collections import OrderedDict
+
+
+class MetadataCache:
+    """
+    Cache for the static parameter definitions: name <-> PID <-> system element <-> type.
+    It has an in-memory LRU tier and an optional on-disk tier (sqlite file), that can be shared
+    by all the processes (e.g. Spark executors) running in the same node.
+    Entries older than ttl seconds are considered stale, and are fetched again from MariaDB.
+    A name is only resolved without system element (lowest PID, as the database layer does) once all
+    the definitions were loaded with preload, otherwise it could pick a PID other than the database one.
+    If the on-disk tier is locked by another process, it is skipped and the lookups go to MariaDB.
+    :param max_entries: Integer max. number of parameters in the in-memory tier
+    :param cache_file: String path of the sqlite file for the on-disk tier, None for memory only
+    :param ttl: Integer time to live of the entries, in seconds
+    """
+
+    __shared = {}
+    __shared_lock = threading.Lock()
+
+    def __init__(self, max_entries=100000, cache_file=None, ttl=86400):
+        self.__max_entries = max_entries
+        self.__ttl = ttl
+        self.__lock = threading.RLock()
+        self.__by_name = OrderedDict()  # (name, syselem) -> (record, time stored)
+        self.__by_pid = {}              # (pid, syselem) -> (name, syselem)
+        self.__any_name = {}            # name -> syselem of its lowest PID, filled by preload
+        self.__preloaded = None         # time of the last preload
+
+        self.__db = None
+        if cache_file:
+            self.__db = sqlite3.connect(cache_file, check_same_thread=False)
+            try:
+                self.__db.execute("CREATE TABLE IF NOT EXISTS PARAMS ("
+                                  "NAME TEXT NOT NULL, SYSTEM_ELEMENT TEXT NOT NULL, PID INTEGER NOT NULL, "
+                                  "DATA_TYPE TEXT, STORED REAL NOT NULL, PRIMARY KEY (NAME, SYSTEM_ELEMENT))")
+                self.__db.execute("CREATE INDEX IF NOT EXISTS PARAMS_PID ON PARAMS (PID)")
+                self.__db.execute("CREATE TABLE IF NOT EXISTS STATE (NAME TEXT PRIMARY KEY, VALUE REAL)")
+                self.__db.commit()
+            except sqlite3.OperationalError:
+                # locked by another process: memory only
+                self.__db.close()
+                self.__db = None
+
+    @classmethod
+    def get_shared(cls, max_entries=100000, cache_file=None, ttl=86400):
+        """
+        Get the cache instance shared by all the providers of this process for a given cache file,
+        so that creating a new provider does not start with an empty cache
+        :param max_entries: Integer max. number of parameters in the in-memory tier
+        :param cache_file: String path of the sqlite file, None for memory only
+        :param ttl: Integer time to live of the entries, in seconds
+        :return: MetadataCache object
+        """
+        with cls.__shared_lock:
+            cache = cls.__shared.get(cache_file)
+            if cache is None:
+                cache = cls(max_entries, cache_file, ttl)
+                cls.__shared[cache_file] = cache
+        return cache
+
+    def get(self, name, syselem=None):
+        """
+        Get the definition of a parameter from its name
+        :param name: String name of the parameter
+        :param syselem: String system element, None matches any
+        :return: dictionary with PID, NAME, SYSTEM_ELEMENT and DATA_TYPE, or None if not cached
+        """
+        with self.__lock:
+            if syselem is None:
+                if not self.__is_complete():
+                    return None
+                if name in self.__any_name:
+                    syselem = self.__any_name[name]
+            record = self.__get_memory((name, syselem)) if syselem is not None else None
+            if record is None:
+                if syselem is None:
+                    record = self.__query_disk("WHERE NAME=? ORDER BY PID LIMIT 1", (name,))
+                else:
+                    record = self.__query_disk("WHERE NAME=? AND SYSTEM_ELEMENT=?", (name, syselem))
+        return record
+
+    def get_by_pid(self, pid, syselem=None):
+        """
+        Get the definition of a parameter from its PID
+        :param pid: Integer PID
+        :param syselem: String system element, None matches any
+        :return: dictionary with PID, NAME, SYSTEM_ELEMENT and DATA_TYPE, or None if not cached
+        """
+        with self.__lock:
+            key = self.__by_pid.get((pid, syselem))
+            record = self.__get_memory(key) if key else None
+            if record is None:
+                if syselem is None:
+                    record = self.__query_disk("WHERE PID=? LIMIT 1", (pid,))
+                else:
+                    record = self.__query_disk("WHERE PID=? AND SYSTEM_ELEMENT=?", (pid, syselem))
+        return record
+
+    def put(self, pid, name, syselem, data_type=None):
+        """
+        Store the definition of a parameter
+        :param pid: Integer PID
+        :param name: String name of the parameter
+        :param syselem: String system element
+        :param data_type: String with the data type, if known
+        """
+        self.put_many([{'PID': pid, 'NAME': name, 'SYSTEM_ELEMENT': syselem, 'DATA_TYPE': data_type}])
+
+    def put_many(self, records):
+        """
+        Store the definitions of a list of parameters. A record without DATA_TYPE keeps the data type
+        already cached for the same parameter and PID (e.g. by preload)
+        :param records: list of dictionaries with PID, NAME, SYSTEM_ELEMENT and (optionally) DATA_TYPE
+        """
+        now = time.time()
+        with self.__lock:
+            records = [self.__merge_type(self.__make_record(record)) for record in records]
+            for record in records:
+                self.__put_memory(record, now)
+            self.__write_disk("INSERT OR REPLACE INTO PARAMS VALUES (?, ?, ?, COALESCE(?, "
+                              "(SELECT DATA_TYPE FROM PARAMS WHERE NAME=? AND SYSTEM_ELEMENT=? AND PID=?)), ?)",
+                              [(r['NAME'], r['SYSTEM_ELEMENT'], r['PID'], r['DATA_TYPE'],
+                                r['NAME'], r['SYSTEM_ELEMENT'], r['PID'], now) for r in records])
+
+    def preload(self, dblayer):
+        """
+        Fill the cache with all the parameter definitions of the database, which also allows
+        to resolve the names without system element
+        :param dblayer: DatabaseLayer object
+        """
+        metadata = dblayer.get_metadata()
+        now = time.time()
+        with self.__lock:
+            self.put_many([{'PID': row['PID'],
+                            'NAME': row['NAME'],
+                            'SYSTEM_ELEMENT': row['SYSTEM_ELEMENT'],
+                            'DATA_TYPE': row.get('DATACATEGORY_str')} for row in metadata])
+            lowest = {}
+            for row in metadata:
+                if row['NAME'] not in lowest or row['PID'] < lowest[row['NAME']][0]:
+                    lowest[row['NAME']] = (row['PID'], row['SYSTEM_ELEMENT'])
+            self.__any_name = {name: syselem for name, (pid, syselem) in lowest.items()}
+            self.__preloaded = now
+            self.__write_disk("INSERT OR REPLACE INTO STATE VALUES ('PRELOADED', ?)", [(now,)])
+
+    def clear(self):
+        """
+        Remove all the entries of the cache, in memory and on disk
+        """
+        with self.__lock:
+            self.__by_name.clear()
+            self.__by_pid.clear()
+            self.__any_name = {}
+            self.__preloaded = None
+            self.__write_disk("DELETE FROM PARAMS", [()])
+            self.__write_disk("DELETE FROM STATE", [()])
+
+    def __len__(self):
+        return len(self.__by_name)
+
+    """
+    Private Methods
+    """
+    def __make_record(self, record):
+        return {'PID': record['PID'],
+                'NAME': record['NAME'],
+                'SYSTEM_ELEMENT': record['SYSTEM_ELEMENT'],
+                'DATA_TYPE': record.get('DATA_TYPE')}
+
+    def __merge_type(self, record):
+        """
+        Fill the missing data type of a record with the one cached for the same parameter and PID
+        """
+        if record['DATA_TYPE'] is not None:
+            return record
+        key = (record['NAME'], record['SYSTEM_ELEMENT'])
+        entry = self.__by_name.get(key)
+        if entry is not None:
+            cached = entry[0]
+        else:
+            cached = self.__query_disk("WHERE NAME=? AND SYSTEM_ELEMENT=?", key)
+        if cached is not None and cached['PID'] == record['PID']:
+            record['DATA_TYPE'] = cached['DATA_TYPE']
+        return record
+
+    def __get_memory(self, key):
+        """
+        Get a record from the in-memory tier, dropping it if it is stale
+        """
+        entry = self.__by_name.get(key)
+        if entry is None:
+            return None
+        record, stored = entry
+        if time.time() - stored > self.__ttl:
+            self.__remove_memory(key)
+            return None
+        self.__by_name.move_to_end(key)
+        return record
+
+    def __is_complete(self):
+        """
+        Check if all the definitions were preloaded (by this process, or by another one in the
+        on-disk tier) less than ttl seconds ago
+        """
+        if self.__preloaded is not None and time.time() - self.__preloaded <= self.__ttl:
+            return True
+        if self.__db is None:
+            return False
+        try:
+            row = self.__db.execute("SELECT VALUE FROM STATE WHERE NAME='PRELOADED'").fetchone()
+        except sqlite3.OperationalError:
+            return False
+        return row is not None and time.time() - row[0] <= self.__ttl
+
+    def __query_disk(self, where, args):
+        """
+        Get a record from the on-disk tier
+        :return: the record, None if it is not there or the file is locked by another process
+        """
+        if self.__db is None:
+            return None
+        try:
+            row = self.__db.execute("SELECT NAME, SYSTEM_ELEMENT, PID, DATA_TYPE, STORED FROM PARAMS "
+                                    + where, args).fetchone()
+        except sqlite3.OperationalError:
+            return None
+        return self.__get_disk(row)
+
+    def __write_disk(self, statement, rows):
+        """
+        Run a statement on the on-disk tier for a list of rows, skipping it if the file is locked
+        """
+        if self.__db is None:
+            return
+        try:
+            self.__db.executemany(statement, rows)
+            self.__db.commit()
+        except sqlite3.OperationalError:
+            self.__db.rollback()
+
+    def __get_disk(self, row):
+        """
+        Convert a row of the on-disk tier into a record, promoting it to the in-memory tier
+        """
+        if row is None:
+            return None
+        name, syselem, pid, data_type, stored = row
+        if time.time() - stored > self.__ttl:
+            return None
+        record = {'PID': pid, 'NAME': name, 'SYSTEM_ELEMENT': syselem, 'DATA_TYPE': data_type}
+        self.__put_memory(record, stored)
+        return record
+
+    def __put_memory(self, record, stored):
+        """
+        Store a record in the in-memory tier, under the name and the PID, the latter both
+        with its system element and with None (any system element)
+        """
+        name, pid, syselem = record['NAME'], record['PID'], record['SYSTEM_ELEMENT']
+        key = (name, syselem)
+        previous = self.__by_name.get(key)
+        if previous is not None and previous[0]['PID'] != pid:
+            self.__remove_memory(key)
+        self.__by_name[key] = (record, stored)
+        self.__by_name.move_to_end(key)
+        self.__by_pid[(pid, syselem)] = key
+        self.__by_pid.setdefault((pid, None), key)
+
+        while len(self.__by_name) > self.__max_entries:
+            self.__remove_memory(next(iter(self.__by_name)))
+
+    def __remove_memory(self, key):
+        """
+        Drop a record from the in-memory tier, with its PID entries
+        """
+        entry = self.__by_name.pop(key, None)
+        if entry is None:
+            return
+        record = entry[0]
+        for pid_key in ((record['PID'], key[1]), (record['PID'], None)):
+            if self.__by_pid.get(pid_key) == key:
+                del self.__by_pid[pid_key]
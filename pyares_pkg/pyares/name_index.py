@@ -0,0 +1,199 @@
+import fnmatch
+import re
+
+import numpy as np
+
+try:
+    import re._parser as sre_parse
+except ImportError:
+    import sre_parse
+
+# characters that make a parameter name a glob pattern
+GLOB_CHARS = '*?['
+
+# prefix of the parameter names that are regular expressions
+REGEX_PREFIX = 're:'
+
+
+def is_name_pattern(name):
+    """
+    Check if a parameter name given to the retrieval methods is a pattern (glob, or regular
+    expression with the re: prefix) instead of a plain name
+    :param name: String
+    :return: Bool
+    """
+    return name.startswith(REGEX_PREFIX) or any(c in name for c in GLOB_CHARS)
+
+
+class ParameterNameIndex:
+    """
+    In-process index of the parameter names, built once from the parameter definitions,
+    to select parameters with glob patterns, regular expressions or prefixes without
+    querying the database. The names are kept in a sorted array, for the prefix queries,
+    with an index of their trigrams to narrow down the candidates of the patterns before
+    matching them.
+    :param records: iterable of dictionaries with PID, NAME and SYSTEM_ELEMENT
+    """
+
+    def __init__(self, records):
+        records = sorted(((r['NAME'], r['SYSTEM_ELEMENT'], r['PID']) for r in records),
+                         key=lambda r: (r[0], r[1] or '', r[2]))
+        self.__name_list = [r[0] for r in records]
+        self.__names = np.array(self.__name_list, dtype=np.str_)
+        self.__syselems = [r[1] for r in records]
+        self.__pids = np.array([r[2] for r in records], dtype=np.int64)
+
+        trigrams = {}
+        for i, (name, syselem, pid) in enumerate(records):
+            for trigram in set(name[j:j + 3] for j in range(len(name) - 2)):
+                trigrams.setdefault(trigram, []).append(i)
+        self.__trigrams = {trigram: np.array(rows, dtype=np.int64) for trigram, rows in trigrams.items()}
+
+    def __len__(self):
+        return len(self.__names)
+
+    def find(self, pattern, syselem=None):
+        """
+        Get the parameters matching a pattern as given to the retrieval methods: a glob pattern
+        (e.g. AOCS_*), a regular expression with the re: prefix, or a plain name
+        :param pattern: String
+        :param syselem: String system element, None matches any
+        :return: list of dictionaries with PID, NAME and SYSTEM_ELEMENT, sorted by name
+        """
+        if pattern.startswith(REGEX_PREFIX):
+            return self.find_regex(pattern[len(REGEX_PREFIX):], syselem)
+        if any(c in pattern for c in GLOB_CHARS):
+            return self.find_glob(pattern, syselem)
+        lo, hi = self.__prefix_range(pattern)
+        return self.__records([i for i in range(lo, hi) if self.__name_list[i] == pattern], syselem)
+
+    def find_prefix(self, prefix, syselem=None):
+        """
+        Get the parameters whose name starts with a prefix
+        :param prefix: String
+        :param syselem: String system element, None matches any
+        :return: list of dictionaries with PID, NAME and SYSTEM_ELEMENT, sorted by name
+        """
+        lo, hi = self.__prefix_range(prefix)
+        return self.__records(range(lo, hi), syselem)
+
+    def find_glob(self, pattern, syselem=None):
+        """
+        Get the parameters whose name matches a glob pattern (case sensitive, see fnmatch)
+        :param pattern: String with * ? and [...] wildcards
+        :param syselem: String system element, None matches any
+        :return: list of dictionaries with PID, NAME and SYSTEM_ELEMENT, sorted by name
+        """
+        prefix, literals = _glob_literals(pattern)
+        if pattern == prefix + '*':
+            return self.find_prefix(prefix, syselem)
+        matcher = re.compile(fnmatch.translate(pattern))
+        return self.__match(prefix, literals, matcher.match, syselem)
+
+    def find_regex(self, pattern, syselem=None):
+        """
+        Get the parameters whose name contains a match of a regular expression
+        (use ^ and $ to match whole names)
+        :param pattern: String regular expression
+        :param syselem: String system element, None matches any
+        :return: list of dictionaries with PID, NAME and SYSTEM_ELEMENT, sorted by name
+        """
+        prefix, literals = _regex_literals(pattern)
+        matcher = re.compile(pattern)
+        return self.__match(prefix, literals, matcher.search, syselem)
+
+    """
+    Private Methods
+    """
+    def __prefix_range(self, prefix):
+        """
+        Get the rows of the sorted names that start with a prefix
+        :return: tuple (first row, last row + 1)
+        """
+        if not prefix:
+            return (0, len(self.__names))
+        lo = int(np.searchsorted(self.__names, prefix, 'left'))
+        hi = int(np.searchsorted(self.__names, prefix[:-1] + chr(ord(prefix[-1]) + 1), 'left'))
+        return (lo, hi)
+
+    def __match(self, prefix, literals, match, syselem):
+        """
+        Get the rows of the names matched by a function, checking only the names that have
+        the prefix and all the trigrams of the literals the pattern requires
+        """
+        lo, hi = self.__prefix_range(prefix)
+        candidates = None
+        for literal in literals:
+            for j in range(len(literal) - 2):
+                rows = self.__trigrams.get(literal[j:j + 3])
+                if rows is None:
+                    return []
+                candidates = rows if candidates is None else np.intersect1d(candidates, rows, assume_unique=True)
+        if candidates is None:
+            candidates = np.arange(lo, hi)
+        else:
+            candidates = candidates[(candidates >= lo) & (candidates < hi)]
+        names = self.__name_list
+        return self.__records([i for i in candidates.tolist() if match(names[i])], syselem)
+
+    def __records(self, rows, syselem):
+        pids = self.__pids
+        return [{'PID': int(pids[i]), 'NAME': self.__name_list[i], 'SYSTEM_ELEMENT': self.__syselems[i]}
+                for i in rows if syselem is None or self.__syselems[i] == syselem]
+
+
+def _glob_literals(pattern):
+    """
+    Get the literal parts of a glob pattern
+    :return: tuple (prefix before the first wildcard, list of literal runs)
+    """
+    runs = ['']
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c in '*?':
+            runs.append('')
+        elif c == '[':
+            # as fnmatch.translate: a ']' right after '[' or '[!' is part of the class
+            close = i + 1
+            if close < len(pattern) and pattern[close] == '!':
+                close += 1
+            if close < len(pattern) and pattern[close] == ']':
+                close += 1
+            close = pattern.find(']', close)
+            if close < 0:
+                runs[-1] += c
+            else:
+                runs.append('')
+                i = close
+        else:
+            runs[-1] += c
+        i += 1
+    return (runs[0], [run for run in runs if len(run) >= 3])
+
+
+def _regex_literals(pattern):
+    """
+    Get the literal parts that any match of a regular expression must contain: the runs of
+    literal characters at its top level (none if it has alternatives or flags)
+    :return: tuple (prefix if the expression is anchored at the start, list of literal runs)
+    """
+    try:
+        parsed = sre_parse.parse(pattern)
+    except re.error:
+        return ('', [])
+    if parsed.state.flags & (re.IGNORECASE | re.VERBOSE):
+        return ('', [])
+
+    runs = ['']
+    anchored = False
+    for position, (op, arg) in enumerate(parsed):
+        if op == sre_parse.LITERAL:
+            runs[-1] += chr(arg)
+        elif op == sre_parse.AT and arg == sre_parse.AT_BEGINNING and position == 0:
+            anchored = True
+        elif op == sre_parse.BRANCH:
+            return ('', [])
+        else:
+            runs.append('')
+    return (runs[0] if anchored else '', [run for run in runs if len(run) >= 3])
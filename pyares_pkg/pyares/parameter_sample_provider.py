@@ -2,12 +2,26 @@
 from pyares.data_provisioning_factory import DataProvisioningFactory
 from pyares.data_source import DataSource
 from pyares.hbase_connect import HBaseConnect
+from pyares.local_backend import LocalStore, LocalDatabaseLayer, LocalSampleTable
 from pyares.pyares_conf_factory import PyAresConfigFactory as paconf
-from pyares.protobuf import ProtoBuf
+from pyares.protobuf import ProtoBuf, iter_decoded
 from pyares.sample import Sample
-from pyares.byte_buffer import ByteBuffer
+from pyares.sample_block import SampleBlock
+from pyares.row_key import MAX_PID, decode_row_key, encode_row_key, normalize_time, plan_scan_ranges
+from pyares.metadata_cache import MetadataCache
+from pyares.name_index import ParameterNameIndex, is_name_pattern
+from pyares.sample_columns import SampleColumns, SampleColumnsBuilder, concat_columns
+from pyares.sample_cache import SampleCache
+from pyares.sample_alignment import align_columns
+from pyares.bucket_stats import BucketStats, STATS, resolution_to_interval, rollup_stats
+from pyares.summary_store import SummaryStore
+
+from collections import deque
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 
 import os
+import time
 
 
 class ParameterSampleProvider:
@@ -24,14 +38,26 @@ class ParameterSampleProvider:
                 conf_file = paconf()
         else:
             conf_file = paconf(conf)
-        mariadb_conf = conf_file.get_conf('MariaDB')
-        self.__mariadb = DataSource(mariadb_conf)
+        hbase_conf = conf_file.get_conf('HBase')
+        try:
+            backend = conf_file.get_conf('PyAres').get('backend', 'cluster')
+        except KeyError:
+            backend = 'cluster'
+
+        if backend == 'local':
+            # embedded stand-in for MariaDB and HBase, for offline runs and benchmarks
+            local_conf = conf_file.get_conf('Local')
+            store = LocalStore(os.path.expanduser(local_conf['store_file']))
+            self.__dblayer = LocalDatabaseLayer(store)
+            self.__hbaseconn = LocalSampleTable(store, int(local_conf.get('pool_size', 4)))
+        else:
+            mariadb_conf = conf_file.get_conf('MariaDB')
+            self.__mariadb = DataSource(mariadb_conf)
 
-        factory = DataProvisioningFactory(self.__mariadb)
-        self.__dblayer = factory.create_database_layer()
+            factory = DataProvisioningFactory(self.__mariadb)
+            self.__dblayer = factory.create_database_layer()
 
-        hbase_conf = conf_file.get_conf('HBase')
-        self.__hbaseconn = HBaseConnect(hbase_conf)
+            self.__hbaseconn = HBaseConnect(hbase_conf)
         self.__hbaseconn.create_hbase_layer()
         print("Parameter Sample Provider initialized.")
 
@@ -41,6 +67,54 @@ class ParameterSampleProvider:
         self.param_dict = {}
         self.system_element = 'TM'
 
+        # parameter definitions cache, shared by all the providers of the process
+        try:
+            cache_conf = conf_file.get_conf('Cache')
+        except KeyError:
+            cache_conf = {}
+        self.__metacache = MetadataCache.get_shared(max_entries=int(cache_conf.get('metadata_entries', 100000)),
+                                                    cache_file=cache_conf.get('metadata_file') or None,
+                                                    ttl=int(cache_conf.get('metadata_ttl', 86400)))
+        if str(cache_conf.get('metadata_preload', 'false')).lower() in ('true', 'yes', '1') \
+                and len(self.__metacache) == 0:
+            self.preload_metadata()
+
+        # index of the parameter names for the patterns, built on first use
+        self.__name_index = None
+
+        # cache of the samples already retrieved, shared by all the providers of the process,
+        # disabled unless set in the config file
+        self.__samples = None
+        self.__settle_time = int(cache_conf.get('sample_settle', 3600)) * 1000000
+        if int(cache_conf.get('sample_bytes', 0) or 0) > 0:
+            spill_dir = cache_conf.get('sample_spill_dir') or None
+            self.__samples = SampleCache.get_shared(int(cache_conf['sample_bytes']),
+                                                    os.path.expanduser(spill_dir) if spill_dir else None,
+                                                    int(cache_conf.get('sample_spill_bytes', 1073741824)))
+
+        # downsampled summaries store, disabled unless set in the config file
+        self.__summaries = None
+        if cache_conf.get('summary_file'):
+            levels = [level.strip() for level in cache_conf.get('summary_levels', '1m,1h,1d').split(',')]
+            self.__summaries = SummaryStore(cache_conf['summary_file'],
+                                            [int(level) if level.isdigit() else level for level in levels])
+
+        # concurrent scan mode, disabled (1 worker) unless set in the config file
+        self.__scan_workers = 1
+        self.__max_in_flight = 1
+        scan_workers = int(hbase_conf.get('scan_workers', 1))
+        if scan_workers > 1:
+            self.set_parallel_scans(scan_workers)
+
+        # bulk scan mode of consecutive PIDs, disabled unless set in the config file
+        self.__bulk_scans = False
+        self.__skip_after = None
+        self.__bulk_max_pids = None
+        self.__bulk_batch_size = 10000
+        if str(hbase_conf.get('bulk_scans', 'false')).lower() in ('true', 'yes', '1'):
+            skip_after = hbase_conf.get('skip_after', '')
+            self.set_bulk_scans(int(skip_after) if skip_after else None)
+
     """
     Public Methods
     """
@@ -56,6 +130,131 @@ class ParameterSampleProvider:
         """
         self.system_element = None
 
+    def preload_metadata(self):
+        """
+        Load all the parameter definitions from the database into the metadata cache,
+        so that no further PID lookups are sent to MariaDB while the entries are valid
+        """
+        self.__metacache.preload(self.__dblayer)
+
+    def get_name_index(self, refresh=False):
+        """
+        Get the index of the parameter names used to expand the patterns, built on first use
+        with a single query for the PIDs, names and system elements of all the parameters
+        :param refresh: Bool to build it again (e.g. after new parameters are defined)
+        :return: ParameterNameIndex object
+        """
+        if self.__name_index is None or refresh:
+            records = self.__dblayer.get_params_sysel_from_pids(0, MAX_PID)
+            self.__name_index = ParameterNameIndex(records)
+        return self.__name_index
+
+    def find_parameters(self, pattern, syselem=None):
+        """
+        Get the parameters whose name matches a pattern, from the index of the parameter names
+        :param pattern: String glob pattern (e.g. AOCS_*), regular expression with the re: prefix, or name
+        :param syselem: String system element, None matches any
+        :return: tuple (param_names, param_syselem), sorted by name
+        """
+        data = self.get_name_index().find(pattern, syselem)
+        self.__set_pids([(item['NAME'], item['SYSTEM_ELEMENT'], item['PID']) for item in data])
+        return ([item['NAME'] for item in data], [item['SYSTEM_ELEMENT'] for item in data])
+
+    def expand_parameter_names(self, param_names, param_syselem=None):
+        """
+        Replace the patterns of a list of parameter names by the names of the parameters they match
+        (see find_parameters), keeping the plain names as they are
+        :param param_names: List of strings with parameter names and patterns
+        :param param_syselem: List with the system element of each one (default is the provider one)
+        :return: tuple (param_names, param_syselem)
+        """
+        if param_syselem is None:
+            param_syselem = [self.system_element] * len(param_names)
+        if not any(is_name_pattern(name) for name in param_names):
+            return (param_names, param_syselem)
+
+        names, syselems = [], []
+        for name, syselem in zip(param_names, param_syselem):
+            if not is_name_pattern(name):
+                names.append(name)
+                syselems.append(syselem)
+                continue
+            found_names, found_syselems = self.find_parameters(name, syselem)
+            for found_name, found_syselem in zip(found_names, found_syselems):
+                # with any system element, a name stands for the parameter with the lowest PID
+                if syselem is None and (not names or names[-1] != found_name):
+                    names.append(found_name)
+                    syselems.append(None)
+                elif syselem is not None:
+                    names.append(found_name)
+                    syselems.append(found_syselem)
+        return (names, syselems)
+
+    def get_pool_size(self):
+        """
+        Get the number of pooled HBase connections, i.e. the max. number of scans that can run at once
+        """
+        return self.__hbaseconn.get_pool_size()
+
+    def set_parallel_scans(self, workers=None, max_in_flight=None):
+        """
+        Enable the concurrent scan mode: the HBase scans of the different parameters are
+        spread over the HBase connection pool by a pool of threads.
+        The samples are returned in the same order as the parameter names, and fully materialized:
+        the sample objects and arrays methods return complete lists, so all the scanned samples are
+        in memory at the end. max_in_flight only bounds the scans submitted ahead of the one being
+        collected (which limits the memory of get_parameter_stats, that reduces each parameter as it comes).
+        :param workers: Integer number of scanning threads (default is the HBase connection pool size)
+        :param max_in_flight: Integer max. number of scans submitted and not yet collected (default 2 x workers)
+        """
+        if not workers:
+            workers = self.__hbaseconn.get_pool_size()
+        workers = max(1, min(int(workers), self.__hbaseconn.get_pool_size()))
+        self.__scan_workers = workers
+        self.__max_in_flight = max(workers, int(max_in_flight) if max_in_flight else 2 * workers)
+
+    def set_serial_scans(self):
+        """
+        Disable the concurrent scan mode, parameters are scanned one after the other
+        """
+        self.__scan_workers = 1
+        self.__max_in_flight = 1
+
+    def set_sample_cache(self, cache):
+        """
+        Set the cache of the samples retrieved by get_parameter_arrays (and the methods based on it)
+        :param cache: SampleCache object, None to disable the cache
+        """
+        self.__samples = cache
+
+    def get_sample_cache(self):
+        return self.__samples
+
+    def set_bulk_scans(self, skip_after=10000, max_pids=None, batch_size=10000):
+        """
+        Enable the bulk scan mode of get_parameter_arrays: the rows are keyed by PID and then by time,
+        so the parameters with consecutive PIDs are scanned with a single scan from the start of the
+        first one to the end of the last one, and the rows are demultiplexed by PID as they stream.
+        The rows of the PIDs in between that are outside the time window are dropped; once skip_after
+        of them have been read in a row, the scan jumps to the start of the window of the next PID.
+        :param skip_after: Integer max. number of consecutive rows read outside the window before
+        jumping to the next PID (0 always jumps, None never does and scans each range in one pass).
+        Reopening a scan costs at least one RPC, so it pays off once about a batch of rows is dropped
+        :param max_pids: Integer max. number of PIDs per scan (default is no limit, or an even split
+        of the PIDs among the workers in concurrent scan mode)
+        :param batch_size: Integer number of rows per batch of the scans
+        """
+        self.__bulk_scans = True
+        self.__skip_after = skip_after
+        self.__bulk_max_pids = max_pids
+        self.__bulk_batch_size = batch_size
+
+    def set_single_scans(self):
+        """
+        Disable the bulk scan mode, each parameter is retrieved with its own scan
+        """
+        self.__bulk_scans = False
+
     def get_param_metadata_df(self):
         """
         Get all the parameter metadata into a pandas dataframe.
@@ -79,7 +278,8 @@ class ParameterSampleProvider:
         """
         return self.__dblayer.get_paramnames_list()
 
-    def get_parameter_data_df(self, param_names, start, end):
+    def get_parameter_data_df(self, param_names, start, end, align='exact', step=None, bfill=False,
+                              sample_filter=None):
         """
         Get all the available samples for a given n parameter names and return a pandas dataframe with their data.
         Colums: Timestamp, Param_1, ..., Param_n
@@ -87,69 +287,247 @@ class ParameterSampleProvider:
         :param param_names: String or List of strings with parameter name(s)
         :param start: Timestamp with the start of the period
         :param end: Timestamp with the end of the period
+        :param align: 'exact', 'ffill' or 'grid', how the samples are aligned (see align_columns)
+        :param step: Integer grid step, in the units of the sample times (only for 'grid')
+        :param bfill: Bool to also back fill the first samples (only for 'ffill' and 'grid'),
+                      align='ffill' with bfill=True is the fill related to JIRA ARESPY-20
+        :param sample_filter: SampleFilter object selecting the samples while they are decoded, None keeps all
         :return: the resulting dataframe
         """
-        samples = self.get_parameter_data_objs(param_names, start, end)
-        df = self.__samples_into_dataframe(samples)
-        # part of the fix related to JIRA ARESPY-20, not implemented for version stability
-        #df = df.fillna(method='ffill').fillna(method='bfill')
-        return df
+        if isinstance(param_names, str):
+            param_names = [param_names]
+        columns = self.get_parameter_arrays(param_names, start, end, sample_filter=sample_filter)
+        return self.__columns_into_dataframe(columns, align, step, bfill)
 
-    def get_parameter_sysel_data_df(self, param_names, param_syselem, start, end):
+    def get_parameter_sysel_data_df(self, param_names, param_syselem, start, end, align='exact', step=None,
+                                    bfill=False, sample_filter=None):
         """
         Get all the available samples for a given n parameter names and return a pandas dataframe with their data.
         Colums: Timestamp, Param_1, ..., Param_n
         Values: Correspond with the raw_values in HBase
         :param param_names: String or List of strings with parameter name(s)
+        :param param_syselem: List with the system element of each parameter
         :param start: Timestamp with the start of the period
         :param end: Timestamp with the end of the period
+        :param align: 'exact', 'ffill' or 'grid', how the samples are aligned (see align_columns)
+        :param step: Integer grid step, in the units of the sample times (only for 'grid')
+        :param bfill: Bool to also back fill the first samples (only for 'ffill' and 'grid')
+        :param sample_filter: SampleFilter object selecting the samples while they are decoded, None keeps all
         :return: the resulting dataframe
         """
-        samples = self.get_parameter_data_sysel_objs(param_names, param_syselem, start, end)
-        df = self.__samples_into_dataframe(samples)
-        # part of the fix related to JIRA ARESPY-20
-        #df = df.fillna(method='ffill').fillna(method='bfill')
-        return df
+        if isinstance(param_names, str):
+            param_names = [param_names]
+        columns = self.get_parameter_arrays(param_names, start, end, param_syselem, sample_filter)
+        return self.__columns_into_dataframe(columns, align, step, bfill)
 
-    def get_parameter_data_objs(self, param_names, start, end):
+    def get_parameter_data_objs(self, param_names, start, end, sample_filter=None):
         """
         Get all the available samples for a given n parameter names and return a collection of sample objects
         :param param_names: List of strings with parameter name(s)
         :param start: Timestamp with the start of the period
         :param end: Timestamp with the end of the period
-        :return: iterator for the samples
+        :param sample_filter: SampleFilter object selecting the samples while they are decoded, None keeps all
+        :return: list with an iterator over the sample objects of each parameter, in the same order
+                 (each iterator can be consumed once)
         """
 
-        samples = []
-        for param in param_names:
-            pid = self.__dblayer.get_param_id(param, self.system_element)
-            self.pid_dict[pid] = param
-            self.param_dict[param] = pid
-
-            raw_samples = self.__get_scan(param, start, end)
-            samples.append(self.__get_param_sample(data) for key, data in raw_samples)
+        param_names, param_syselem = self.expand_parameter_names(param_names)
+        pids = self.__resolve_pids(param_names, param_syselem)
+        return self.__get_params_samples(list(zip(pids, param_names, param_syselem)), start, end, sample_filter)
 
-        return samples
-
-    def get_parameter_sysel_data_objs(self, param_names, param_syselem, start, end):
+    def get_parameter_sysel_data_objs(self, param_names, param_syselem, start, end, sample_filter=None):
         """
         Get all the available samples for a given n parameter names and return a collection of sample objects
         :param param_names: List of strings with parameter name(s)
         :param start: Timestamp with the start of the period
         :param end: Timestamp with the end of the period
-        :return: iterator for the samples
+        :param sample_filter: SampleFilter object selecting the samples while they are decoded, None keeps all
+        :return: list with an iterator over the sample objects of each parameter, in the same order
+                 (each iterator can be consumed once)
         """
 
-        samples = []
-        for param, syselem in zip(param_names, param_syselem):
-            pid = self.__dblayer.get_param_id(param, syselem)
-            self.pid_dict[pid] = param
-            self.param_dict[param] = pid
+        param_names, param_syselem = self.expand_parameter_names(param_names, param_syselem)
+        pids = self.__resolve_pids(param_names, param_syselem)
+        return self.__get_params_samples(list(zip(pids, param_names, param_syselem)), start, end, sample_filter)
 
-            raw_samples = self.__get_scan(param, start, end)
-            samples.append(self.__get_param_sample(data) for key, data in raw_samples)
+    def get_parameter_arrays(self, param_names, start, end, param_syselem=None, sample_filter=None):
+        """
+        Get all the available samples for a given n parameter names, decoded straight into typed
+        NumPy arrays instead of sample objects: int64 timestamps, values with the dtype of the
+        parameter type code and uint8 validity.
+        :param param_names: List of strings with parameter name(s) or patterns like AOCS_* (see find_parameters)
+        :param start: Timestamp with the start of the period
+        :param end: Timestamp with the end of the period
+        :param param_syselem: List with the system element of each parameter (default is the provider one)
+        :param sample_filter: SampleFilter object selecting the samples while they are decoded, None keeps all
+        :return: list with a SampleColumns object for each parameter, in the same order,
+                 with the parameters matching each pattern in its place
+        """
+        param_names, param_syselem = self.expand_parameter_names(param_names, param_syselem)
+        pids = self.__resolve_pids(param_names, param_syselem)
+        units = list(zip(pids, param_names, param_syselem))
 
-        return samples
+        if self.__samples is not None:
+            columns = self.__get_cached_columns(units, start, end)
+            return [sample_filter.select(c) for c in columns] if sample_filter is not None else columns
+        return self.__get_columns(units, start, end, sample_filter)
+
+    def get_parameter_data_block(self, param_names, start, end, param_syselem=None, sample_filter=None):
+        """
+        Get all the available samples for a given n parameter names in a single SampleBlock,
+        a compact alternative to get_parameter_data_objs that still iterates as sample objects
+        :param param_names: List of strings with parameter name(s)
+        :param start: Timestamp with the start of the period
+        :param end: Timestamp with the end of the period
+        :param param_syselem: List with the system element of each parameter (default is the provider one)
+        :param sample_filter: SampleFilter object selecting the samples while they are decoded, None keeps all
+        :return: SampleBlock object with the samples of the parameters, one parameter after the other
+        """
+        return SampleBlock.from_columns(self.get_parameter_arrays(param_names, start, end, param_syselem,
+                                                                  sample_filter))
+
+    def get_parameter_stream(self, param_name, start, end, slice_length=3600000000, batch_size=10000,
+                             prefetch=False, resume_key=None, syselem=None, sample_filter=None, pid=None):
+        """
+        Get the samples of a parameter as a stream of batches. The period is split in time slices,
+        scanned one after the other, so long retrievals never hold a huge scanner, and the stream
+        records the last rowkey delivered so an interrupted retrieval can be resumed from there.
+        :param param_name: String with the parameter name
+        :param start: Timestamp with the start of the period
+        :param end: Timestamp with the end of the period
+        :param slice_length: Integer length of the time slices, in microseconds
+        :param batch_size: Integer max. number of samples per batch
+        :param prefetch: Bool to read the next slice in the background while the current one is consumed
+        :param resume_key: Bytes rowkey as returned by get_last_key() of an interrupted stream
+        :param syselem: String system element of the parameter (default is the provider one)
+        :param sample_filter: SampleFilter object selecting the samples while they are decoded, None keeps all
+                              (the decimation runs across the batches)
+        :param pid: Integer PID of the parameter when already known (e.g. from get_row_estimates),
+                    to skip its lookup in the metadata
+        :return: ScanStream iterable of SampleColumns batches, empty if the parameter is unknown
+        """
+        if syselem is None:
+            syselem = self.system_element
+        if pid is None:
+            pid = self.__resolve_pids([param_name], [syselem])[0]
+        return self.__stream_param_columns((pid, param_name, syselem), start, end, slice_length, batch_size,
+                                           prefetch, resume_key, sample_filter)
+
+    def get_row_estimates(self, param_names, start, end, param_syselem=None, probe_rows=1000):
+        """
+        Estimate the number of samples of n parameters in a period, to plan distributed retrievals
+        (see scan_partitions). The first probe_rows rows of each parameter are scanned and their rate
+        extrapolated to the whole period; the count is exact for the parameters with fewer rows.
+        :param param_names: List of strings with parameter name(s) or patterns like AOCS_* (see find_parameters)
+        :param start: Timestamp with the start of the period
+        :param end: Timestamp with the end of the period
+        :param param_syselem: List with the system element of each parameter (default is the provider one)
+        :param probe_rows: Integer number of rows scanned per parameter
+        :return: list of (pid, param_name, syselem, rows) tuples, without the unknown parameters
+        """
+        param_names, param_syselem = self.expand_parameter_names(param_names, param_syselem)
+        pids = self.__resolve_pids(param_names, param_syselem)
+        units = [unit for unit in zip(pids, param_names, param_syselem) if unit[0] is not None]
+        start, end = self.__normalize_time(start), self.__normalize_time(end)
+
+        fetch = partial(self.__estimate_rows, probe_rows=probe_rows)
+        if self.__scan_workers > 1:
+            rows = self.__run_parallel(fetch, units, start, end)
+        else:
+            rows = (fetch(unit, start, end) for unit in units)
+        return [(pid, param_name, syselem, count) for (pid, param_name, syselem), count in zip(units, rows)]
+
+    def get_parameter_stats(self, param_names, start, end, resolution='5m', param_syselem=None,
+                            slice_length=3600000000, batch_size=10000, sample_filter=None):
+        """
+        Get statistics of the samples of n parameters per time interval, computed locally while streaming
+        the scans, so the raw samples are never held in memory. Colums: interval_start (index) and
+        count_<name>, sum_<name>, min_<name>, max_<name>, mean_<name>, var_<name>, std_<name>,
+        first_ts_<name>, first_<name>, last_ts_<name>, last_<name> for each parameter.
+        Only count, first and last are computed for non numeric parameters.
+        Parameters whose period is covered by the summary store (see update_summaries) are answered
+        from its coarsest suitable level instead of scanning the samples, unless a sample filter is given.
+        :param param_names: String or List of strings with parameter name(s)
+        :param start: Timestamp with the start of the period
+        :param end: Timestamp with the end of the period
+        :param resolution: int resolution in microseconds OR string '1m'/'5m'/'1h'/'1d'
+        :param param_syselem: List with the system element of each parameter (default is the provider one)
+        :param slice_length: Integer length of the time slices scanned, in microseconds
+        :param batch_size: Integer max. number of samples decoded at once
+        :param sample_filter: SampleFilter object selecting the samples while they are decoded, None keeps all
+        :return: pandas dataframe with a row per interval with samples of any of the parameters
+        """
+        import pandas as pd
+
+        if isinstance(param_names, str):
+            param_names = [param_names]
+        param_names, param_syselem = self.expand_parameter_names(param_names, param_syselem)
+        interval = resolution_to_interval(resolution)
+        pids = self.__resolve_pids(param_names, param_syselem)
+        units = list(zip(pids, param_names, param_syselem))
+
+        def fetch(unit, start_time, end_time):
+            if sample_filter is None:
+                summaries = self.__get_summaries(unit[0], start_time, end_time, interval)
+                if summaries is not None:
+                    return summaries
+            stats = BucketStats(interval)
+            for batch in self.__stream_param_columns(unit, start_time, end_time, slice_length, batch_size,
+                                                     sample_filter=sample_filter):
+                stats.add(batch)
+            return stats.get_stats()
+
+        if self.__scan_workers > 1:
+            results = self.__run_parallel(fetch, units, start, end)
+        else:
+            results = (fetch(unit, start, end) for unit in units)
+
+        frames = []
+        for param_name, stats in zip(param_names, results):
+            index = pd.Index(stats['interval_start'], name='interval_start')
+            frames.append(pd.DataFrame({'{}_{}'.format(stat, param_name): stats[stat] for stat in STATS},
+                                       index=index))
+        if len(frames) == 0:
+            return pd.DataFrame(index=pd.Index([], name='interval_start'))
+        return pd.concat(frames, axis=1).sort_index()
+
+    def update_summaries(self, param_names, start, end, param_syselem=None, slice_length=3600000000,
+                         batch_size=10000):
+        """
+        Compute the downsampled summaries of n parameters for a period, at all the levels of the summary
+        store, with a single streaming pass over the samples, and save them in the store. The period is
+        extended to the boundaries of the coarsest level. Later calls to get_parameter_stats covered by
+        the stored summaries do not scan HBase.
+        :param param_names: String or List of strings with parameter name(s)
+        :param start: Timestamp with the start of the period
+        :param end: Timestamp with the end of the period
+        :param param_syselem: List with the system element of each parameter (default is the provider one)
+        :param slice_length: Integer length of the time slices scanned, in microseconds
+        :param batch_size: Integer max. number of samples decoded at once
+        """
+        if self.__summaries is None:
+            raise ValueError('No summary store configured (summary_file in the Cache section)')
+        if isinstance(param_names, str):
+            param_names = [param_names]
+        param_names, param_syselem = self.expand_parameter_names(param_names, param_syselem)
+        start, end = self.__summaries.get_update_range(self.__normalize_time(start), self.__normalize_time(end))
+        pids = self.__resolve_pids(param_names, param_syselem)
+        units = [unit for unit in zip(pids, param_names, param_syselem) if unit[0] is not None]
+
+        def fetch(unit, start_time, end_time):
+            levels = {level: BucketStats(level) for level in self.__summaries.get_levels()}
+            for batch in self.__stream_param_columns(unit, start_time, end_time, slice_length, batch_size):
+                for stats in levels.values():
+                    stats.add(batch)
+            self.__summaries.put(unit[0], start_time, end_time,
+                                 {level: stats.get_stats() for level, stats in levels.items()})
+
+        if self.__scan_workers > 1:
+            for _ in self.__run_parallel(fetch, units, start, end):
+                pass
+        else:
+            for unit in units:
+                fetch(unit, start, end)
 
     def get_parameter_pids_data_objs(self, from_pid, to_pid, start, end):
         """
@@ -157,21 +535,16 @@ class ParameterSampleProvider:
         :param param_names: List of strings with parameter name(s)
         :param start: Timestamp with the start of the period
         :param end: Timestamp with the end of the period
-        :return: iterator for the samples
+        :return: tuple (param_names, list with an iterator over the sample objects of each parameter)
         """
 
         data = self.__dblayer.get_params_from_pids(from_pid, to_pid, self.system_element)
         param_names = [item['NAME'] for item in data]
-        samples = []
-        for param in param_names:
-            pid = self.__dblayer.get_param_id(param, self.system_element)
-            self.pid_dict[pid] = param
-            self.param_dict[param] = pid
-
-            raw_samples = self.__get_scan(param, start, end)
-            samples.append(self.__get_param_sample(data) for key, data in raw_samples)
+        pids = [item['PID'] for item in data]
+        self.__set_pids([(param, self.system_element, pid) for param, pid in zip(param_names, pids)])
 
-        return (param_names, samples)
+        units = [(pid, param, self.system_element) for param, pid in zip(param_names, pids)]
+        return (param_names, self.__get_params_samples(units, start, end))
 
     def get_parameter_names_from_pids(self, from_pid, to_pid):
         """
@@ -186,6 +559,7 @@ class ParameterSampleProvider:
         param_names = [item['NAME'] for item in data]
         param_syselem = [item['SYSTEM_ELEMENT'] for item in data]
         #print(list(zip(param_names, param_syselem)))
+        self.__set_pids([(item['NAME'], item['SYSTEM_ELEMENT'], item['PID']) for item in data])
         return (param_names, param_syselem)
 
     def get_parameter_pid_sysel_from_names(self, names):
@@ -205,74 +579,390 @@ class ParameterSampleProvider:
     """
     Private Methods
     """
-    def __get_param_sample(self, hbase_row):
+    def __resolve_pids(self, param_names, param_syselem):
         """
-        Get all the sample attributes into an object, retrieved from the buffer.
-        :param hbase_row: the raw buffer as retrieved from hbase
-        :return: sample object
+        Get the PIDs of a list of parameters. The ones not yet known are resolved with
+        a single bulk query (per chunk) to the database layer.
+        :param param_names: List of strings with parameter name(s)
+        :param param_syselem: List of system elements (None matches any)
+        :return: list of PIDs, with None for the parameters not found in the database
         """
+        pids = []
+        missing = []
+        for param, syselem in zip(param_names, param_syselem):
+            record = self.__metacache.get(param, syselem)
+            if record is None:
+                missing.append((param, syselem))
+                pids.append(None)
+            else:
+                self.pid_dict[record['PID']] = param
+                self.param_dict[param] = record['PID']
+                pids.append(record['PID'])
 
-        buf = ProtoBuf(hbase_row[b'v:e'])
-        pid = buf.get_buf_pid()
-        syselem = buf.get_buf_syselem() if buf.get_buf_syselem() != '' else self.system_element
-        value = buf.get_buf_value()
-        sam_type = buf.get_buf_type()
-        time = buf.get_buf_gen_time()
-        validity = buf.get_buf_validity()
-        name = self.pid_dict[pid]
-        raw_sample = Sample(pid, syselem, time=time, value=value, type=sam_type, validity=validity, name=name)
+        if missing:
+            found = self.__dblayer.get_param_ids(missing)
+            self.__set_pids([(param, syselem, pid) for (param, syselem), pid in found.items()])
+            pids = [pid if pid is not None else found.get(pair)
+                    for pid, pair in zip(pids, zip(param_names, param_syselem))]
 
-        return raw_sample
+        return pids
 
-    def __get_scan(self, param_name, start_time, end_time):
+    def __set_pids(self, params):
+        """
+        Store the PIDs of a list of parameters
+        :param params: list of (param_name, syselem, pid) tuples
+        """
+        self.__metacache.put_many([{'PID': pid, 'NAME': param, 'SYSTEM_ELEMENT': syselem}
+                                   for param, syselem, pid in params if syselem is not None])
+        for param, syselem, pid in params:
+            self.pid_dict[pid] = param
+            self.param_dict[param] = pid
+
+    def __get_param_samples(self, unit, rows, predicate=None):
+        """
+        Get the sample objects of the rows of a scan, lazily. Each row is parsed once, and the rows
+        rejected by the predicate are dropped before any object is created for them.
+        :param unit: Tuple (pid, param_name, syselem) of the scanned parameter, the name and the system
+                     element of the samples (the provider one if syselem is None)
+        :param rows: iterable of (row_key, row_dict) tuples, as returned by the HBase scans
+        :param predicate: function accept(paramsam) -> Bool (see SampleFilter.predicate), None keeps all
+        :return: generator of sample objects
         """
-        Gets an HBase scan for a given parameter name and a given start and end time
-        :param param_name: String
+        param_name, syselem = unit[1], unit[2] or self.system_element
+        decoded = iter_decoded((data[b'v:e'] for key, data in rows), predicate=predicate)
+        for pid, time, value, sam_type, validity in decoded:
+            yield Sample(pid, syselem, time=time, value=value, type=sam_type, validity=validity, name=param_name)
+
+    def __get_params_samples(self, units, start, end, sample_filter=None):
+        """
+        Get the samples of a list of parameters, either serially (lazy generators) or with
+        the concurrent scan mode (all scanned before returning). Parameters without PID get no samples.
+        :param units: List of tuples (pid, param_name, syselem), pid is None for an unknown parameter
+        :param start: Timestamp with the start of the period
+        :param end: Timestamp with the end of the period
+        :param sample_filter: SampleFilter object, None keeps all the samples
+        :return: list with an iterator over the samples of each parameter, in both modes
+        """
+        if self.__scan_workers > 1:
+            return [iter(samples) for samples in
+                    self.__run_parallel(partial(self.__fetch_param_samples, sample_filter=sample_filter),
+                                        units, start, end)]
+
+        samples = []
+        for unit in units:
+            if unit[0] is None:
+                samples.append(iter([]))
+                continue
+            raw_samples = self.__get_scan(unit[0], start, end)
+            samples.append(self.__get_param_samples(unit, raw_samples, _new_predicate(sample_filter)))
+        return samples
+
+    def __run_parallel(self, fetch, units, start, end):
+        """
+        Fans the parameter scans out over a thread pool, keeping at most max_in_flight
+        scans pending, and yields the results in the order of the units.
+        :param fetch: method called as fetch(unit, start, end) to scan and decode a parameter
+        :param units: List with the parameters to fetch (e.g. PIDs)
+        :param start: Timestamp with the start of the period
+        :param end: Timestamp with the end of the period
+        :return: generator with the result of each unit
+        """
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.__scan_workers) as executor:
+            for unit in units:
+                if len(pending) >= self.__max_in_flight:
+                    yield pending.popleft().result()
+                pending.append(executor.submit(fetch, unit, start, end))
+            while pending:
+                yield pending.popleft().result()
+
+    def __fetch_param_samples(self, unit, start_time, end_time, sample_filter=None):
+        """
+        Scans HBase for a given parameter, reading all the rows while holding a pooled connection.
+        Used from the threads of the concurrent scan mode.
+        :param unit: Tuple (pid, param_name, syselem), pid is None for an unknown parameter
+        :param start_time: Int
+        :param end_time: Int
+        :param sample_filter: SampleFilter object, None keeps all the samples
+        :return: list of sample objects
+        """
+        pid = unit[0]
+        if pid is None:
+            return []
+        start_key = self.__get_rowkey(pid, start_time)
+        end_key = self.__get_rowkey(pid, end_time)
+
+        rows = self.__hbaseconn.fetch_scan(start_key, end_key)
+        return list(self.__get_param_samples(unit, rows, _new_predicate(sample_filter)))
+
+    def __fetch_param_columns(self, unit, start_time, end_time, sample_filter=None):
+        """
+        Scans HBase for a given parameter and decodes the rows into NumPy columns.
+        :param unit: Tuple (pid, param_name, syselem), pid is None for an unknown parameter
+        :param start_time: Int
+        :param end_time: Int
+        :param sample_filter: SampleFilter object, None keeps all the samples
+        :return: SampleColumns object
+        """
+        pid, param_name, syselem = unit
+        builder = SampleColumnsBuilder(predicate=_new_predicate(sample_filter))
+        if pid is not None:
+            start_key = self.__get_rowkey(pid, start_time)
+            end_key = self.__get_rowkey(pid, end_time)
+            builder.add_rows(self.__hbaseconn.fetch_scan(start_key, end_key))
+        return builder.build(pid, param_name, syselem)
+
+    def __get_columns(self, units, start_time, end_time, sample_filter=None):
+        """
+        Scans HBase for a list of parameters, with the bulk, concurrent or serial scan mode
+        :param units: List of tuples (pid, param_name, syselem), pid is None for an unknown parameter
+        :param start_time: Int
+        :param end_time: Int
+        :param sample_filter: SampleFilter object, None keeps all the samples
+        :return: list with a SampleColumns object for each unit, in the same order
+        """
+        if self.__bulk_scans:
+            return self.__get_bulk_columns(units, start_time, end_time, sample_filter)
+        fetch = partial(self.__fetch_param_columns, sample_filter=sample_filter)
+        if self.__scan_workers > 1:
+            return list(self.__run_parallel(fetch, units, start_time, end_time))
+        return [fetch(unit, start_time, end_time) for unit in units]
+
+    def __get_cached_columns(self, units, start_time, end_time):
+        """
+        Gets the NumPy columns of a list of parameters from the sample cache, scanning HBase only for
+        the parts of the window not cached yet. The parameters missing the same part are scanned together.
+        The samples of the last sample_settle seconds are not cached, as they can still arrive.
+        :param units: List of tuples (pid, param_name, syselem), pid is None for an unknown parameter
+        :param start_time: Int
+        :param end_time: Int
+        :return: list with a SampleColumns object for each unit, in the same order
+        """
+        start_time, end_time = self.__normalize_time(start_time), self.__normalize_time(end_time)
+        settled = int(time.time() * 1000000) - self.__settle_time
+
+        parts = {}
+        missing = {}
+        for unit in units:
+            pid = unit[0]
+            if pid is None or pid in parts:
+                continue
+            parts[pid], gaps = self.__samples.lookup(pid, start_time, end_time)
+            for gap in gaps:
+                missing.setdefault(gap, []).append(unit)
+
+        for (gap_start, gap_end), gap_units in missing.items():
+            for unit, columns in zip(gap_units, self.__get_columns(gap_units, gap_start, gap_end)):
+                parts[unit[0]].append((gap_start, columns))
+                if gap_end <= settled:
+                    self.__samples.put(unit[0], gap_start, gap_end, columns)
+                elif gap_start < settled:
+                    self.__samples.put(unit[0], gap_start, settled, columns.select(columns.get_time() < settled))
+
+        return [concat_columns([columns for first, columns in sorted(parts[pid], key=lambda part: part[0])],
+                               pid, param_name, syselem) if pid is not None else SampleColumns(pid, param_name, syselem)
+                for pid, param_name, syselem in units]
+
+    def __get_bulk_columns(self, units, start_time, end_time, sample_filter=None):
+        """
+        Gets the NumPy columns of a list of parameters with the bulk scan mode: one scan per run
+        of consecutive PIDs, spread over the scanning threads in concurrent scan mode.
+        :param units: List of tuples (pid, param_name, syselem), pid is None for an unknown parameter
+        :param start_time: Int
+        :param end_time: Int
+        :param sample_filter: SampleFilter object, None keeps all the samples
+        :return: list with a SampleColumns object for each unit, in the same order
+        """
+        start_time, end_time = self.__normalize_time(start_time), self.__normalize_time(end_time)
+        pids = set(pid for pid, param_name, syselem in units if pid is not None)
+        max_pids = self.__bulk_max_pids
+        if max_pids is None and self.__scan_workers > 1:
+            max_pids = max(1, -(-len(pids) // self.__scan_workers))
+        scan_ranges = plan_scan_ranges(pids, start_time, end_time, max_pids)
+
+        fetch = partial(self.__fetch_range_columns, sample_filter=sample_filter)
+        builders = {}
+        if self.__scan_workers > 1:
+            for range_builders in self.__run_parallel(fetch, scan_ranges, start_time, end_time):
+                builders.update(range_builders)
+        else:
+            for scan_range in scan_ranges:
+                builders.update(fetch(scan_range, start_time, end_time))
+
+        return [(builders.get(pid) or SampleColumnsBuilder()).build(pid, param_name, syselem)
+                for pid, param_name, syselem in units]
+
+    def __fetch_range_columns(self, scan_range, start_time, end_time, sample_filter=None):
+        """
+        Scans HBase over the key range of a run of consecutive PIDs, decoding the rows in the time
+        window into a NumPy columns builder per PID. When skip_after consecutive rows are outside
+        the window, the scan is closed and reopened at the start of the window of the PID (rows
+        before the window) or of the next PID (rows after the window).
+        :param scan_range: ScanRange tuple
+        :param start_time: Int, normalized to 16 digits
+        :param end_time: Int, normalized to 16 digits
+        :param sample_filter: SampleFilter object, None keeps all the samples
+        :return: dictionary pid -> SampleColumnsBuilder, only for the PIDs with rows in the window
+        """
+        skip_after = self.__skip_after
+        builders = {}
+        current_pid, builder = None, None
+        start_key = scan_range.start_key
+        while start_key is not None:
+            restart_key = None
+            outside = 0
+            batches = self.__hbaseconn.scan_batches(start_key, scan_range.end_key, self.__bulk_batch_size)
+            try:
+                for batch in batches:
+                    for row_key, data in batch:
+                        pid, timestamp = decode_row_key(row_key)
+                        if start_time <= timestamp < end_time:
+                            if pid != current_pid:
+                                current_pid = pid
+                                builder = builders.get(pid)
+                                if builder is None:
+                                    builder = SampleColumnsBuilder(predicate=_new_predicate(sample_filter))
+                                    builders[pid] = builder
+                            builder.add_buffer(data[b'v:e'])
+                            outside = 0
+                            continue
+                        outside += 1
+                        if skip_after is not None and outside > skip_after:
+                            next_pid = pid + 1 if timestamp >= end_time else pid
+                            # past the last PID of the range the scan is over
+                            restart_key = (encode_row_key(next_pid, start_time) if next_pid <= scan_range.last_pid
+                                           else scan_range.end_key)
+                            break
+                    if restart_key is not None:
+                        break
+            finally:
+                batches.close()
+            start_key = restart_key if restart_key is not None and restart_key < scan_range.end_key else None
+        return builders
+
+    def __estimate_rows(self, unit, start_time, end_time, probe_rows=1000):
+        """
+        Estimate the rows of a parameter in a time window from the rate of its first rows
+        :param unit: Tuple (pid, param_name, syselem)
+        :param start_time: Int, normalized to 16 digits
+        :param end_time: Int, normalized to 16 digits
+        :param probe_rows: Integer max. number of rows scanned
+        :return: Integer estimated number of rows
+        """
+        batches = self.__hbaseconn.scan_batches(self.__get_rowkey(unit[0], start_time),
+                                                self.__get_rowkey(unit[0], end_time), probe_rows)
+        try:
+            probe = next(batches, [])
+        finally:
+            batches.close()
+        if len(probe) < probe_rows:
+            return len(probe)
+        last_time = decode_row_key(probe[-1][0])[1]
+        return max(len(probe), len(probe) * (end_time - start_time) // max(1, last_time - start_time))
+
+    def __get_summaries(self, pid, start_time, end_time, interval):
+        """
+        Get the statistics of a parameter from the coarsest level of the summary store that can answer
+        the query, rolling them up to the requested interval
+        :param pid: Int parameter id, None for an unknown parameter
+        :param start_time: Int
+        :param end_time: Int
+        :param interval: Integer requested interval in microseconds
+        :return: dictionary with the statistics arrays, or None if the summaries do not cover the query
+        """
+        if self.__summaries is None or pid is None:
+            return None
+        start_time, end_time = self.__normalize_time(start_time), self.__normalize_time(end_time)
+        level = self.__summaries.select_level(pid, start_time, end_time, interval)
+        if level is None:
+            return None
+        stats = self.__summaries.get(pid, level, start_time, end_time)
+        return stats if level == interval else rollup_stats(stats, interval)
+
+    def __stream_param_columns(self, unit, start_time, end_time, slice_length=3600000000, batch_size=10000,
+                               prefetch=False, resume_key=None, sample_filter=None):
+        """
+        Scans HBase for a given parameter in time slices, decoding the rows in batches of NumPy columns.
+        :param unit: Tuple (pid, param_name, syselem), pid is None for an unknown parameter
+        :param start_time: Int
+        :param end_time: Int
+        :param slice_length: Integer length of the time slices, in microseconds
+        :param batch_size: Integer max. number of samples per batch
+        :param prefetch: Bool to read the next slice in the background
+        :param resume_key: Bytes rowkey of an interrupted stream
+        :param sample_filter: SampleFilter object, None keeps all the samples
+        :return: ScanStream iterable of SampleColumns batches
+        """
+        pid, param_name, syselem = unit
+        key_ranges = []
+        if pid is not None:
+            start_time, end_time = self.__normalize_time(start_time), self.__normalize_time(end_time)
+            for slice_start in range(start_time, end_time, slice_length):
+                slice_end = min(slice_start + slice_length, end_time)
+                key_ranges.append((self.__get_rowkey(pid, slice_start), self.__get_rowkey(pid, slice_end)))
+
+        # a single predicate for the whole stream, so the decimation goes on across the batches
+        predicate = _new_predicate(sample_filter)
+
+        def decode_batch(rows):
+            builder = SampleColumnsBuilder(len(rows), predicate)
+            builder.add_rows(rows)
+            return builder.build(pid, param_name, syselem)
+
+        return self.__hbaseconn.stream_scan(key_ranges, batch_size=batch_size, prefetch=prefetch,
+                                            resume_key=resume_key, transform=decode_batch)
+
+    def __get_scan(self, pid, start_time, end_time):
+        """
+        Gets an HBase scan for a given parameter id and a given start and end time
+        :param pid: Int
         :param start_time: Int
         :param end_time: Int
         :return: all the results from the scan
         """
 
-        start_key = self.__get_rowkey(param_name, start_time)
-        end_key = self.__get_rowkey(param_name, end_time)
+        start_key = self.__get_rowkey(pid, start_time)
+        end_key = self.__get_rowkey(pid, end_time)
 
         return self.__hbaseconn.create_scan(start_key, end_key)
 
-    def __samples_into_dataframe(self, samples):
+    def __columns_into_dataframe(self, columns, align='exact', step=None, bfill=False):
         """
-        Converts n samples into a Pandas DF with columns
-        Timestamp, Paramname for each unique paramname in samples
-        :param samples: List of sample objects
+        Converts the sample columns of n parameters into a Pandas DF with columns
+        Timestamp, Paramname for each unique paramname, aligning the sorted time
+        arrays of the parameters instead of pivoting a long format table
+        :param columns: List of SampleColumns objects
+        :param align: 'exact', 'ffill' or 'grid'
+        :param step: Integer grid step (only for 'grid')
+        :param bfill: Bool to also back fill the first samples
         :return: pandas dataframe
         """
 
         import pandas as pd
 
-        sample_dict = {'timestamp': [], 'var_name': [], 'value': []}
-        for sample in samples:
-            for s in sample:
-                sample_dict['timestamp'].append(s.get_time())
-                sample_dict['var_name'].append(s.get_name())
-                sample_dict['value'].append(s.get_value())
-
-        df = pd.DataFrame(data=sample_dict, columns=['timestamp', 'var_name', 'value'])
-        df = df.pivot(index='timestamp', columns='var_name', values='value')
+        index, aligned = align_columns(columns, how=align, step=step, bfill=bfill)
+        names = sorted(aligned)
+        df = pd.DataFrame({name: aligned[name] for name in names},
+                          index=pd.Index(index, name='timestamp'), columns=names)
+        df.columns.name = 'var_name'
         return df
 
-    def __get_rowkey(self, param_name, timestamp):
+    def __get_rowkey(self, pid, timestamp):
         """
-        Translates a parameter name and corresponding timestamp to a bytebuffer rowkey
-        :param param_name: String name of parameter
+        Translates a parameter id and corresponding timestamp to a bytebuffer rowkey
+        :param pid: Integer parameter id
         :param timestamp: Integer timestamp in milli or micro seconds
         :return: the bytebuffer rowkey needed for the hbase scan
         """
-        pid = self.param_dict[param_name]
-        row_key = ByteBuffer()
-        row_key.put_int(pid)
-        if len(str(timestamp)) < 16:
-            timestamp = int(str(timestamp).ljust(16, '0'))
-        row_key.put_long(timestamp)
-        return row_key.get_bytebuffer()
+        return encode_row_key(pid, normalize_time(timestamp))
+
+    def __normalize_time(self, timestamp):
+        """
+        Pads a timestamp in milli or micro seconds to the 16 digits used in the rowkeys
+        :param timestamp: Integer timestamp
+        :return: Integer timestamp with 16 digits
+        """
+        return normalize_time(timestamp)
 
     def __get_value(self, hbase_row):
         """
@@ -283,3 +973,11 @@ class ParameterSampleProvider:
         value = hbase_row[1][b'v:e']
         return ProtoBuf(value).get_buf_value()
 
+
+def _new_predicate(sample_filter):
+    """
+    Get a new predicate of a sample filter, with its own decimation count
+    :param sample_filter: SampleFilter object, or None
+    :return: function accept(paramsam) -> Bool, None if there is no filter
+    """
+    return sample_filter.predicate() if sample_filter is not None else None
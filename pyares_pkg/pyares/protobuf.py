@@ -1,16 +1,45 @@
+from operator import attrgetter
+
 import pyares.param_pb2 as param_pb2
 
+# ParamSample field holding the value for each type code
+VALUE_FIELDS = {0: 'v_str',   # unknown
+                1: 'v_bit',   # bit
+                2: 'v_long',  # utinyint
+                3: 'v_long',  # stinyint
+                4: 'v_long',  # usmallint
+                5: 'v_long',  # ssmallint
+                6: 'v_long',  # umediumint
+                7: 'v_long',  # smediumint
+                8: 'v_long',  # sint
+                9: 'v_long',  # uint
+                10: 'v_flt',  # float
+                11: 'v_dbl',  # double
+                12: 'v_str',  # string
+                13: 'v_str',  # datetime
+                14: 'v_str',  # job
+                15: 'v_str',  # log
+                }
+
+# Precomputed value accessor for each type code, so only the needed field is read and converted
+VALUE_ACCESSORS = {sam_type: attrgetter(field) for sam_type, field in VALUE_FIELDS.items()}
+VALUE_ACCESSORS[1] = lambda paramsam: int(paramsam.v_bit)
+
 
 class ProtoBuf:
+    """
+    Decoded HBase cell. The buffer is parsed once as a ParamSample, the ParamDefinition
+    fields (name, system element) are only parsed when they are asked for.
+    :param buf: the raw buffer as retrieved from hbase
+    """
     def __init__(self, buf):
+        self.__buf = buf
         self.__paramsam = param_pb2.ParamSample()
         self.__paramsam.ParseFromString(buf)
-
-        self.__paramdef = param_pb2.ParamDefinition()
-        self.__paramdef.ParseFromString(buf)
+        self.__paramdef = None
 
     def get_protobuf(self):
-        return self.__paramsam, self.__paramdef
+        return self.__paramsam, self.__get_paramdef()
 
     def get_buf_pid(self):
         return self.__paramsam.pid
@@ -28,30 +57,44 @@ class ProtoBuf:
     def get_buf_value(self):
         # TODO built in check if val and raw_val is equal
         #assert self.__paramsam.type == self.__paramdef.raw_type
-
-        type_map = {0: str(self.__paramsam.v_str), # unknown
-                    1: int(self.__paramsam.v_bit), # bit
-                    2: int(self.__paramsam.v_long), # utinyint
-                    3: int(self.__paramsam.v_long), # stinyint
-                    4: int(self.__paramsam.v_long), # usmallint
-                    5: int(self.__paramsam.v_long), # ssmallint
-                    6: int(self.__paramsam.v_long), # umediumint
-                    7: int(self.__paramsam.v_long), # smediumint
-                    8: int(self.__paramsam.v_long), # sint
-                    9: int(self.__paramsam.v_long), # uint
-                    10: float(self.__paramsam.v_flt), # float
-                    11: float(self.__paramsam.v_dbl), # double
-                    12: str(self.__paramsam.v_str), # string
-                    13: str(self.__paramsam.v_str), # datetime
-                    14: str(self.__paramsam.v_str), # job
-                    15: str(self.__paramsam.v_str), # log
-                    }
-
-        value = type_map[self.__paramsam.type]
-        return value
+        return VALUE_ACCESSORS[self.__paramsam.type](self.__paramsam)
 
     def get_buf_name(self):
-        return self.__paramdef.name
+        return self.__get_paramdef().name
 
     def get_buf_syselem(self):
-        return self.__paramdef.system_element
+        return self.__get_paramdef().system_element
+
+    def __get_paramdef(self):
+        if self.__paramdef is None:
+            self.__paramdef = param_pb2.ParamDefinition()
+            self.__paramdef.ParseFromString(self.__buf)
+        return self.__paramdef
+
+
+def decode_many(buffers, predicate=None):
+    """
+    Decode a whole batch of HBase cells, reusing a single message object.
+    Each buffer is parsed once, as a ParamSample: the system element is not in it,
+    it has to come from the request of the samples.
+    :param buffers: iterable with the raw buffers as retrieved from hbase
+    :param predicate: function accept(paramsam) -> Bool deciding if a parsed sample is kept
+                      (see SampleFilter.predicate), None keeps all
+    :return: list of (pid, gen_time, value, type, validity) tuples
+    """
+    return list(iter_decoded(buffers, predicate))
+
+
+def iter_decoded(buffers, predicate=None):
+    """
+    Lazy version of decode_many, decoding each HBase cell when it is asked for
+    :return: generator of (pid, gen_time, value, type, validity) tuples
+    """
+    paramsam = param_pb2.ParamSample()
+    accessors = VALUE_ACCESSORS
+    for buf in buffers:
+        paramsam.ParseFromString(buf)
+        if predicate is not None and not predicate(paramsam):
+            continue
+        sam_type = paramsam.type
+        yield (paramsam.pid, paramsam.gen_time, accessors[sam_type](paramsam), sam_type, paramsam.validity)
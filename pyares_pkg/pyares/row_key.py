@@ -0,0 +1,100 @@
+import struct
+
+from collections import namedtuple
+
+# Rowkey of the ARES_<dataspace>_ParamSamples table: 3 bytes big endian PID + 8 bytes big endian
+# timestamp. struct has no 3 bytes integer, so the PID is packed as 4 bytes and the first one dropped.
+ROW_KEY = struct.Struct('>IQ')
+ROW_KEY_SIZE = ROW_KEY.size - 1
+MAX_PID = (1 << 24) - 1
+
+# Timestamps in the rowkeys have 16 digits (microseconds)
+TIME_DIGITS_MIN = 10 ** 15
+
+# Contiguous key range covering the samples of the PIDs first_pid..last_pid in a time window
+ScanRange = namedtuple('ScanRange', ['first_pid', 'last_pid', 'start_key', 'end_key'])
+
+
+def normalize_time(timestamp):
+    """
+    Pads a timestamp in seconds, milli or micro seconds to the 16 digits used in the rowkeys,
+    as str(timestamp).ljust(16, '0') but without string conversions
+    :param timestamp: Integer timestamp
+    :return: Integer timestamp with 16 digits
+    """
+    timestamp = int(timestamp)
+    if 0 < timestamp < TIME_DIGITS_MIN:
+        while timestamp < TIME_DIGITS_MIN:
+            timestamp *= 10
+    return timestamp
+
+
+def encode_row_key(pid, timestamp):
+    """
+    Get the rowkey of a sample
+    :param pid: Integer parameter id
+    :param timestamp: Integer timestamp, already normalized to 16 digits
+    :return: Bytes rowkey
+    :raises ValueError: if the PID does not fit in the 3 bytes of the rowkey
+    """
+    if not 0 <= pid <= MAX_PID:
+        raise ValueError('PID %s is outside of the rowkey range 0..%d' % (pid, MAX_PID))
+    return ROW_KEY.pack(pid, timestamp)[1:]
+
+
+def decode_row_key(row_key):
+    """
+    Get the PID and the timestamp of a rowkey
+    :param row_key: Bytes rowkey
+    :return: tuple (pid, timestamp)
+    """
+    return ROW_KEY.unpack(b'\x00' + row_key[:ROW_KEY_SIZE])
+
+
+def decode_row_key_pid(row_key):
+    """
+    Get the PID of a rowkey
+    :param row_key: Bytes rowkey
+    :return: Integer pid
+    """
+    return int.from_bytes(row_key[:3], 'big')
+
+
+def plan_scan_ranges(pids, start, end, max_pids=None):
+    """
+    Turn a set of PIDs and a time window into the minimal sorted list of contiguous key ranges.
+    Runs of consecutive PIDs are merged in a single range, from (first PID, start) to (last PID, end):
+    the keys between them also include the samples of the first PIDs after the end and of the last
+    PIDs before the start, so the rows of a merged range must be filtered by time (see in_window).
+    :param pids: iterable of Integer PIDs, in any order, None values are ignored
+    :param start: Integer start timestamp
+    :param end: Integer end timestamp (not included)
+    :param max_pids: Integer max. number of PIDs merged in a range, None for no limit
+    :return: list of ScanRange tuples, sorted by key
+    """
+    start, end = normalize_time(start), normalize_time(end)
+    pids = sorted(set(pid for pid in pids if pid is not None))
+    ranges = []
+    first = last = None
+    for pid in pids:
+        if first is not None and pid == last + 1 and (max_pids is None or pid - first < max_pids):
+            last = pid
+            continue
+        if first is not None:
+            ranges.append(ScanRange(first, last, encode_row_key(first, start), encode_row_key(last, end)))
+        first = last = pid
+    if first is not None:
+        ranges.append(ScanRange(first, last, encode_row_key(first, start), encode_row_key(last, end)))
+    return ranges
+
+
+def in_window(row_key, start, end):
+    """
+    Check if the timestamp of a rowkey is inside a time window
+    :param row_key: Bytes rowkey
+    :param start: Integer start timestamp, normalized to 16 digits
+    :param end: Integer end timestamp (not included), normalized to 16 digits
+    :return: Bool
+    """
+    timestamp = int.from_bytes(row_key[3:ROW_KEY_SIZE], 'big')
+    return start <= timestamp < end
@@ -10,6 +10,9 @@ class Sample:
     :param type: Type of the value, corresponding with what is in the buffer
     """
 
+    # no per-instance __dict__, millions of samples can be created by the object API
+    __slots__ = ('__pid', '__name', '__time', '__value', '__syselem', '__validity', '__type')
+
     def __init__(self, pid, syselem, name=None, time=None, value=None, validity=None, type=None):
         self.__pid = pid
         self.__name = name
@@ -22,6 +25,10 @@ class Sample:
         # raw type
         # type
 
+    def __reduce__(self):
+        return (Sample, (self.__pid, self.__syselem, self.__name, self.__time, self.__value,
+                         self.__validity, self.__type))
+
     """
     Setters
     """
@@ -0,0 +1,144 @@
+import numpy as np
+
+# Alignment modes of align_columns
+ALIGN_MODES = ('exact', 'ffill', 'grid')
+
+
+def align_columns(columns, how='exact', step=None, start=None, end=None, bfill=False):
+    """
+    Align the samples of several parameters on a common time index, working on the per-parameter
+    time arrays (already sorted, as they come from HBase) instead of a long format table.
+    If a parameter has several samples with the same time, the last one is kept.
+    :param columns: list of SampleColumns objects
+    :param how: 'exact' to use the union of all the sample times, leaving the parameters without a
+                sample at a time missing; 'ffill' to use the same index, but taking the last sample
+                at or before each time (as-of); 'grid' to take the last sample at or before each
+                time of a regular grid
+    :param step: Integer grid step, in the units of the sample times (only for 'grid')
+    :param start: Integer first time of the grid (default is the first sample time)
+    :param end: Integer last time of the grid (default is the last sample time)
+    :param bfill: Bool to also fill the times before the first sample of a parameter with that sample
+                  (only for 'ffill' and 'grid')
+    :return: tuple (int64 array with the time index, dictionary name -> array of values aligned to it),
+             missing values are NaN, with integer columns promoted to float64 if they have any
+    """
+    if how not in ALIGN_MODES:
+        raise ValueError('Unknown alignment mode {}, must be one of {}'.format(how, ', '.join(ALIGN_MODES)))
+
+    series = _merge_by_name(columns)
+    times = [t for t, v in series.values()]
+
+    if how == 'grid':
+        if step is None or step <= 0:
+            raise ValueError('A positive grid step is needed to align to a grid')
+        index = _grid_index(times, step, start, end)
+    else:
+        index = merge_times(times)
+
+    aligned = {}
+    for name, (time, value) in series.items():
+        if how == 'exact':
+            pos = np.searchsorted(index, time)
+            aligned[name] = _scatter(value, pos, len(index))
+        else:
+            pos = np.searchsorted(time, index, side='right') - 1
+            if bfill and len(time) > 0:
+                pos[pos < 0] = 0
+            aligned[name] = _gather(value, pos)
+    return (index, aligned)
+
+
+def merge_times(times):
+    """
+    Merge sorted time arrays into their sorted union, without duplicates
+    :param times: list of sorted int64 arrays
+    :return: sorted int64 array
+    """
+    times = [t for t in times if len(t) > 0]
+    if len(times) == 0:
+        return np.empty(0, dtype=np.int64)
+    if len(times) == 1:
+        merged = times[0]
+    else:
+        # concatenated sorted runs, a stable sort merges them in a single pass
+        merged = np.sort(np.concatenate(times), kind='mergesort')
+    return merged[_last_of_runs(merged)]
+
+
+def _merge_by_name(columns):
+    """
+    Get the (time, value) arrays of each parameter name, merging the SampleColumns with the same name
+    (e.g. from different system elements) and keeping only the last sample of each time
+    """
+    grouped = {}
+    for col in columns:
+        grouped.setdefault(col.get_name(), []).append(col)
+
+    series = {}
+    for name, cols in grouped.items():
+        if len(cols) == 1:
+            time, value = cols[0].get_time(), cols[0].get_value()
+        else:
+            time = np.concatenate([c.get_time() for c in cols])
+            value = np.concatenate([c.get_value() for c in cols])
+            order = np.argsort(time, kind='mergesort')
+            time, value = time[order], value[order]
+        keep = _last_of_runs(time)
+        series[name] = (time[keep], value[keep])
+    return series
+
+
+def _last_of_runs(time):
+    """
+    Get the mask selecting the last element of each run of equal times of a sorted array
+    """
+    keep = np.ones(len(time), dtype=bool)
+    if len(time) > 1:
+        keep[:-1] = time[1:] != time[:-1]
+    return keep
+
+
+def _grid_index(times, step, start, end):
+    """
+    Get the times of a regular grid, by default covering all the samples
+    """
+    times = [t for t in times if len(t) > 0]
+    if start is None:
+        start = min(t[0] for t in times) if times else 0
+    if end is None:
+        end = max(t[-1] for t in times) if times else start - 1
+    return np.arange(start, end + 1, step, dtype=np.int64)
+
+
+def _missing_dtype(value):
+    if value.dtype.kind in 'biu':
+        return np.float64
+    if value.dtype.kind in 'f':
+        return value.dtype
+    return np.object_
+
+
+def _scatter(value, pos, size):
+    """
+    Place the values at the given positions of an array of missing values
+    """
+    if len(value) == size:
+        # the parameter has a sample at every time of the index
+        return value
+    out = np.full(size, np.nan, dtype=_missing_dtype(value))
+    out[pos] = value
+    return out
+
+
+def _gather(value, pos):
+    """
+    Take the values at the given positions, negative positions are missing values
+    """
+    missing = pos < 0
+    if len(value) == 0:
+        return np.full(len(pos), np.nan)
+    out = value[np.where(missing, 0, pos)]
+    if missing.any():
+        out = out.astype(_missing_dtype(value))
+        out[missing] = np.nan
+    return out
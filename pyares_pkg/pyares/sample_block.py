@@ -0,0 +1,128 @@
+import numpy as np
+
+from pyares.sample import Sample
+
+
+def block_dtype(value_dtype=np.object_):
+    """
+    Get the dtype of the records of a SampleBlock
+    :param value_dtype: NumPy dtype of the value field
+    :return: structured dtype with the fields pid, time, value, validity and type
+    """
+    return np.dtype([('pid', np.uint32), ('time', np.int64), ('value', value_dtype),
+                     ('validity', np.uint8), ('type', np.uint8)])
+
+
+class SampleBlock:
+    """
+    Samples of one or more parameters stored in a NumPy structured array (pid, time, value,
+    validity, type), a few bytes per sample instead of a Sample object each.
+    Iterating a block yields Sample objects, indexing it with a slice or a mask gives another
+    block, and it is pickled as the array itself (e.g. when Spark ships it between nodes).
+    :param data: structured array with the dtype of block_dtype()
+    :param names: dictionary pid -> (name, syselem) of the parameters in the block
+    """
+
+    # number of records converted at once to Python values while iterating
+    IterChunk = 4096
+
+    def __init__(self, data=None, names=None):
+        self.__data = data if data is not None else np.empty(0, dtype=block_dtype())
+        self.__names = dict(names) if names else {}
+
+    @staticmethod
+    def from_columns(columns):
+        """
+        Build a block with the samples of several parameters, one after the other
+        :param columns: list of SampleColumns objects, the ones of unknown parameters (pid None) are skipped
+        :return: SampleBlock object, with the value dtype of the columns if they all share it
+        (otherwise the values are stored as Python objects)
+        """
+        columns = [col for col in columns if col.get_pid() is not None]
+        dtypes = set(col.get_value().dtype for col in columns if len(col) > 0)
+        value_dtype = dtypes.pop() if len(dtypes) == 1 else np.object_
+
+        data = np.empty(sum(len(col) for col in columns), dtype=block_dtype(value_dtype))
+        names = {}
+        first = 0
+        for col in columns:
+            names[col.get_pid()] = (col.get_name(), col.get_syselem())
+            records = data[first:first + len(col)]
+            records['pid'] = col.get_pid()
+            records['time'] = col.get_time()
+            records['value'] = col.get_value()
+            records['validity'] = col.get_validity()
+            records['type'] = col.get_type() or 0
+            first += len(col)
+        return SampleBlock(data, names)
+
+    @staticmethod
+    def from_samples(samples):
+        """
+        Build a block from sample objects
+        :param samples: iterable of Sample objects
+        :return: SampleBlock object, with the values stored as Python objects
+        """
+        samples = list(samples)
+        data = np.empty(len(samples), dtype=block_dtype())
+        data['pid'] = [sample.get_pid() for sample in samples]
+        data['time'] = [sample.get_time() for sample in samples]
+        data['value'] = [sample.get_value() for sample in samples]
+        data['validity'] = [sample.get_validity() or 0 for sample in samples]
+        data['type'] = [sample.get_type() or 0 for sample in samples]
+        names = {sample.get_pid(): (sample.get_name(), sample.get_syselem()) for sample in samples}
+        return SampleBlock(data, names)
+
+    def __len__(self):
+        return len(self.__data)
+
+    def __iter__(self):
+        data = self.__data
+        for first in range(0, len(data), self.IterChunk):
+            for record in data[first:first + self.IterChunk].tolist():
+                yield self.__make_sample(record)
+
+    def __getitem__(self, index):
+        """
+        Get a sample or a subset of the samples
+        :param index: integer for a single sample, or slice, boolean mask or integer array
+        :return: Sample object for an integer index, otherwise SampleBlock object
+        """
+        if isinstance(index, (int, np.integer)):
+            return self.__make_sample(self.__data[index].tolist())
+        return SampleBlock(self.__data[index], self.__names)
+
+    def __reduce__(self):
+        return (SampleBlock, (self.__data, self.__names))
+
+    """
+    Getters
+    """
+    def get_data(self):
+        return self.__data
+
+    def get_names(self):
+        return self.__names
+
+    def get_pid(self):
+        return self.__data['pid']
+
+    def get_time(self):
+        return self.__data['time']
+
+    def get_value(self):
+        return self.__data['value']
+
+    def get_validity(self):
+        return self.__data['validity']
+
+    def get_type(self):
+        return self.__data['type']
+
+    """
+    Private Methods
+    """
+    def __make_sample(self, record):
+        pid, time, value, validity, sam_type = record
+        name, syselem = self.__names.get(pid, (None, None))
+        return Sample(pid, syselem, name=name, time=time, value=value, validity=validity, type=sam_type)
@@ -0,0 +1,297 @@
+import bisect
+import os
+import re
+import threading
+
+from collections import OrderedDict
+
+import numpy as np
+
+from pyares.sample_columns import SampleColumns, concat_columns
+
+# estimated size of a value stored as a Python object (strings, datetimes)
+OBJECT_VALUE_BYTES = 64
+
+# name of the spill files: <pid>_<start>_<end>.npz
+SPILL_FILE = re.compile(r'^(\d+)_(\d+)_(\d+)\.npz$')
+
+
+class SampleCache:
+    """
+    Cache of the samples already retrieved, keyed by PID and time window.
+    For each PID it keeps the sorted, non overlapping time ranges already retrieved, so a query
+    is answered with the cached part of its window plus the list of gaps still to fetch;
+    the ranges stored later are merged with the overlapping or adjacent ones.
+    The ranges are held in memory as NumPy columns up to max_bytes, evicting the least recently
+    used ones. With a spill directory the evicted ranges are written there as .npz columns files
+    (up to spill_bytes, also LRU), read back when used again, and found again by a new cache
+    on the same directory (e.g. when a retrieval is rerun).
+    :param max_bytes: Integer max. size of the samples kept in memory
+    :param spill_dir: String path of the directory for the evicted ranges, None to drop them
+    :param spill_bytes: Integer max. size of the spill files
+    """
+
+    __shared = {}
+    __shared_lock = threading.Lock()
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, spill_dir=None, spill_bytes=1024 * 1024 * 1024):
+        self.__max_bytes = max_bytes
+        self.__spill_dir = spill_dir
+        self.__spill_bytes = spill_bytes
+        self.__lock = threading.RLock()
+        self.__ranges = {}               # pid -> sorted list of (start, end)
+        self.__memory = OrderedDict()    # (pid, start) -> (end, SampleColumns, bytes), in LRU order
+        self.__memory_bytes = 0
+        self.__disk = OrderedDict()      # (pid, start) -> (end, file path, bytes), in LRU order
+        self.__disk_bytes = 0
+
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+            self.__load_spilled()
+
+    @classmethod
+    def get_shared(cls, max_bytes=256 * 1024 * 1024, spill_dir=None, spill_bytes=1024 * 1024 * 1024):
+        """
+        Get the cache instance shared by all the providers of this process for a given spill directory
+        :param max_bytes: Integer max. size of the samples kept in memory
+        :param spill_dir: String path of the directory for the evicted ranges, None to drop them
+        :param spill_bytes: Integer max. size of the spill files
+        :return: SampleCache object
+        """
+        with cls.__shared_lock:
+            cache = cls.__shared.get(spill_dir)
+            if cache is None:
+                cache = cls(max_bytes, spill_dir, spill_bytes)
+                cls.__shared[spill_dir] = cache
+        return cache
+
+    def __len__(self):
+        return len(self.__memory) + len(self.__disk)
+
+    def get_bytes(self):
+        """
+        :return: tuple (bytes in memory, bytes in the spill files)
+        """
+        return (self.__memory_bytes, self.__disk_bytes)
+
+    def get_ranges(self, pid):
+        """
+        :return: list of (start, end) time ranges of a PID in the cache
+        """
+        with self.__lock:
+            return list(self.__ranges.get(pid, []))
+
+    def lookup(self, pid, start, end):
+        """
+        Get the cached samples of a PID in a time window, and the parts of the window not cached
+        :param pid: Integer PID
+        :param start: Integer start timestamp
+        :param end: Integer end timestamp (not included)
+        :return: tuple (parts, gaps): list of (start, SampleColumns) with the cached samples, and
+        list of (start, end) windows to fetch, both sorted by time
+        """
+        parts = []
+        gaps = []
+        with self.__lock:
+            cursor = start
+            for range_start, range_end in self.__overlapping(pid, start, end):
+                columns = self.__read(pid, range_start)
+                if columns is None:
+                    continue
+                if range_start > cursor:
+                    gaps.append((cursor, range_start))
+                first, last = max(start, range_start), min(end, range_end)
+                time = columns.get_time()
+                parts.append((first, columns.select(slice(np.searchsorted(time, first, 'left'),
+                                                          np.searchsorted(time, last, 'left')))))
+                cursor = last
+            if cursor < end:
+                gaps.append((cursor, end))
+        return (parts, gaps)
+
+    def put(self, pid, start, end, columns):
+        """
+        Store the samples of a PID retrieved for a time window, merging them with the cached
+        ranges that overlap or touch the window (the new samples replace the cached ones)
+        :param pid: Integer PID
+        :param start: Integer start timestamp
+        :param end: Integer end timestamp (not included)
+        :param columns: SampleColumns object with all the samples of the window
+        """
+        if end <= start:
+            return
+        with self.__lock:
+            before, after = [], []
+            merged_start, merged_end = start, end
+            for range_start, range_end in [r for r in self.__ranges.get(pid, []) if r[0] <= end and r[1] >= start]:
+                cached = self.__read(pid, range_start)
+                if cached is None:
+                    continue
+                self.__remove(pid, range_start)
+                time = cached.get_time()
+                if range_start < start:
+                    before.append(cached.select(time < start))
+                    merged_start = range_start
+                if range_end > end:
+                    after.append(cached.select(time >= end))
+                    merged_end = range_end
+            merged = concat_columns(before + [columns] + after, pid, None)
+            bisect.insort(self.__ranges.setdefault(pid, []), (merged_start, merged_end))
+            self.__memory[(pid, merged_start)] = (merged_end, merged, _columns_bytes(merged))
+            self.__memory_bytes += self.__memory[(pid, merged_start)][2]
+            self.__evict()
+
+    def invalidate(self, pid=None):
+        """
+        Drop the cached samples of a PID, or of all of them
+        :param pid: Integer PID, None for all
+        """
+        with self.__lock:
+            pids = [pid] if pid is not None else list(self.__ranges)
+            for each_pid in pids:
+                for range_start, range_end in list(self.__ranges.get(each_pid, [])):
+                    self.__remove(each_pid, range_start)
+
+    def flush(self):
+        """
+        Write all the ranges kept in memory to the spill directory, so that a later process finds them
+        """
+        if not self.__spill_dir:
+            return
+        with self.__lock:
+            while self.__memory:
+                self.__spill(*self.__memory.popitem(last=False))
+            self.__trim_disk()
+
+    """
+    Private Methods
+    """
+    def __overlapping(self, pid, start, end):
+        """
+        Get the cached ranges of a PID that overlap a time window
+        """
+        ranges = self.__ranges.get(pid, [])
+        i = max(0, bisect.bisect_right(ranges, (start, start)) - 1)
+        overlapping = []
+        for range_start, range_end in ranges[i:]:
+            if range_start >= end:
+                break
+            if range_end > start:
+                overlapping.append((range_start, range_end))
+        return overlapping
+
+    def __read(self, pid, start):
+        """
+        Get the samples of a cached range, reading them back into memory if they were spilled
+        :return: SampleColumns object, None if the range was dropped or its spill file is gone
+        """
+        key = (pid, start)
+        if key in self.__memory:
+            self.__memory.move_to_end(key)
+            return self.__memory[key][1]
+        if key not in self.__disk:
+            return None
+
+        end, path, nbytes = self.__disk.pop(key)
+        self.__disk_bytes -= nbytes
+        try:
+            with np.load(path, allow_pickle=True) as data:
+                sam_type = int(data['type'])
+                columns = SampleColumns(pid, None, time=data['time'], value=data['value'],
+                                        validity=data['validity'], type=sam_type if sam_type >= 0 else None)
+            os.remove(path)
+        except (OSError, ValueError, KeyError):
+            self.__ranges[pid].remove((start, end))
+            return None
+        self.__memory[key] = (end, columns, _columns_bytes(columns))
+        self.__memory_bytes += self.__memory[key][2]
+        self.__evict(keep=key)
+        return columns
+
+    def __remove(self, pid, start):
+        """
+        Drop a cached range, from memory or from the spill directory
+        """
+        key = (pid, start)
+        if key in self.__memory:
+            end, columns, nbytes = self.__memory.pop(key)
+            self.__memory_bytes -= nbytes
+        else:
+            end, path, nbytes = self.__disk.pop(key)
+            self.__disk_bytes -= nbytes
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self.__ranges[pid].remove((start, end))
+
+    def __evict(self, keep=None):
+        """
+        Move the least recently used ranges out of memory until it is below max_bytes
+        :param keep: key of a range that must stay in memory
+        """
+        while self.__memory_bytes > self.__max_bytes and self.__memory:
+            key, entry = next(iter(self.__memory.items()))
+            if key == keep:
+                if len(self.__memory) == 1:
+                    break
+                self.__memory.move_to_end(key)
+                continue
+            del self.__memory[key]
+            if self.__spill_dir:
+                self.__spill(key, entry)
+            else:
+                self.__memory_bytes -= entry[2]
+                self.__ranges[key[0]].remove((key[1], entry[0]))
+        self.__trim_disk()
+
+    def __spill(self, key, entry):
+        """
+        Write a range removed from memory to the spill directory
+        """
+        pid, start = key
+        end, columns, nbytes = entry
+        self.__memory_bytes -= nbytes
+        path = os.path.join(self.__spill_dir, '{0}_{1}_{2}.npz'.format(pid, start, end))
+        temp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+        with open(temp_path, 'wb') as spill_file:
+            np.savez(spill_file, time=columns.get_time(), value=columns.get_value(),
+                     validity=columns.get_validity(),
+                     type=np.int64(columns.get_type() if columns.get_type() is not None else -1))
+        os.replace(temp_path, path)
+        self.__disk[key] = (end, path, os.path.getsize(path))
+        self.__disk_bytes += self.__disk[key][2]
+
+    def __trim_disk(self):
+        """
+        Delete the least recently used spill files until they are below spill_bytes
+        """
+        while self.__disk_bytes > self.__spill_bytes and self.__disk:
+            self.__remove(*next(iter(self.__disk)))
+
+    def __load_spilled(self):
+        """
+        Register the spill files left in the spill directory, oldest first
+        """
+        files = []
+        for file_name in os.listdir(self.__spill_dir):
+            match = SPILL_FILE.match(file_name)
+            if match:
+                path = os.path.join(self.__spill_dir, file_name)
+                files.append((os.path.getmtime(path), [int(n) for n in match.groups()], path))
+        for mtime, (pid, start, end), path in sorted(files):
+            if self.__overlapping(pid, start, end):
+                continue
+            bisect.insort(self.__ranges.setdefault(pid, []), (start, end))
+            self.__disk[(pid, start)] = (end, path, os.path.getsize(path))
+            self.__disk_bytes += self.__disk[(pid, start)][2]
+        self.__trim_disk()
+
+
+def _columns_bytes(columns):
+    """
+    Estimate the memory used by the samples of a SampleColumns object
+    """
+    value = columns.get_value()
+    value_bytes = len(value) * OBJECT_VALUE_BYTES if value.dtype == np.object_ else value.nbytes
+    return columns.get_time().nbytes + columns.get_validity().nbytes + value_bytes
@@ -0,0 +1,185 @@
+import numpy as np
+
+import pyares.param_pb2 as param_pb2
+from pyares.protobuf import VALUE_ACCESSORS
+
+# NumPy dtype of the value column for each ARES type code
+TYPE_DTYPES = {0: np.object_,   # unknown
+               1: np.uint8,     # bit
+               2: np.uint8,     # utinyint
+               3: np.int8,      # stinyint
+               4: np.uint16,    # usmallint
+               5: np.int16,     # ssmallint
+               6: np.uint32,    # umediumint
+               7: np.int32,     # smediumint
+               8: np.int64,     # sint
+               9: np.int64,     # uint, stored in the sint64 v_long field
+               10: np.float32,  # float
+               11: np.float64,  # double
+               12: np.object_,  # string
+               13: np.object_,  # datetime
+               14: np.object_,  # job
+               15: np.object_,  # log
+               }
+
+class SampleColumns:
+    """
+    Samples of one parameter stored column-wise, in typed NumPy arrays
+    :param pid: Integer
+    :param name: String
+    :param syselem: String
+    :param time: int64 array with the sample generation times
+    :param value: array with the values, with the dtype of the type code (see TYPE_DTYPES)
+    :param validity: uint8 array with the validity of each sample
+    :param type: Type of the values, corresponding with what is in the buffer (None if there are no samples)
+    """
+
+    def __init__(self, pid, name, syselem=None, time=None, value=None, validity=None, type=None):
+        self.__pid = pid
+        self.__name = name
+        self.__syselem = syselem
+        self.__time = time if time is not None else np.empty(0, dtype=np.int64)
+        self.__value = value if value is not None else np.empty(0, dtype=TYPE_DTYPES.get(type, np.object_))
+        self.__validity = validity if validity is not None else np.empty(0, dtype=np.uint8)
+        self.__type = type
+
+    def __len__(self):
+        return len(self.__time)
+
+    def select(self, index):
+        """
+        Get a subset of the samples
+        :param index: slice, boolean mask or integer array applied to all the columns
+        :return: SampleColumns object with the selected samples
+        """
+        return SampleColumns(self.__pid, self.__name, self.__syselem,
+                             time=self.__time[index], value=self.__value[index],
+                             validity=self.__validity[index], type=self.__type)
+
+    """
+    Getters
+    """
+    def get_pid(self):
+        return self.__pid
+
+    def get_name(self):
+        return self.__name
+
+    def get_syselem(self):
+        return self.__syselem
+
+    def get_time(self):
+        return self.__time
+
+    def get_value(self):
+        return self.__value
+
+    def get_validity(self):
+        return self.__validity
+
+    def get_type(self):
+        return self.__type
+
+
+class SampleColumnsBuilder:
+    """
+    Decodes HBase rows straight into preallocated NumPy arrays, growing them geometrically
+    when full, so no per-sample Python object is kept. The value dtype is the one of the type
+    of the first sample, a sample of another type raises a ValueError.
+    :param capacity: Integer initial number of samples allocated
+    :param predicate: function accept(paramsam) -> Bool deciding if a parsed sample is kept
+                      (see SampleFilter.predicate), None keeps all
+    """
+
+    def __init__(self, capacity=4096, predicate=None):
+        self.__capacity = max(1, capacity)
+        self.__predicate = predicate
+        self.__size = 0
+        self.__type = None
+        self.__accessor = None
+        self.__time = np.empty(self.__capacity, dtype=np.int64)
+        self.__validity = np.empty(self.__capacity, dtype=np.uint8)
+        self.__value = None
+        self.__paramsam = param_pb2.ParamSample()
+
+    def add_rows(self, rows):
+        """
+        Decode a sequence of HBase rows and append their samples
+        :param rows: iterable of (row_key, row_dict) tuples, as returned by the HBase scans
+        """
+        for key, data in rows:
+            self.add_buffer(data[b'v:e'])
+
+    def add_buffer(self, buf):
+        """
+        Decode a single protobuf buffer and append its sample, if the predicate accepts it
+        :param buf: the raw buffer as stored in HBase
+        """
+        paramsam = self.__paramsam
+        paramsam.ParseFromString(buf)
+        if self.__predicate is not None and not self.__predicate(paramsam):
+            return
+        if self.__type is None:
+            self.__type = paramsam.type
+            self.__accessor = VALUE_ACCESSORS[self.__type]
+            self.__value = np.empty(self.__capacity, dtype=TYPE_DTYPES[self.__type])
+        elif paramsam.type != self.__type:
+            raise ValueError('Sample of PID {} at {} has type {}, the previous ones have type {}'
+                             .format(paramsam.pid, paramsam.gen_time, paramsam.type, self.__type))
+        if self.__size == self.__capacity:
+            self.__grow()
+
+        i = self.__size
+        self.__time[i] = paramsam.gen_time
+        self.__value[i] = self.__accessor(paramsam)
+        self.__validity[i] = paramsam.validity
+        self.__size = i + 1
+
+    def build(self, pid, name, syselem=None):
+        """
+        Get the decoded samples
+        :param pid: Integer
+        :param name: String
+        :param syselem: String
+        :return: SampleColumns object
+        """
+        value = self.__trim(self.__value) if self.__value is not None else None
+        return SampleColumns(pid, name, syselem,
+                             time=self.__trim(self.__time), value=value, validity=self.__trim(self.__validity),
+                             type=self.__type)
+
+    """
+    Private Methods
+    """
+    def __trim(self, array):
+        # copy, so that the unused capacity is released
+        return array[:self.__size].copy() if self.__size < len(array) else array
+
+    def __grow(self):
+        self.__capacity = 2 * self.__capacity
+        self.__time = np.resize(self.__time, self.__capacity)
+        self.__validity = np.resize(self.__validity, self.__capacity)
+        self.__value = np.resize(self.__value, self.__capacity)
+
+
+def concat_columns(parts, pid, name, syselem=None):
+    """
+    Join the samples of a parameter kept in several SampleColumns objects
+    :param parts: list of SampleColumns objects, sorted by time and not overlapping
+    :param pid: Integer
+    :param name: String
+    :param syselem: String
+    :return: SampleColumns object
+    :raises ValueError: if the parts have different types
+    """
+    parts = [part for part in parts if len(part) > 0]
+    if not parts:
+        return SampleColumns(pid, name, syselem)
+    types = set(part.get_type() for part in parts)
+    if len(types) > 1:
+        raise ValueError('Samples of PID {} with different types {}'.format(pid, sorted(types)))
+    return SampleColumns(pid, name, syselem,
+                         time=np.concatenate([part.get_time() for part in parts]),
+                         value=np.concatenate([part.get_value() for part in parts]),
+                         validity=np.concatenate([part.get_validity() for part in parts]),
+                         type=parts[0].get_type())
@@ -0,0 +1,101 @@
+import numpy as np
+
+import pyares.param_pb2 as param_pb2
+from pyares.protobuf import VALUE_ACCESSORS
+
+# type codes with numeric values, the only ones a value range applies to
+NUMERIC_TYPES = frozenset(range(1, 12))
+
+
+class SampleFilter:
+    """
+    Selection of the samples applied while the HBase rows are decoded, so the rejected ones
+    never become arrays entries or sample objects: accepted validity codes, accepted type codes,
+    range of the values, and decimation (one of every stride accepted samples).
+    :param validity: iterable of accepted validity codes (e.g. [ParamSample.VALID]), None accepts all
+    :param value_range: tuple (min, max) of accepted values, both included, a None bound is open;
+                        the samples with non numeric values are rejected when it is set
+    :param stride: Integer, keep the first of every stride accepted samples (1 keeps all)
+    :param types: iterable of accepted type codes, None accepts all
+    """
+
+    def __init__(self, validity=None, value_range=None, stride=1, types=None):
+        self.__validity = frozenset(validity) if validity is not None else None
+        self.__value_range = tuple(value_range) if value_range is not None else None
+        self.__stride = max(1, int(stride))
+        self.__types = frozenset(types) if types is not None else None
+
+    @staticmethod
+    def valid_only(value_range=None, stride=1, types=None):
+        """
+        Get a filter accepting only the valid samples
+        """
+        return SampleFilter([param_pb2.ParamSample.VALID], value_range, stride, types)
+
+    def get_validity(self):
+        return self.__validity
+
+    def get_value_range(self):
+        return self.__value_range
+
+    def get_stride(self):
+        return self.__stride
+
+    def get_types(self):
+        return self.__types
+
+    def predicate(self):
+        """
+        Get the function deciding if a decoded sample is kept. It counts the accepted samples
+        for the decimation, so a new one is needed for each parameter (or stream) decoded.
+        :return: function accept(paramsam) -> Bool, paramsam being a parsed ParamSample message
+        """
+        validity = self.__validity
+        types = self.__types
+        value_range = self.__value_range
+        low, high = value_range if value_range is not None else (None, None)
+        stride = self.__stride
+        accepted = [0]
+
+        def accept(paramsam):
+            if validity is not None and paramsam.validity not in validity:
+                return False
+            if types is not None and paramsam.type not in types:
+                return False
+            if value_range is not None:
+                if paramsam.type not in NUMERIC_TYPES:
+                    return False
+                value = VALUE_ACCESSORS[paramsam.type](paramsam)
+                if (low is not None and value < low) or (high is not None and value > high):
+                    return False
+            if stride > 1:
+                count = accepted[0]
+                accepted[0] = count + 1
+                return count % stride == 0
+            return True
+
+        return accept
+
+    def select(self, columns):
+        """
+        Apply the filter to already decoded samples (e.g. the ones served by the sample cache)
+        :param columns: SampleColumns object
+        :return: SampleColumns object with the accepted samples
+        """
+        mask = np.ones(len(columns), dtype=bool)
+        if self.__validity is not None:
+            mask &= np.isin(columns.get_validity(), list(self.__validity))
+        if self.__types is not None and columns.get_type() not in self.__types:
+            mask[:] = False
+        if self.__value_range is not None:
+            if columns.get_type() not in NUMERIC_TYPES:
+                mask[:] = False
+            else:
+                low, high = self.__value_range
+                value = columns.get_value()
+                if low is not None:
+                    mask &= value >= low
+                if high is not None:
+                    mask &= value <= high
+        index = np.flatnonzero(mask)[::self.__stride]
+        return columns.select(index)
@@ -0,0 +1,54 @@
+import heapq
+
+from collections import namedtuple
+
+from pyares.row_key import normalize_time
+
+# Time slice of a parameter read by a single task of a distributed retrieval, with its estimated rows
+ScanUnit = namedtuple('ScanUnit', ['pid', 'name', 'syselem', 'start', 'end', 'rows'])
+
+# Cost of opening a scan, counted as rows when the units are spread over the partitions
+SCAN_COST_ROWS = 1000
+
+
+def split_units(estimates, start, end, max_rows=1000000):
+    """
+    Turn the estimated rows of n parameters into scan units: the period of the parameters with more
+    than max_rows rows is split in equal time slices of about max_rows rows, so a parameter with a
+    high sampling rate is read by several tasks. Parameters without rows in the period are left out.
+    :param estimates: iterable of (pid, param_name, syselem, rows) tuples, see get_row_estimates
+    :param start: Integer start timestamp
+    :param end: Integer end timestamp (not included)
+    :param max_rows: Integer max. estimated rows of a unit
+    :return: list of ScanUnit tuples
+    """
+    start, end = normalize_time(start), normalize_time(end)
+    units = []
+    for pid, param_name, syselem, rows in estimates:
+        if rows <= 0 or end <= start:
+            continue
+        slices = min(-(-rows // max_rows), end - start)
+        length = -(-(end - start) // slices)
+        for slice_start in range(start, end, length):
+            slice_end = min(slice_start + length, end)
+            units.append(ScanUnit(pid, param_name, syselem, slice_start, slice_end,
+                                  rows * (slice_end - slice_start) // (end - start)))
+    return units
+
+
+def pack_partitions(units, partitions):
+    """
+    Spread scan units over a number of partitions balancing their estimated rows: the largest
+    units first, each one to the least loaded partition. The units of a partition are sorted by
+    key, so consecutive slices of a parameter are read one after the other.
+    :param units: list of ScanUnit tuples
+    :param partitions: Integer number of partitions
+    :return: list of lists of ScanUnit tuples, without the empty partitions
+    """
+    loads = [(0, i) for i in range(max(1, min(partitions, len(units))))]
+    packed = [[] for _ in loads]
+    for unit in sorted(units, key=lambda unit: unit.rows, reverse=True):
+        load, i = heapq.heappop(loads)
+        packed[i].append(unit)
+        heapq.heappush(loads, (load + unit.rows + SCAN_COST_ROWS, i))
+    return [sorted(units, key=lambda unit: (unit.pid, unit.start)) for units in packed if units]
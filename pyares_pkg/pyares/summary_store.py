@@ -0,0 +1,132 @@
+import sqlite3
+import threading
+
+import numpy as np
+
+from pyares.bucket_stats import ACCUMULATORS, finish_stats, resolution_to_interval
+
+
+class SummaryStore:
+    """
+    Local store of downsampled parameter samples: for each PID, a pyramid of per-interval
+    accumulators (count, sum, min, max, mean, M2, first/last sample) at several levels
+    (by default 1 minute, 1 hour and 1 day), kept in a sqlite file.
+    The time ranges already summarized are recorded per PID, so a query can be answered
+    from the store only when it is fully covered.
+    :param store_file: String path of the sqlite file
+    :param levels: List with the resolutions of the levels ('1m'/'5m'/'1h'/'1d' or int microseconds)
+    """
+
+    def __init__(self, store_file, levels=('1m', '1h', '1d')):
+        self.__levels = sorted(resolution_to_interval(level) for level in levels)
+        self.__lock = threading.RLock()
+        self.__db = sqlite3.connect(store_file, check_same_thread=False)
+        self.__db.execute("CREATE TABLE IF NOT EXISTS SUMMARY ("
+                          "PID INTEGER NOT NULL, LEVEL INTEGER NOT NULL, INTERVAL_START INTEGER NOT NULL, "
+                          "COUNT INTEGER NOT NULL, SUM REAL, MIN REAL, MAX REAL, MEAN REAL, M2 REAL, "
+                          "FIRST_TS INTEGER, FIRST, LAST_TS INTEGER, LAST, "
+                          "PRIMARY KEY (PID, LEVEL, INTERVAL_START)) WITHOUT ROWID")
+        self.__db.execute("CREATE TABLE IF NOT EXISTS COVERAGE ("
+                          "PID INTEGER NOT NULL, FROM_TS INTEGER NOT NULL, TO_TS INTEGER NOT NULL, "
+                          "PRIMARY KEY (PID, FROM_TS))")
+        self.__db.commit()
+
+    def get_levels(self):
+        return list(self.__levels)
+
+    def get_update_range(self, start, end):
+        """
+        Get the range to summarize so that the buckets of all the levels are complete
+        :param start: Integer timestamp in microseconds
+        :param end: Integer timestamp in microseconds
+        :return: tuple (start, end) extended to the boundaries of the coarsest level
+        """
+        coarsest = self.__levels[-1]
+        return ((start // coarsest) * coarsest, -((-end) // coarsest) * coarsest)
+
+    def put(self, pid, start, end, stats_by_level):
+        """
+        Store the summaries of a parameter for a time range, replacing the ones already stored
+        :param pid: Integer PID
+        :param start: Integer start of the summarized range (see get_update_range)
+        :param end: Integer end of the summarized range (not included)
+        :param stats_by_level: dictionary level interval -> dictionary with the arrays of ACCUMULATORS
+        """
+        with self.__lock:
+            for level, stats in stats_by_level.items():
+                self.__db.execute("DELETE FROM SUMMARY WHERE PID=? AND LEVEL=? AND INTERVAL_START>=? "
+                                  "AND INTERVAL_START<?", (pid, level, start, end))
+                rows = zip(*[stats[name].tolist() for name in ACCUMULATORS])
+                self.__db.executemany("INSERT INTO SUMMARY VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                      [(pid, level) + row for row in rows])
+            self.__add_coverage(pid, start, end)
+            self.__db.commit()
+
+    def select_level(self, pid, start, end, interval):
+        """
+        Get the coarsest level that can answer a query: it covers the range, its interval
+        divides the requested one, and the range starts and ends on its boundaries
+        :param pid: Integer PID
+        :param start: Integer timestamp in microseconds
+        :param end: Integer timestamp in microseconds
+        :param interval: Integer requested interval in microseconds
+        :return: Integer level interval, or None if the query cannot be answered from the store
+        """
+        if not self.covers(pid, start, end):
+            return None
+        for level in reversed(self.__levels):
+            if interval % level == 0 and start % level == 0 and end % level == 0:
+                return level
+        return None
+
+    def get(self, pid, level, start, end):
+        """
+        Get the summaries of a parameter at a level
+        :param pid: Integer PID
+        :param level: Integer level interval
+        :param start: Integer timestamp in microseconds
+        :param end: Integer timestamp in microseconds (not included)
+        :return: dictionary with the arrays of ACCUMULATORS and of STATS, sorted by interval_start
+        """
+        with self.__lock:
+            rows = self.__db.execute("SELECT INTERVAL_START, COUNT, SUM, MIN, MAX, MEAN, M2, "
+                                     "FIRST_TS, FIRST, LAST_TS, LAST FROM SUMMARY "
+                                     "WHERE PID=? AND LEVEL=? AND INTERVAL_START>=? AND INTERVAL_START<? "
+                                     "ORDER BY INTERVAL_START", (pid, level, start, end)).fetchall()
+        columns = list(zip(*rows)) if rows else [()] * len(ACCUMULATORS)
+        # first/last as BucketStats returns them: float64 for the numeric parameters, else object
+        samples = dict(zip(ACCUMULATORS, columns))
+        numeric = all(isinstance(v, (int, float)) for name in ('first', 'last') for v in samples[name]
+                      if v is not None)
+        stats = {}
+        for name, values in zip(ACCUMULATORS, columns):
+            if name in ('interval_start', 'count', 'first_ts', 'last_ts'):
+                stats[name] = np.array(values, dtype=np.int64)
+            elif name in ('first', 'last') and not numeric:
+                stats[name] = np.array(values, dtype=np.object_)
+            else:
+                stats[name] = np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+        return finish_stats(stats)
+
+    def covers(self, pid, start, end):
+        """
+        Check if a time range of a parameter is fully summarized
+        """
+        with self.__lock:
+            row = self.__db.execute("SELECT 1 FROM COVERAGE WHERE PID=? AND FROM_TS<=? AND TO_TS>=?",
+                                    (pid, start, end)).fetchone()
+        return row is not None
+
+    """
+    Private Methods
+    """
+    def __add_coverage(self, pid, start, end):
+        """
+        Record a summarized range, merging it with the overlapping or adjacent ones
+        """
+        rows = self.__db.execute("SELECT FROM_TS, TO_TS FROM COVERAGE WHERE PID=? AND FROM_TS<=? AND TO_TS>=?",
+                                 (pid, end, start)).fetchall()
+        for from_ts, to_ts in rows:
+            start, end = min(start, from_ts), max(end, to_ts)
+        self.__db.execute("DELETE FROM COVERAGE WHERE PID=? AND FROM_TS<=? AND TO_TS>=?", (pid, end, start))
+        self.__db.execute("INSERT INTO COVERAGE VALUES (?, ?, ?)", (pid, start, end))
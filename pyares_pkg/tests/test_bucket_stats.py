@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from pyares.bucket_stats import BucketStats, resolution_to_interval, rollup_stats
+from pyares.sample_columns import SampleColumns
+
+pd = pytest.importorskip('pandas')
+
+
+def make_columns(time, value):
+    return SampleColumns(1, 'P', 'TM', time=time, value=value,
+                         validity=np.zeros(len(time), dtype=np.uint8), type=11)
+
+
+def random_samples(n=5000, seed=0):
+    rng = np.random.default_rng(seed)
+    time = np.sort(rng.integers(0, 10 * 3600000000, n)).astype(np.int64)
+    return (time, rng.normal(10., 3., n))
+
+
+def pandas_stats(time, value, interval):
+    df = pd.DataFrame({'interval_start': (time // interval) * interval, 'time': time, 'value': value})
+    grouped = df.groupby('interval_start')
+    stats = grouped['value'].agg(['count', 'sum', 'min', 'max', 'mean', 'var', 'std'])
+    stats['first_ts'] = grouped['time'].first()
+    stats['first'] = grouped['value'].first()
+    stats['last_ts'] = grouped['time'].last()
+    stats['last'] = grouped['value'].last()
+    return stats
+
+
+def assert_matches(stats, expected):
+    np.testing.assert_array_equal(stats['interval_start'], expected.index.to_numpy())
+    for name in expected.columns:
+        np.testing.assert_allclose(stats[name], expected[name].to_numpy(), rtol=1e-9, err_msg=name)
+
+
+def test_resolution_to_interval():
+    assert resolution_to_interval('1m') == 60000000
+    assert resolution_to_interval('1d') == 86400000000
+    assert resolution_to_interval(60000000) == 60000000
+    with pytest.raises(ValueError):
+        resolution_to_interval('2w')
+    with pytest.raises(ValueError):
+        resolution_to_interval(0)
+
+
+def test_batches_match_pandas():
+    time, value = random_samples()
+    interval = resolution_to_interval('5m')
+    stats = BucketStats(interval)
+    # uneven batches, splitting buckets between them
+    for lo, hi in [(0, 1), (1, 777), (777, 3001), (3001, len(time))]:
+        stats.add(make_columns(time[lo:hi], value[lo:hi]))
+    assert len(stats) == len(np.unique(time // interval))
+    assert_matches(stats.get_stats(), pandas_stats(time, value, interval))
+
+
+def test_rollup_matches_pandas():
+    time, value = random_samples(seed=1)
+    stats = BucketStats(resolution_to_interval('1m'))
+    stats.add(make_columns(time, value))
+    interval = resolution_to_interval('1h')
+    assert_matches(rollup_stats(stats.get_stats(), interval), pandas_stats(time, value, interval))
+
+
+def test_rollup_empty():
+    stats = BucketStats(60000000).get_stats()
+    rolled = rollup_stats(stats, 3600000000)
+    assert len(rolled['interval_start']) == 0
+    assert len(rolled['std']) == 0
+
+
+def test_single_sample_buckets_have_no_variance():
+    stats = BucketStats(10)
+    stats.add(make_columns(np.array([1, 11, 12], dtype=np.int64), np.array([1., 2., 4.])))
+    result = stats.get_stats()
+    assert np.isnan(result['var'][0])
+    assert result['var'][1] == pytest.approx(2.)
@@ -0,0 +1,141 @@
+import numpy as np
+import pytest
+
+import pyares.param_pb2 as param_pb2
+from pyares.database_layer import DatabaseLayer
+from pyares.local_backend import LocalStore, LocalDatabaseLayer, encode_sample
+from pyares.parameter_sample_provider import ParameterSampleProvider
+from pyares.sample_filter import SampleFilter
+
+T0 = 1600000000000000
+STEP = 1000000
+SAMPLES = 600
+
+# name -> (pid, type code)
+PARAMS = {'LBT_DBL_A': (1, 11), 'LBT_DBL_B': (2, 11), 'LBT_SINT': (3, 8), 'LBT_STR': (4, 12), 'LBT_NONE': (6, 11)}
+
+
+def expected_value(name, i):
+    pid, sam_type = PARAMS[name]
+    if sam_type == 12:
+        return 'S%d' % i
+    if sam_type == 8:
+        return pid * 1000 + i
+    return pid * 1000. + i / 4.
+
+
+def expected_validity(i):
+    return param_pb2.ParamSample.INVALID if i % 10 == 0 else param_pb2.ParamSample.VALID
+
+
+@pytest.fixture(scope='module')
+def provider(tmp_path_factory):
+    workdir = tmp_path_factory.mktemp('local_backend')
+    store = LocalStore(str(workdir / 'store.db'))
+    store.put_params([{'PID': pid, 'NAME': name, 'SYSTEM_ELEMENT': 'TM',
+                       'DATACATEGORY_str': param_pb2.Type.Name(sam_type)}
+                      for name, (pid, sam_type) in PARAMS.items()])
+    # LBT_NONE has a definition but no samples, PID 5 has samples but no definition
+    store.put_samples([encode_sample(pid, T0 + i * STEP, sam_type, expected_value(name, i), expected_validity(i))
+                       for name, (pid, sam_type) in PARAMS.items() if name != 'LBT_NONE'
+                       for i in range(SAMPLES)] +
+                      [encode_sample(5, T0 + i * STEP, 11, i) for i in range(SAMPLES)])
+    ini_file = workdir / 'pyares.ini'
+    ini_file.write_text('[PyAres]\njob_dir = {0}\nbackend = local\n\n'
+                        '[HBase]\nhost = localhost\nport = 9090\ndataspace = TEST\n\n'
+                        '[Local]\nstore_file = {0}/store.db\n\n[Cache]\n'.format(workdir))
+    return ParameterSampleProvider(str(ini_file))
+
+
+def check_columns(columns, name, first, last):
+    pid, sam_type = PARAMS[name]
+    assert columns.get_name() == name
+    assert columns.get_pid() == pid
+    assert columns.get_time().tolist() == [T0 + i * STEP for i in range(first, last)]
+    assert columns.get_value().tolist() == [expected_value(name, i) for i in range(first, last)]
+    assert columns.get_validity().tolist() == [expected_validity(i) for i in range(first, last)]
+
+
+def test_arrays_in_period(provider):
+    names = ['LBT_DBL_A', 'LBT_SINT', 'LBT_STR']
+    columns = provider.get_parameter_arrays(names, T0 + 100 * STEP, T0 + 200 * STEP)
+    assert len(columns) == 3
+    for name, cols in zip(names, columns):
+        check_columns(cols, name, 100, 200)
+    assert columns[1].get_value().dtype == np.int64
+
+
+def test_unknown_and_empty_parameters(provider):
+    columns = provider.get_parameter_arrays(['LBT_NONE', 'LBT_MISSING', 'LBT_DBL_B'], T0, T0 + SAMPLES * STEP)
+    assert [len(c) for c in columns] == [0, 0, SAMPLES]
+
+
+@pytest.mark.parametrize('mode', ['serial', 'parallel', 'bulk'])
+def test_scan_modes_agree(provider, mode):
+    names = list(PARAMS)
+    reference = provider.get_parameter_arrays(names, T0 + 5 * STEP, T0 + 505 * STEP)
+    try:
+        if mode == 'parallel':
+            provider.set_parallel_scans(3)
+        elif mode == 'bulk':
+            provider.set_bulk_scans(skip_after=None)
+        columns = provider.get_parameter_arrays(names, T0 + 5 * STEP, T0 + 505 * STEP)
+    finally:
+        provider.set_serial_scans()
+        provider.set_single_scans()
+    for ref, cols in zip(reference, columns):
+        assert cols.get_name() == ref.get_name()
+        assert cols.get_time().tolist() == ref.get_time().tolist()
+        assert cols.get_value().tolist() == ref.get_value().tolist()
+
+
+def test_sample_objects(provider):
+    samples = provider.get_parameter_data_objs(['LBT_DBL_A', 'LBT_STR'], T0, T0 + 3 * STEP)
+    assert isinstance(samples, list)
+    first, second = [list(s) for s in samples]
+    assert [s.get_value() for s in first] == [expected_value('LBT_DBL_A', i) for i in range(3)]
+    assert [s.get_value() for s in second] == ['S0', 'S1', 'S2']
+    assert {(s.get_name(), s.get_syselem()) for s in first} == {('LBT_DBL_A', 'TM')}
+
+
+def test_sample_filter(provider):
+    columns, = provider.get_parameter_arrays(['LBT_DBL_A'], T0, T0 + 100 * STEP,
+                                             sample_filter=SampleFilter.valid_only(stride=3))
+    valid = [i for i in range(100) if expected_validity(i) == param_pb2.ParamSample.VALID][::3]
+    assert columns.get_time().tolist() == [T0 + i * STEP for i in valid]
+
+
+def test_stream_matches_arrays(provider):
+    stream = provider.get_parameter_stream('LBT_DBL_B', T0, T0 + SAMPLES * STEP,
+                                           slice_length=77 * STEP, batch_size=50)
+    batches = list(stream)
+    assert max(len(batch) for batch in batches) <= 50
+    assert np.concatenate([batch.get_time() for batch in batches]).tolist() == \
+        [T0 + i * STEP for i in range(SAMPLES)]
+
+
+def test_stats(provider):
+    stats = provider.get_parameter_stats(['LBT_DBL_A'], T0, T0 + SAMPLES * STEP, resolution='1m')
+    times = T0 + np.arange(SAMPLES) * STEP
+    values = np.array([expected_value('LBT_DBL_A', i) for i in range(SAMPLES)])
+    buckets = times // 60000000
+    assert stats.filter(like='count').to_numpy().sum() == SAMPLES
+    np.testing.assert_allclose(stats.filter(like='mean').to_numpy().ravel(),
+                               [values[buckets == b].mean() for b in np.unique(buckets)])
+
+
+def test_expand_patterns(provider):
+    names, syselems = provider.expand_parameter_names(['LBT_DBL_*'])
+    assert names == ['LBT_DBL_A', 'LBT_DBL_B']
+    assert syselems == ['TM', 'TM']
+
+
+def test_param_ids(tmp_path):
+    store = LocalStore(str(tmp_path / 'store.db'))
+    store.put_params([{'PID': 1, 'NAME': 'P1', 'SYSTEM_ELEMENT': 'TM', 'DATACATEGORY_str': 'DOUBLE'},
+                      {'PID': 2, 'NAME': 'P1', 'SYSTEM_ELEMENT': 'TC', 'DATACATEGORY_str': 'DOUBLE'},
+                      {'PID': 3, 'NAME': 'P3', 'SYSTEM_ELEMENT': 'TM', 'DATACATEGORY_str': 'DOUBLE'}])
+    dblayer = LocalDatabaseLayer(store)
+    assert isinstance(dblayer, DatabaseLayer)
+    assert dblayer.get_param_ids([('P1', 'TC'), ('P1', None), ('P3', 'TC'), ('P9', None)]) == \
+        {('P1', 'TC'): 2, ('P1', None): 1}
@@ -0,0 +1,76 @@
+from pyares.metadata_cache import MetadataCache
+
+
+class FakeDBLayer:
+    def __init__(self, metadata):
+        self.metadata = metadata
+
+    def get_metadata(self):
+        return self.metadata
+
+
+def test_lru_eviction_cleans_both_maps():
+    cache = MetadataCache(max_entries=3)
+    for pid in range(10):
+        cache.put(pid, 'P%d' % pid, 'TM')
+    assert len(cache) == 3
+    assert cache.get('P1', 'TM') is None
+    assert cache.get_by_pid(1, 'TM') is None
+    assert cache.get('P9', 'TM')['PID'] == 9
+    assert cache.get_by_pid(9, 'TM')['NAME'] == 'P9'
+    assert len(cache._MetadataCache__by_pid) <= 2 * len(cache)
+
+
+def test_lookup_refreshes_lru_order():
+    cache = MetadataCache(max_entries=2)
+    cache.put(1, 'A', 'TM')
+    cache.put(2, 'B', 'TM')
+    cache.get('A', 'TM')
+    cache.put(3, 'C', 'TM')
+    assert cache.get('A', 'TM') is not None
+    assert cache.get('B', 'TM') is None
+
+
+def test_stale_entries_are_dropped():
+    cache = MetadataCache(ttl=-1)
+    cache.put(1, 'A', 'TM')
+    assert cache.get('A', 'TM') is None
+    assert len(cache) == 0
+
+
+def test_bare_name_needs_preload():
+    cache = MetadataCache()
+    cache.put(5, 'A', 'TC')
+    assert cache.get('A') is None
+    cache.preload(FakeDBLayer([{'PID': 5, 'NAME': 'A', 'SYSTEM_ELEMENT': 'TC'},
+                               {'PID': 2, 'NAME': 'A', 'SYSTEM_ELEMENT': 'TM'}]))
+    assert cache.get('A')['PID'] == 2
+    assert len(cache) == 2
+
+
+def test_disk_tier_is_shared(tmp_path):
+    cache_file = str(tmp_path / 'meta.db')
+    MetadataCache(cache_file=cache_file).put(7, 'X', 'TM', 'DOUBLE')
+    other = MetadataCache(cache_file=cache_file)
+    assert other.get('X', 'TM') == {'PID': 7, 'NAME': 'X', 'SYSTEM_ELEMENT': 'TM', 'DATA_TYPE': 'DOUBLE'}
+    assert other.get_by_pid(7)['NAME'] == 'X'
+
+
+def test_clear():
+    cache = MetadataCache()
+    cache.put(1, 'A', 'TM')
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.get('A', 'TM') is None
+
+
+def test_lookup_after_preload_keeps_data_type(tmp_path):
+    cache = MetadataCache(cache_file=str(tmp_path / 'meta.db'))
+    cache.preload(FakeDBLayer([{'PID': 3, 'NAME': 'T', 'SYSTEM_ELEMENT': 'TM', 'DATACATEGORY_str': 'DOUBLE'}]))
+    # as stored by the provider after resolving a name, without data type
+    cache.put_many([{'PID': 3, 'NAME': 'T', 'SYSTEM_ELEMENT': 'TM'}])
+    assert cache.get('T', 'TM')['DATA_TYPE'] == 'DOUBLE'
+    assert MetadataCache(cache_file=str(tmp_path / 'meta.db')).get('T', 'TM')['DATA_TYPE'] == 'DOUBLE'
+    # a new PID for the name does not inherit the old data type
+    cache.put(4, 'T', 'TM')
+    assert cache.get('T', 'TM')['DATA_TYPE'] is None
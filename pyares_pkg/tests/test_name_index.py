@@ -0,0 +1,76 @@
+import fnmatch
+import random
+import re
+
+import pytest
+
+from pyares.name_index import ParameterNameIndex, is_name_pattern
+
+PREFIXES = ['AOCS_', 'AOCS_GYRO_', 'PWR_', 'THM_', 'TTC_', 'A', 'AB']
+
+
+def make_records(n=2000, seed=0):
+    rng = random.Random(seed)
+    records = []
+    for pid in range(1, n + 1):
+        name = rng.choice(PREFIXES) + ''.join(rng.choice('ABCXYZ0123_') for _ in range(rng.randint(0, 8)))
+        records.append({'PID': pid, 'NAME': name, 'SYSTEM_ELEMENT': rng.choice(['TM', 'TC'])})
+    return records
+
+
+@pytest.fixture(scope='module')
+def records():
+    return make_records()
+
+
+@pytest.fixture(scope='module')
+def index(records):
+    return ParameterNameIndex(records)
+
+
+def brute_force(records, accept, syselem=None):
+    return sorted((r['NAME'], r['SYSTEM_ELEMENT'], r['PID']) for r in records
+                  if accept(r['NAME']) and (syselem is None or r['SYSTEM_ELEMENT'] == syselem))
+
+
+def as_tuples(found):
+    return sorted((r['NAME'], r['SYSTEM_ELEMENT'], r['PID']) for r in found)
+
+
+def test_is_name_pattern():
+    assert is_name_pattern('AOCS_*')
+    assert is_name_pattern('re:^AOCS')
+    assert is_name_pattern('PWR_[AB]1')
+    assert not is_name_pattern('AOCS_GYRO_X')
+
+
+@pytest.mark.parametrize('pattern', ['AOCS_*', 'AOCS_GYRO_*', '*_X*', 'A?C*', '*Z1?', 'PWR_[AB]*',
+                                     'THM_[!X]*', '*', 'A*_*3', 'TTC_', 'AB*B'])
+@pytest.mark.parametrize('syselem', [None, 'TC'])
+def test_glob_matches_fnmatch(records, index, pattern, syselem):
+    assert as_tuples(index.find_glob(pattern, syselem)) == \
+        brute_force(records, lambda name: fnmatch.fnmatchcase(name, pattern), syselem)
+
+
+@pytest.mark.parametrize('pattern', ['[]a]*', '[!]]*', '[!]]XYZ*', '*[]]XYZ*', 'a[]]*'])
+def test_glob_bracket_classes(pattern):
+    # a ']' right after '[' or '[!' is part of the class, as in fnmatch
+    records = [{'PID': pid, 'NAME': name, 'SYSTEM_ELEMENT': 'TM'}
+               for pid, name in enumerate([']XYZ1', 'aXYZ2', 'b]XYZ3', 'BXYZ4', 'a]XYZ5', ']]ABC'], 1)]
+    assert as_tuples(ParameterNameIndex(records).find_glob(pattern)) == \
+        brute_force(records, lambda name: fnmatch.fnmatchcase(name, pattern))
+
+
+@pytest.mark.parametrize('pattern', ['^AOCS_GYRO', 'XYZ', '^(PWR|THM)_A', '1$', 'C?X', '^A[B_]',
+                                     'Z{2}', '^TTC_(AB|XY)?0', '(?i)^pwr_', '_ZZ|^AB1', '.'])
+def test_regex_matches_search(records, index, pattern):
+    regex = re.compile(pattern)
+    assert as_tuples(index.find_regex(pattern)) == brute_force(records, lambda name: regex.search(name))
+    assert as_tuples(index.find('re:' + pattern)) == as_tuples(index.find_regex(pattern))
+
+
+def test_prefix_and_plain_names(records, index):
+    assert as_tuples(index.find_prefix('AOCS_')) == brute_force(records, lambda name: name.startswith('AOCS_'))
+    name = records[10]['NAME']
+    assert as_tuples(index.find(name)) == brute_force(records, lambda other: other == name)
+    assert index.find('NOT_A_PARAMETER') == []
@@ -0,0 +1,53 @@
+import random
+
+import pytest
+
+from pyares.row_key import (MAX_PID, ROW_KEY_SIZE, decode_row_key, decode_row_key_pid, encode_row_key,
+                            in_window, normalize_time, plan_scan_ranges)
+
+
+def test_normalize_time():
+    for timestamp in (1600000000, 1600000000123, 1600000000123456, 1, 99):
+        assert normalize_time(timestamp) == int(str(timestamp).ljust(16, '0'))
+    assert normalize_time(0) == 0
+
+
+def test_round_trip():
+    for pid, timestamp in [(0, 0), (1, 1600000000000000), (MAX_PID, 2 ** 63 - 1), (65536, 42)]:
+        key = encode_row_key(pid, timestamp)
+        assert len(key) == ROW_KEY_SIZE
+        assert decode_row_key(key) == (pid, timestamp)
+        assert decode_row_key_pid(key) == pid
+
+
+@pytest.mark.parametrize('pid', [-1, MAX_PID + 1, 1 << 32])
+def test_pid_out_of_range(pid):
+    with pytest.raises(ValueError):
+        encode_row_key(pid, 1600000000000000)
+
+
+def test_keys_sort_by_pid_then_time():
+    rng = random.Random(0)
+    pairs = [(rng.randrange(1 << 20), rng.randrange(1 << 60)) for _ in range(500)]
+    assert sorted(pairs) == [decode_row_key(k) for k in sorted(encode_row_key(*p) for p in pairs)]
+
+
+def test_plan_merges_consecutive_pids():
+    start, end = 1600000000000000, 1600000100000000
+    ranges = plan_scan_ranges([7, 3, 4, None, 5, 9, 4], start, end)
+    assert [(r.first_pid, r.last_pid) for r in ranges] == [(3, 5), (7, 7), (9, 9)]
+    assert ranges[0].start_key == encode_row_key(3, start)
+    assert ranges[0].end_key == encode_row_key(5, end)
+    assert [r.start_key for r in ranges] == sorted(r.start_key for r in ranges)
+
+
+def test_plan_max_pids():
+    ranges = plan_scan_ranges(range(1, 8), 1600000000, 1600000100, max_pids=3)
+    assert [(r.first_pid, r.last_pid) for r in ranges] == [(1, 3), (4, 6), (7, 7)]
+    # the times are normalized to 16 digits
+    assert decode_row_key(ranges[0].start_key) == (1, 1600000000000000)
+
+
+@pytest.mark.parametrize('timestamp,inside', [(99, False), (100, True), (199, True), (200, False)])
+def test_in_window(timestamp, inside):
+    assert in_window(encode_row_key(12, timestamp), 100, 200) == inside
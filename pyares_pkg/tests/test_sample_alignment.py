@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from pyares.sample_alignment import align_columns, merge_times
+from pyares.sample_columns import SampleColumns
+
+
+def make_columns(name, time, value, syselem='TM'):
+    value = np.asarray(value)
+    return SampleColumns(1, name, syselem, time=np.asarray(time, dtype=np.int64), value=value,
+                         validity=np.zeros(len(value), dtype=np.uint8), type=11)
+
+
+def test_merge_times():
+    merged = merge_times([np.array([1, 3, 5]), np.array([], dtype=np.int64), np.array([2, 3, 6])])
+    assert merged.tolist() == [1, 2, 3, 5, 6]
+    assert merge_times([]).dtype == np.int64
+
+
+def test_exact_leaves_missing_values():
+    index, aligned = align_columns([make_columns('a', [1, 3], [1., 3.]),
+                                    make_columns('b', [2, 3], [20, 30])])
+    assert index.tolist() == [1, 2, 3]
+    np.testing.assert_array_equal(aligned['a'], [1., np.nan, 3.])
+    # integer columns with gaps become float
+    np.testing.assert_array_equal(aligned['b'], [np.nan, 20., 30.])
+
+
+def test_ffill_and_bfill():
+    columns = [make_columns('a', [1, 3], [1., 3.]), make_columns('b', [2, 4], [20., 40.])]
+    index, aligned = align_columns(columns, how='ffill')
+    assert index.tolist() == [1, 2, 3, 4]
+    np.testing.assert_array_equal(aligned['a'], [1., 1., 3., 3.])
+    np.testing.assert_array_equal(aligned['b'], [np.nan, 20., 20., 40.])
+    _, aligned = align_columns(columns, how='ffill', bfill=True)
+    np.testing.assert_array_equal(aligned['b'], [20., 20., 20., 40.])
+
+
+def test_grid_takes_last_sample_at_or_before():
+    index, aligned = align_columns([make_columns('a', [0, 5, 12], [0., 5., 12.])],
+                                   how='grid', step=4, start=0, end=12)
+    assert index.tolist() == [0, 4, 8, 12]
+    np.testing.assert_array_equal(aligned['a'], [0., 0., 5., 12.])
+    with pytest.raises(ValueError):
+        align_columns([make_columns('a', [0], [0.])], how='grid')
+
+
+def test_same_name_is_merged_keeping_last_sample():
+    index, aligned = align_columns([make_columns('a', [1, 2], [1., 2.], 'TM'),
+                                    make_columns('a', [2, 3], [22., 3.], 'TC')])
+    assert index.tolist() == [1, 2, 3]
+    np.testing.assert_array_equal(aligned['a'], [1., 22., 3.])
+
+
+def test_matches_pandas_asof():
+    pd = pytest.importorskip('pandas')
+    rng = np.random.default_rng(0)
+    times = [np.unique(rng.integers(0, 1000, 200)) for _ in range(3)]
+    columns = [make_columns('p%d' % i, t, rng.normal(size=len(t))) for i, t in enumerate(times)]
+    index, aligned = align_columns(columns, how='ffill')
+    expected = pd.concat([pd.Series(c.get_value(), index=c.get_time(), name=c.get_name()) for c in columns],
+                         axis=1).sort_index().ffill()
+    assert index.tolist() == expected.index.tolist()
+    for name in aligned:
+        np.testing.assert_array_equal(aligned[name], expected[name].to_numpy())
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        align_columns([], how='nearest')
@@ -0,0 +1,85 @@
+import numpy as np
+
+from pyares.sample_cache import SampleCache
+from pyares.sample_columns import SampleColumns
+
+
+def make_columns(times, offset=0.):
+    times = np.asarray(times, dtype=np.int64)
+    return SampleColumns(1, 'P', 'TM', time=times, value=times.astype(np.float64) + offset,
+                         validity=np.zeros(len(times), dtype=np.uint8), type=11)
+
+
+def window(start, end, step=10, offset=0.):
+    return make_columns(np.arange(start, end, step), offset)
+
+
+def cached_times(cache, start, end):
+    parts, gaps = cache.lookup(1, start, end)
+    return ([t for _, columns in parts for t in columns.get_time().tolist()], gaps)
+
+
+def test_lookup_reports_gaps():
+    cache = SampleCache()
+    cache.put(1, 100, 200, window(100, 200))
+    cache.put(1, 300, 400, window(300, 400))
+    times, gaps = cached_times(cache, 50, 450)
+    assert times == list(range(100, 200, 10)) + list(range(300, 400, 10))
+    assert gaps == [(50, 100), (200, 300), (400, 450)]
+    assert cache.lookup(2, 0, 10) == ([], [(0, 10)])
+
+
+def test_overlapping_and_adjacent_ranges_are_merged():
+    cache = SampleCache()
+    cache.put(1, 100, 200, window(100, 200))
+    cache.put(1, 300, 400, window(300, 400))
+    cache.put(1, 200, 300, window(200, 300))
+    assert cache.get_ranges(1) == [(100, 400)]
+    assert len(cache) == 1
+    cache.put(1, 350, 500, window(350, 500))
+    assert cache.get_ranges(1) == [(100, 500)]
+    times, gaps = cached_times(cache, 100, 500)
+    assert times == list(range(100, 500, 10))
+    assert gaps == []
+
+
+def test_new_samples_replace_cached_ones():
+    cache = SampleCache()
+    cache.put(1, 0, 100, window(0, 100))
+    cache.put(1, 40, 60, window(40, 60, offset=0.5))
+    parts, gaps = cache.lookup(1, 0, 100)
+    columns, = [c for _, c in parts]
+    assert columns.get_time().tolist() == list(range(0, 100, 10))
+    assert columns.get_value()[4:6].tolist() == [40.5, 50.5]
+    assert columns.get_value()[6] == 60.
+
+
+def test_invalidate():
+    cache = SampleCache()
+    cache.put(1, 0, 100, window(0, 100))
+    cache.invalidate(1)
+    assert cache.get_ranges(1) == []
+    assert cache.get_bytes()[0] == 0
+
+
+def test_eviction_and_spill(tmp_path):
+    one_range = SampleCache()
+    one_range.put(1, 0, 1000, window(0, 1000))
+    max_bytes = one_range.get_bytes()[0] * 3 // 2
+
+    cache = SampleCache(max_bytes=max_bytes)
+    cache.put(1, 0, 1000, window(0, 1000))
+    cache.put(1, 2000, 3000, window(2000, 3000))
+    assert cache.get_ranges(1) == [(2000, 3000)]
+
+    spill_dir = str(tmp_path / 'spill')
+    cache = SampleCache(max_bytes=max_bytes, spill_dir=spill_dir)
+    cache.put(1, 0, 1000, window(0, 1000))
+    cache.put(1, 2000, 3000, window(2000, 3000))
+    assert cache.get_ranges(1) == [(0, 1000), (2000, 3000)]
+    assert cache.get_bytes()[1] > 0
+    cache.flush()
+    reopened = SampleCache(max_bytes=max_bytes, spill_dir=spill_dir)
+    times, gaps = cached_times(reopened, 0, 3000)
+    assert times == list(range(0, 1000, 10)) + list(range(2000, 3000, 10))
+    assert gaps == [(1000, 2000)]
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+import pyares.param_pb2 as param_pb2
+from pyares.local_backend import encode_sample
+from pyares.sample_columns import SampleColumnsBuilder
+from pyares.sample_filter import SampleFilter
+
+VALID = param_pb2.ParamSample.VALID
+INVALID = param_pb2.ParamSample.INVALID
+
+
+def make_buffers(n=300, sam_type=11, seed=0):
+    rng = np.random.default_rng(seed)
+    values = rng.integers(-50, 50, n)
+    validity = rng.choice([VALID, VALID, INVALID], n)
+    if sam_type == 12:
+        return [encode_sample(7, 1600000000000000 + i, sam_type, 'S%d' % i, validity[i])[1] for i in range(n)]
+    return [encode_sample(7, 1600000000000000 + i, sam_type, values[i], validity[i])[1] for i in range(n)]
+
+
+def decode(buffers, predicate=None):
+    builder = SampleColumnsBuilder(predicate=predicate)
+    for buffer in buffers:
+        builder.add_buffer(buffer)
+    return builder.build(7, 'P', 'TM')
+
+
+FILTERS = [SampleFilter(),
+           SampleFilter.valid_only(),
+           SampleFilter(value_range=(-10, 20)),
+           SampleFilter(value_range=(None, 0)),
+           SampleFilter(stride=4),
+           SampleFilter.valid_only(value_range=(0, None), stride=3),
+           SampleFilter(types=[8]),
+           SampleFilter(types=[11], validity=[INVALID])]
+
+
+@pytest.mark.parametrize('sample_filter', FILTERS)
+@pytest.mark.parametrize('sam_type', [8, 11, 12])
+def test_predicate_matches_select(sample_filter, sam_type):
+    buffers = make_buffers(sam_type=sam_type)
+    decoded = decode(buffers, sample_filter.predicate())
+    selected = sample_filter.select(decode(buffers))
+    assert decoded.get_time().tolist() == selected.get_time().tolist()
+    assert decoded.get_value().tolist() == selected.get_value().tolist()
+
+
+def test_valid_only():
+    columns = SampleFilter.valid_only().select(decode(make_buffers()))
+    assert len(columns) > 0
+    assert set(columns.get_validity().tolist()) == {VALID}
+
+
+def test_value_range_rejects_non_numeric():
+    assert len(SampleFilter(value_range=(None, None)).select(decode(make_buffers(sam_type=12)))) == 0
+
+
+def test_stride_counts_accepted_samples():
+    columns = decode(make_buffers())
+    sample_filter = SampleFilter.valid_only(stride=2)
+    valid_times = columns.get_time()[columns.get_validity() == VALID]
+    assert sample_filter.select(columns).get_time().tolist() == valid_times[::2].tolist()
+
+
+def test_each_predicate_has_its_own_count():
+    sample_filter = SampleFilter(stride=3)
+    buffers = make_buffers(n=10)
+    assert len(decode(buffers, sample_filter.predicate())) == 4
+    assert len(decode(buffers, sample_filter.predicate())) == 4
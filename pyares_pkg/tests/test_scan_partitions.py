@@ -0,0 +1,52 @@
+import random
+
+from pyares.scan_partitions import SCAN_COST_ROWS, ScanUnit, pack_partitions, split_units
+
+START = 1600000000000000
+END = START + 3600000000
+
+
+def test_small_parameters_are_single_units():
+    units = split_units([(1, 'A', 'TM', 10), (2, 'B', 'TM', 0), (3, 'C', 'TM', 999)], START, END, max_rows=1000)
+    assert units == [ScanUnit(1, 'A', 'TM', START, END, 10), ScanUnit(3, 'C', 'TM', START, END, 999)]
+
+
+def test_large_parameters_are_split_in_slices():
+    units = split_units([(1, 'A', 'TM', 10500)], START, END, max_rows=1000)
+    assert len(units) == 11
+    # the slices cover the period without gaps or overlaps
+    assert units[0].start == START
+    assert units[-1].end == END
+    assert all(a.end == b.start for a, b in zip(units, units[1:]))
+    assert all(unit.rows <= 1000 for unit in units)
+    assert abs(sum(unit.rows for unit in units) - 10500) <= len(units)
+
+
+def test_times_are_normalized():
+    units = split_units([(1, 'A', 'TM', 5)], START // 1000, END // 1000)
+    assert (units[0].start, units[0].end) == (START, END)
+
+
+def test_empty_period():
+    assert split_units([(1, 'A', 'TM', 5)], END, START) == []
+
+
+def test_packing_balances_rows():
+    rng = random.Random(0)
+    estimates = [(pid, 'P%d' % pid, 'TM', rng.randint(1, 200000)) for pid in range(1, 300)]
+    units = split_units(estimates, START, END, max_rows=50000)
+    partitions = pack_partitions(units, 16)
+    assert len(partitions) == 16
+    assert sorted(u for part in partitions for u in part) == sorted(units)
+    loads = [sum(u.rows + SCAN_COST_ROWS for u in part) for part in partitions]
+    # greedy largest-first: no partition exceeds the average by more than the largest unit
+    assert max(loads) - sum(loads) / len(loads) <= max(u.rows for u in units) + SCAN_COST_ROWS
+    for part in partitions:
+        assert part == sorted(part, key=lambda u: (u.pid, u.start))
+
+
+def test_packing_fewer_units_than_partitions():
+    units = split_units([(1, 'A', 'TM', 10), (2, 'B', 'TM', 20)], START, END)
+    partitions = pack_partitions(units, 8)
+    assert len(partitions) == 2
+    assert pack_partitions([], 4) == []
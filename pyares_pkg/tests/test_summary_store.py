@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from pyares.bucket_stats import BucketStats, resolution_to_interval
+from pyares.sample_columns import SampleColumns
+from pyares.summary_store import SummaryStore
+
+MINUTE = resolution_to_interval('1m')
+HOUR = resolution_to_interval('1h')
+
+
+def make_columns(time, value):
+    return SampleColumns(1, 'P', 'TM', time=time, value=value,
+                         validity=np.zeros(len(time), dtype=np.uint8), type=11)
+
+
+@pytest.mark.parametrize('value', [np.arange(600, dtype=np.int64) - 300,
+                                   np.linspace(-5., 5., 600),
+                                   np.array(['S%d' % i for i in range(600)], dtype=object)])
+def test_stored_matches_computed(tmp_path, value):
+    time = np.arange(600, dtype=np.int64) * 7000000
+    computed = BucketStats(MINUTE)
+    computed.add(make_columns(time, value))
+    expected = computed.get_stats()
+
+    store = SummaryStore(str(tmp_path / 'summary.db'), levels=('1m', '1h'))
+    start, end = store.get_update_range(int(time[0]), int(time[-1]) + 1)
+    store.put(1, start, end, {MINUTE: expected})
+    stored = store.get(1, MINUTE, start, end)
+
+    assert sorted(stored) == sorted(expected)
+    for name in expected:
+        assert stored[name].dtype == expected[name].dtype, name
+        np.testing.assert_array_equal(stored[name], expected[name], err_msg=name)
+
+
+def test_empty_range(tmp_path):
+    store = SummaryStore(str(tmp_path / 'summary.db'))
+    stored = store.get(1, MINUTE, 0, HOUR)
+    expected = BucketStats(MINUTE).get_stats()
+    for name in expected:
+        assert stored[name].dtype == expected[name].dtype, name
+        assert len(stored[name]) == 0